@@ -0,0 +1,37 @@
+# 运行全部(或指定的)基准, 结果可以写入json, 再用 python -m benchmarks.compare 比较两次提交
+# 运行: python -m benchmarks [text prompt ...] [--quick] [--json results.json]
+import importlib
+from benchmarks.common import parser, write_results
+
+# 名称 -> 模块, 按耗时从短到长
+BENCHMARKS = {
+    "text": "benchmarks.bench_text",
+    "prompt": "benchmarks.bench_prompt",
+    "result": "benchmarks.bench_result",
+    "deck": "benchmarks.bench_deck",
+    "draw": "benchmarks.bench_draw",
+    "render": "benchmarks.bench_render",
+    "select": "benchmarks.bench_select",
+    "readings": "benchmarks.bench_readings",
+    "pool": "benchmarks.bench_pool",
+    "policy": "benchmarks.bench_policy",
+    "session": "benchmarks.bench_session",
+    "startup": "benchmarks.bench_startup",
+}
+
+def main():
+    argument_parser = parser("运行基准测试")
+    argument_parser.add_argument("names", nargs="*", help=f"要运行的基准, 默认全部: {' '.join(BENCHMARKS)}")
+    args = argument_parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            argument_parser.error(f"unknown benchmark {name!r}, choose from {', '.join(BENCHMARKS)}")
+
+    results = {}
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        results[name] = importlib.import_module(BENCHMARKS[name]).main(args.quick)
+    write_results(args.json, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# 牌组加载的基准: 解析JSON并构建索引 vs 读取预编译缓存, 以及异步重新加载时事件循环的最长停顿
+# 运行: python -m benchmarks.bench_deck [--json results.json]
+import os, json, time, asyncio, tempfile, statistics
+from tarot_config import TAROT_DATA_PATH
+from tarot_deck import DeckStore
+from benchmarks.common import parser, write_results
+
+# 优化前的加载方式: 只用json.load解析源文件
+def plain_json(number: int) -> float:
+    times = []
+    for _ in range(number):
+        start = time.perf_counter()
+        with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
+            json.load(file)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def measure(store: DeckStore, number: int) -> float:
+    return statistics.median(store.load().load_time for _ in range(number))
+
+async def loop_stall(store: DeckStore, number: int) -> float:
+    worst = 0.0
+    for _ in range(number):
+        reload = asyncio.ensure_future(store.reload_async())
+        last = time.perf_counter()
+        while not reload.done():
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            worst = max(worst, now - last)
+            last = now
+    return worst
+
+def main(quick: bool = False) -> dict:
+    number = 5 if quick else 20
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "tarot.cache")
+
+        plain_time = plain_json(number)
+        json_time = measure(DeckStore(TAROT_DATA_PATH, None), number)
+        store = DeckStore(TAROT_DATA_PATH, cache_path)
+        first = store.load()
+        cache_time = measure(store, number)
+
+        print(f"plain json.load     {plain_time * 1e3:7.2f} ms")
+        print(f"json + index build  {json_time * 1e3:7.2f} ms")
+        print(f"first load (writes cache) {first.load_time * 1e3:7.2f} ms")
+        print(f"precompiled cache   {cache_time * 1e3:7.2f} ms  ({json_time / cache_time:.1f}x, {plain_time / cache_time:.1f}x vs plain json.load)")
+        stall = asyncio.run(loop_stall(store, number))
+        print(f"reload_async max event loop stall {stall * 1e3:7.2f} ms")
+
+    return {"plain_json_ms": plain_time * 1e3, "json_load_ms": json_time * 1e3, "first_load_ms": first.load_time * 1e3, "cache_load_ms": cache_time * 1e3, "reload_stall_ms": stall * 1e3}
+
+if __name__ == "__main__":
+    args = parser("牌组加载的耗时").parse_args()
+    write_results(args.json, {"deck": main(args.quick)})
@@ -0,0 +1,77 @@
+# 牌面变换与牌阵绘制的基准: 旧版全分辨率两次旋转再缩放 vs 合并的仿射变换
+# 两者都不使用牌面缓存(只缓存解码后的原图), 测的是缓存未命中时的开销
+# 运行: python -m benchmarks.bench_draw [--json results.json]
+import json, math, time, random
+from PIL import Image, ImageChops, ImageStat
+from tarot import TarotDraw
+from tarot_assets import AssetCache
+from tarot_config import TAROT_DATA_PATH, RESOURCES_PATH
+from benchmarks.common import parser, write_results
+
+# 旧版_process_card中的变换
+def legacy_transform(card_img: Image, rotate: float, scale: float, is_reversed: bool) -> Image:
+    if is_reversed:
+        card_img = card_img.rotate(180, expand=True, resample=Image.Resampling.BICUBIC)
+    if not math.isclose(rotate, 0.0):
+        card_img = card_img.rotate(rotate, expand=True, resample=Image.Resampling.BICUBIC)
+    if not math.isclose(scale, 1.0):
+        new_size = (int(card_img.width * scale), int(card_img.height * scale))
+        resample = Image.Resampling.LANCZOS if scale < 1.0 else Image.Resampling.BICUBIC
+        card_img = card_img.resize(new_size, resample=resample)
+    return card_img
+
+def render(transform, wallpaper: Image, sprites: list) -> Image:
+    base_img = wallpaper.copy()
+    for card_img, args in (transform(*sprite) for sprite in sprites):
+        position = (int(args["position"][0] - card_img.width / 2), int(args["position"][1] - card_img.height / 2))
+        base_img.alpha_composite(card_img, dest=position)
+    return base_img
+
+def main(quick: bool = False, seed: int = 0) -> dict:
+    with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
+        spreads = json.load(file)["spreads"]
+
+    rng = random.Random(seed)
+    cache = AssetCache()
+    card_dir = f"{RESOURCES_PATH}/cards"
+    wallpaper = TarotDraw._load_image(f"{RESOURCES_PATH}/wallpaper.png", cache)
+    for card_id in range(78):
+        TarotDraw._load_image(f"{card_dir}/{card_id}.jpg", cache)
+
+    def legacy(card_path, args, is_reversed):
+        return legacy_transform(TarotDraw._load_image(card_path, cache), args["rotate"], args["scale"], is_reversed), args
+
+    def affine(card_path, args, is_reversed):
+        return TarotDraw._transform_card(card_path, args["rotate"], args["scale"], is_reversed, cache), args
+
+    totals = {"legacy": 0.0, "affine": 0.0}
+    cards = 0
+    diff = 0.0
+    rows = []
+    for spread_key, spread in spreads.items():
+        sprites = [(f"{card_dir}/{rng.randrange(78)}.jpg", args, rng.choice([True, False])) for args in spread["draw"]]
+        cards += len(sprites)
+
+        times = {}
+        images = {}
+        for name, transform in (("legacy", legacy), ("affine", affine)):
+            start = time.perf_counter()
+            images[name] = render(transform, wallpaper, sprites)
+            times[name] = time.perf_counter() - start
+            totals[name] += times[name]
+
+        diff += sum(ImageStat.Stat(ImageChops.difference(images["legacy"], images["affine"])).mean[:3]) / 3
+        rows.append((spread_key, len(sprites), times["legacy"], times["affine"]))
+
+    for spread_key, count, legacy_time, affine_time in sorted(rows, key=lambda row: row[1]):
+        print(f"{spread_key:32s} {count:3d} cards  legacy {legacy_time * 1e3:7.2f} ms  affine {affine_time * 1e3:7.2f} ms")
+
+    print(f"per card    legacy {totals['legacy'] / cards * 1e3:6.2f} ms  affine {totals['affine'] / cards * 1e3:6.2f} ms  ({totals['legacy'] / totals['affine']:.1f}x)")
+    print(f"per spread  legacy {totals['legacy'] / len(spreads) * 1e3:6.2f} ms  affine {totals['affine'] / len(spreads) * 1e3:6.2f} ms")
+    print(f"mean abs pixel difference {diff / len(spreads):.2f} / 255")
+
+    return {"legacy_per_card_ms": totals["legacy"] / cards * 1e3, "affine_per_card_ms": totals["affine"] / cards * 1e3, "legacy_per_spread_ms": totals["legacy"] / len(spreads) * 1e3, "affine_per_spread_ms": totals["affine"] / len(spreads) * 1e3, "pixel_difference": diff / len(spreads)}
+
+if __name__ == "__main__":
+    args = parser("牌面变换的耗时").parse_args()
+    write_results(args.json, {"draw": main(args.quick)})
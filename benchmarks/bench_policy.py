@@ -0,0 +1,76 @@
+# 请求策略(RequestPolicy)的检查: 用模拟的Ollama服务让一次请求变慢或断开连接,
+# 检查慢请求会被对冲、连接错误会按指数退避重试, 截止时间到了不再重试
+# 运行: python -m benchmarks.bench_policy [--json results.json]
+import time, asyncio
+from tarot_backend import OllamaPool, RequestPolicy, Deadline
+from benchmarks.common import parser, write_results
+from benchmarks.mock_ollama import MockOllama
+
+MESSAGES = [{"role": "user", "content": "我最近的工作运势如何？"}]
+# 慢请求额外等待的秒数, 远大于正常耗时
+STALL_TIME = 2.0
+BACKOFF = 0.2
+
+async def request(policy: RequestPolicy, pool: OllamaPool, deadline: Deadline = None) -> float:
+    start = time.perf_counter()
+    await policy.call("reading", lambda: pool.chat(model="mock", messages=MESSAGES), deadline)
+    return time.perf_counter() - start
+
+async def run(warmup: int) -> dict:
+    results = {}
+    async with MockOllama(latency=0.02, token_rate=2000) as server:
+        pool = OllamaPool.from_hosts(server.url)
+        try:
+            # 慢请求: 积累样本后让下一个请求卡住, 超过p90后应发出对冲请求并取先返回的结果
+            policy = RequestPolicy(retries=0, hedge_percentile=0.9, hedge_min_samples=warmup)
+            # 第一次请求要建立连接, 不计入样本
+            await pool.chat(model="mock", messages=MESSAGES)
+            for _ in range(warmup):
+                await request(policy, pool)
+            server.stalls, server.stall_time = 1, STALL_TIME
+            elapsed = await request(policy, pool)
+            if policy.hedged != 1 or elapsed >= STALL_TIME:
+                raise AssertionError(f"slow request was not hedged: hedged={policy.hedged} elapsed={elapsed:.2f}s")
+            print(f"hedge     stalled request answered in {elapsed * 1e3:7.1f} ms (stall {STALL_TIME:.1f} s), hedged {policy.hedged}")
+            results["hedged_ms"] = elapsed * 1e3
+
+            # 连接错误: 服务端直接断开, 应等待退避时间后重试成功
+            policy = RequestPolicy(retries=2, backoff=BACKOFF)
+            server.drops = 2
+            elapsed = await request(policy, pool)
+            # 两次退避分别至少为backoff*0.5与backoff*1.0
+            if policy.retried != 2 or elapsed < BACKOFF * 1.5:
+                raise AssertionError(f"connection error was not retried with backoff: retried={policy.retried} elapsed={elapsed:.2f}s")
+            print(f"retry     2 dropped connections, answered in {elapsed * 1e3:7.1f} ms, retried {policy.retried}")
+            results["retried_ms"] = elapsed * 1e3
+
+            # 截止时间: 剩余时间不够退避时直接抛出错误
+            policy = RequestPolicy(retries=5, backoff=BACKOFF)
+            server.drops = 1
+            try:
+                await request(policy, pool, Deadline(BACKOFF * 0.4))
+            except Exception as error:
+                if not policy.is_transient(error) or policy.retried != 0:
+                    raise AssertionError(f"unexpected error past the deadline: {error!r}, retried={policy.retried}")
+            else:
+                raise AssertionError("dropped connection succeeded past the deadline")
+            print("deadline  no retry when the backoff would pass the deadline")
+            server.drops = 0
+
+            # 百分位写成95时应直接报错
+            try:
+                RequestPolicy(hedge_percentile=95)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("hedge_percentile=95 was accepted")
+        finally:
+            await pool.close()
+    return results
+
+def main(quick: bool = False) -> dict:
+    return asyncio.run(run(10 if quick else 30))
+
+if __name__ == "__main__":
+    args = parser("请求重试与对冲的检查").parse_args()
+    write_results(args.json, {"policy": main(args.quick)})
@@ -0,0 +1,50 @@
+# 多主机连接池的基准: 用本地模拟的Ollama服务, 比较单主机与多主机的吞吐, 并在运行中让一台主机出错检查故障转移
+# 运行: python -m benchmarks.bench_pool [--json results.json]
+import time, asyncio
+from tarot import Tarot
+from benchmarks.mock_ollama import MockOllama
+from benchmarks.common import parser, write_results
+
+QUESTION = "我最近的工作运势如何？"
+
+async def run(tarot: Tarot, readings: int) -> tuple:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(tarot.divination(QUESTION, queue_timeout=None) for _ in range(readings)))
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(result.is_complete for result in results)
+
+async def run_pool(hosts: int, readings: int, concurrency: int) -> dict:
+    results = {}
+    servers = [await MockOllama(latency=0.1, token_rate=400).start() for _ in range(hosts)]
+    try:
+        single = Tarot("mock", servers[0].url, max_concurrency=concurrency, max_queue=readings)
+        elapsed, completed = await run(single, readings)
+        print(f"1 host   {readings / elapsed:6.1f} readings/s  {completed}/{readings} completed")
+        results["single_readings_per_sec"] = readings / elapsed
+        await single.client.close()
+
+        for server in servers:
+            server.requests = 0
+        pool = Tarot("mock", [server.url for server in servers], max_concurrency=concurrency, max_queue=readings)
+        elapsed, completed = await run(pool, readings)
+        print(f"{hosts} hosts  {readings / elapsed:6.1f} readings/s  {completed}/{readings} completed, requests per host {[server.requests for server in servers]}")
+        results["pool_readings_per_sec"] = readings / elapsed
+
+        # 一台主机出错, 请求应转移到其他主机
+        servers[0].failing = True
+        elapsed, completed = await run(pool, readings)
+        print(f"failover {readings / elapsed:6.1f} readings/s  {completed}/{readings} completed, {pool.client.backends[0]}")
+        results["failover_readings_per_sec"] = readings / elapsed
+        results["failover_completed"] = completed / readings
+        await pool.client.close()
+    finally:
+        for server in servers:
+            await server.close()
+    return results
+
+def main(quick: bool = False) -> dict:
+    return asyncio.run(run_pool(3, 30 if quick else 60, 12))
+
+if __name__ == "__main__":
+    args = parser("多主机连接池的吞吐与故障转移").parse_args()
+    write_results(args.json, {"pool": main(args.quick)})
@@ -0,0 +1,125 @@
+# 提示词生成的微基准: 旧版逐张牌遍历字典拼接 vs 预编译的DeckIndex, 以及去重后提示词的大小
+# 运行: python -m benchmarks.bench_prompt [--json results.json]
+import json, random, timeit
+from tarot_config import TAROT_DATA_PATH
+from tarot_deck import DeckIndex, estimate_tokens
+from benchmarks.common import parser, write_results
+
+# 旧版divination中的属性文本处理
+def legacy_element_text(element, a_mod, total_zodiacs_key):
+    color = ", ".join(element["colorsCN"])
+    result_text = f"元素:{element['name_cn']},能量属性:{element['genderCN']},颜色:{color},生物:{element['animals']},表达:{element['expression']},属性:{element['attribute']},含义:{element['meaning']}"
+    if a_mod:
+        total_zodiacs_key.update(element['zodiac'])
+        zodiac_cn = ", ".join(element['zodiacCN'])
+        result_text += f",元素对应星座:{zodiac_cn}"
+    return result_text
+
+# 旧版divination中的提示词拼接
+def legacy_build(tarot_data, spread_key, random_cards, is_reversed_list, a_mod):
+    spread = tarot_data['spreads'][spread_key]
+    tarot_cards = tarot_data['cards']
+    elements = tarot_data['elements']
+    court_elemental_correspondence = tarot_data['courtElementalCorrespondence']
+    tarot_texts = f"塔罗牌阵讯息:\n{spread['name_cn']}: {spread['description_cn']}\n"
+    show_text = f"{spread['name_cn']}: {spread['description_cn']}"
+    total_zodiacs_key = set()
+
+    for index, card in enumerate(spread["positions"]):
+        tarot_texts += f"\n{index + 1}. {card['name_cn']}: {card['description_cn']}"
+        tarot_card_key = random_cards[index]
+        tarot_card = tarot_cards[tarot_card_key]
+        is_reversed = is_reversed_list[index]
+        card_name = tarot_card["card_name_cn"]
+        first_element = tarot_card["first_element"]
+        second_element = tarot_card["second_element"]
+        court_elemental = None
+        for court_elemental_correspondence_key in court_elemental_correspondence.keys():
+            if tarot_card_key.lower().startswith(court_elemental_correspondence_key):
+                court_elemental = court_elemental_correspondence[court_elemental_correspondence_key]
+        if is_reversed:
+            card_description = tarot_card["reversed_cn"]
+            card_name = "逆" + card_name
+        else:
+            card_description = tarot_card["upright_cn"]
+            card_name = "正" + card_name
+        show_text += f"\n#{index + 1} {card['name_cn']}: {card['description_cn']}\n{card_name}"
+        tarot_texts += f"\n{card_name}: {card_description}"
+        if first_element:
+            tarot_texts += f"\n第一元素:{tarot_card['first_element_cn']}," + legacy_element_text(elements[first_element], a_mod, total_zodiacs_key)
+        if second_element:
+            tarot_texts += f"\n第二元素:{tarot_card['second_element_cn']}," + legacy_element_text(elements[first_element], a_mod, total_zodiacs_key)
+        if court_elemental:
+            tarot_texts += f"\n宫廷元素:{court_elemental['elementCN']},{court_elemental['nameCN']}含义:{court_elemental['meaning']}," + legacy_element_text(elements[court_elemental["element"]], a_mod, total_zodiacs_key)
+
+    tarot_texts += f"\n阵型解释:{spread['interpretation_method_cn']}"
+
+    if "all" in total_zodiacs_key and a_mod:
+        total_zodiacs_key = {"Aries", "Leo", "Sagittarius", "Taurus","Virgo","Capricorn", "Gemini","Libra","Aquarius", "Cancer","Scorpio","Pisces"}
+
+    zodiacs_text = ""
+    if a_mod:
+        total_astrology_modality_keys = set()
+        zodiacs_text_info = ""
+        for zodiacs_key in total_zodiacs_key:
+            zodiac = tarot_data['zodiacs'][zodiacs_key]
+            total_astrology_modality_keys.add(zodiac['astrologyModality'])
+            zodiacs_text_info += f"\n{zodiac['zodiacCN']}: {zodiac['astrologyModalityCN']}\n元素:{zodiac['elementCN']},季节:{zodiac['seasonCN']},本质:{zodiac['nature']}"
+            if zodiac['rulingBodyTraditional']:
+                zodiacs_text_info += f",现代守护星: {zodiac['rulingBodyModern']}, 古典守护星: {zodiac['rulingBodyTraditional']}"
+            else:
+                zodiacs_text_info += f",守护星: {zodiac['rulingBodyModern']}"
+        astrology_modality_info = ""
+        for key in total_astrology_modality_keys:
+            value = tarot_data['astrologyModality'][key]
+            astrology_modality_info += f"\n{value['name_cn']},对应宫廷牌:{value['cardCN']},属性:{value['attribute']},含义:{value['meaning']}"
+        zodiacs_text = "占星讯息:" + astrology_modality_info + zodiacs_text_info
+
+    return tarot_texts, show_text, zodiacs_text
+
+def make_cases(tarot_data, count):
+    rng = random.Random(0)
+    card_keys = list(tarot_data['cards'].keys())
+    spread_keys = list(tarot_data['spreads'].keys())
+    cases = []
+    for _ in range(count):
+        spread_key = rng.choice(spread_keys)
+        card_count = len(tarot_data['spreads'][spread_key]['positions'])
+        cases.append((spread_key, rng.sample(card_keys, card_count), [rng.choice([True, False]) for _ in range(card_count)], rng.choice([True, False])))
+    return cases
+
+def main(quick: bool = False) -> dict:
+    number = 2 if quick else 20
+    with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
+        tarot_data = json.load(file)
+
+    index = DeckIndex(tarot_data)
+    cases = make_cases(tarot_data, 500)
+
+    # 去重后的提示词与旧版的估算token数
+    legacy_tokens = 0
+    indexed_tokens = 0
+    shrunk = 0
+    for spread_key, cards, is_reversed_list, a_mod in cases:
+        parts = index.build_prompt(spread_key, cards, is_reversed_list, a_mod)
+        tarot_text, show_text, zodiacs_text = legacy_build(tarot_data, spread_key, cards, is_reversed_list, a_mod)
+        assert parts.show_text == show_text
+        legacy_tokens += estimate_tokens(tarot_text) + estimate_tokens(zodiacs_text)
+        indexed_tokens += parts.token_count
+        shrunk += bool(parts.shrink)
+
+    legacy = timeit.timeit(lambda: [legacy_build(tarot_data, *case) for case in cases], number=number)
+    indexed = timeit.timeit(lambda: [index.build_prompt(*case) for case in cases], number=number)
+    build = timeit.timeit(lambda: DeckIndex(tarot_data), number=number) / number
+
+    total = len(cases) * number
+    print(f"legacy      {legacy / total * 1e6:8.2f} us/reading")
+    print(f"deck index  {indexed / total * 1e6:8.2f} us/reading  ({legacy / indexed:.1f}x)")
+    print(f"index build {build * 1e3:8.2f} ms (once per load)")
+    print(f"prompt size {legacy_tokens / len(cases):8.0f} -> {indexed_tokens / len(cases):.0f} tokens/reading (estimated, {shrunk} of {len(cases)} shrunk)")
+
+    return {"legacy_us": legacy / total * 1e6, "indexed_us": indexed / total * 1e6, "index_build_ms": build * 1e3, "legacy_tokens": legacy_tokens / len(cases), "indexed_tokens": indexed_tokens / len(cases), "shrunk": shrunk}
+
+if __name__ == "__main__":
+    args = parser("提示词生成的耗时与大小").parse_args()
+    write_results(args.json, {"prompt": main(args.quick)})
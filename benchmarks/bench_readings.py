@@ -0,0 +1,71 @@
+# 端到端占卜的基准: 用本地模拟的Ollama服务, 测不同并发下Tarot.divination的吞吐与延迟分位数, 以及流式的首句延迟
+# 运行: python -m benchmarks.bench_readings [--json results.json]
+import time, random, asyncio
+from tarot import Tarot, TarotContent
+from tarot_metrics import TarotMetrics
+from benchmarks.common import latency_stats, parser, write_results
+from benchmarks.mock_ollama import MockOllama
+
+QUESTIONS = ("我最近的工作运势如何？", "我和他的感情会有结果吗", "下个月适合换工作吗", "我的重复梦境试图传达什么？", "今年的财运怎么样", "我该如何面对现在的困境")
+
+async def run_level(url: str, concurrency: int, readings: int, stream: bool) -> dict:
+    tarot = Tarot("mock", url, max_concurrency=concurrency, max_queue=readings, metrics=TarotMetrics())
+    rng = random.Random(concurrency)
+    latencies = []
+    first_sentences = []
+    completed = 0
+
+    async def reading():
+        nonlocal completed
+        start = time.perf_counter()
+        if stream:
+            result = TarotContent()
+            is_first = True
+            async for __ in tarot.divination_stream(rng.choice(QUESTIONS), result=result):
+                if is_first:
+                    is_first = False
+                    first_sentences.append(time.perf_counter() - start)
+        else:
+            result = await tarot.divination(rng.choice(QUESTIONS))
+        latencies.append(time.perf_counter() - start)
+        completed += result.is_complete
+
+    # 同时只有concurrency个请求, 测的是服务能力而不是排队
+    semaphore = asyncio.Semaphore(concurrency)
+    async def bounded():
+        async with semaphore:
+            await reading()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded() for _ in range(readings)))
+    elapsed = time.perf_counter() - start
+    await tarot.client.close()
+
+    result = {"concurrency": concurrency, "readings": readings, "completed": completed, "readings_per_sec": readings / elapsed, "latency": latency_stats(latencies)}
+    if stream:
+        result["first_sentence"] = latency_stats(first_sentences)
+    return result
+
+async def run(levels: tuple, readings: int, latency: float, token_rate: float, parallel: int) -> dict:
+    results = {"server": {"latency": latency, "token_rate": token_rate, "parallel": parallel}, "divination": [], "divination_stream": []}
+    async with MockOllama(latency=latency, token_rate=token_rate, parallel=parallel) as server:
+        for stream in (False, True):
+            name = "divination_stream" if stream else "divination"
+            for concurrency in levels:
+                row = await run_level(server.url, concurrency, readings, stream)
+                results[name].append(row)
+                stats = row["latency"]
+                line = f"{name:18s} c={concurrency:<3d} {row['readings_per_sec']:7.1f} readings/s  p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  p99 {stats['p99_ms']:7.1f} ms  {row['completed']}/{readings}"
+                if stream:
+                    line += f"  first sentence p50 {row['first_sentence']['p50_ms']:6.1f} ms"
+                print(line)
+    return results
+
+def main(quick: bool = False) -> dict:
+    levels = (1, 4, 16) if quick else (1, 2, 4, 8, 16, 32)
+    readings = 32 if quick else 128
+    return asyncio.run(run(levels, readings, latency=0.05, token_rate=400.0, parallel=8))
+
+if __name__ == "__main__":
+    args = parser("端到端占卜的吞吐与延迟").parse_args()
+    write_results(args.json, {"readings": main(args.quick)})
@@ -0,0 +1,66 @@
+# 牌阵绘制的基准: 对全部牌阵测TarotDraw.draw, 冷(新的图片缓存)、热(牌面已缓存)以及编码JPEG的耗时
+# 运行: python -m benchmarks.bench_render [--json results.json]
+import json, time, random, asyncio
+from tarot import TarotDraw
+from tarot_assets import AssetCache, AssetAtlas
+from tarot_config import TAROT_DATA_PATH, RESOURCES_PATH
+from benchmarks.common import latency_stats, parser, write_results
+
+async def run(repeat: int, seed: int) -> dict:
+    with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
+        tarot_data = json.load(file)
+
+    rng = random.Random(seed)
+    cards = list(tarot_data["cards"].values())
+    spreads = []
+    samples = {"cold": [], "warm": [], "jpeg": []}
+    per_card = {"cold": 0.0, "warm": 0.0}
+    card_total = 0
+
+    for spread_key, spread in tarot_data["spreads"].items():
+        count = len(spread["positions"])
+        drawn = rng.sample(cards, count)
+        is_reversed_list = [rng.choice([True, False]) for _ in range(count)]
+        card_total += count
+
+        # 热: 同一组牌先绘制一次, 之后牌面变换都命中缓存
+        warm_draw = TarotDraw(RESOURCES_PATH, cache=AssetCache())
+        await warm_draw.draw(drawn, spread, is_reversed_list)
+
+        times = {}
+        for name in ("cold", "warm", "jpeg"):
+            best = None
+            for _ in range(repeat):
+                # 冷: 每次都用新的缓存, 包含解码(或读取图集)与变换
+                tarot_draw = TarotDraw(RESOURCES_PATH, cache=AssetCache()) if name == "cold" else warm_draw
+                start = time.perf_counter()
+                await tarot_draw.draw(drawn, spread, is_reversed_list, image_format="JPEG" if name == "jpeg" else None)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times[name] = best
+            samples[name].append(best)
+
+        per_card["cold"] += times["cold"]
+        per_card["warm"] += times["warm"]
+        spreads.append({"spread": spread_key, "cards": count, "cold_ms": times["cold"] * 1e3, "warm_ms": times["warm"] * 1e3, "jpeg_ms": times["jpeg"] * 1e3})
+
+    return {"atlas": AssetAtlas.is_fresh(RESOURCES_PATH), "spreads": spreads, "cold": latency_stats(samples["cold"]), "warm": latency_stats(samples["warm"]), "jpeg": latency_stats(samples["jpeg"]), "cold_per_card_ms": per_card["cold"] / card_total * 1e3, "warm_per_card_ms": per_card["warm"] / card_total * 1e3}
+
+def main(quick: bool = False) -> dict:
+    results = asyncio.run(run(1 if quick else 3, 0))
+
+    # 按牌数分组输出
+    groups = {}
+    for row in results["spreads"]:
+        groups.setdefault(row["cards"], []).append(row)
+    for count, rows in sorted(groups.items()):
+        average = lambda field: sum(row[field] for row in rows) / len(rows)
+        print(f"{count:3d} cards x{len(rows):<3d} cold {average('cold_ms'):7.1f} ms  warm {average('warm_ms'):7.1f} ms  jpeg {average('jpeg_ms'):7.1f} ms")
+    print(f"all spreads  cold p50 {results['cold']['p50_ms']:.1f} ms  warm p50 {results['warm']['p50_ms']:.1f} ms  jpeg p50 {results['jpeg']['p50_ms']:.1f} ms")
+    print(f"atlas {'used' if results['atlas'] else 'not built'}")
+    print(f"per card     cold {results['cold_per_card_ms']:.2f} ms  warm {results['warm_per_card_ms']:.2f} ms")
+    return results
+
+if __name__ == "__main__":
+    args = parser("牌阵绘制的耗时").parse_args()
+    write_results(args.json, {"render": main(args.quick)})
@@ -0,0 +1,85 @@
+# 占卜结果的基准: 每个结果占用的内存与序列化耗时, 与原来内嵌牌组数据的tarot_info dict比较
+# 运行: python -m benchmarks.bench_result [--json results.json]
+import gc, json, time, random, pickle, tracemalloc
+from tarot import TarotContent
+from tarot_deck import DeckStore, TarotInfo
+from benchmarks.common import parser, write_results
+
+# 原来的tarot_info: 每个结果一组dict, 引用牌组中的牌、牌阵、元素与星座
+def legacy_tarot_info(snapshot, spread_key: str, card_keys: list, is_reversed_list: list, a_mod: bool) -> dict:
+    data = snapshot.data
+    prompt = snapshot.index.build_prompt(spread_key, card_keys, is_reversed_list, a_mod)
+    return {
+        "spread": data["spreads"][spread_key],
+        "cards": {card_key: data["cards"][card_key] for card_key in card_keys},
+        "is_reversed_list": is_reversed_list,
+        "astrologyModality": {key: data["astrologyModality"][key] for key in prompt.astrology_modality_keys},
+        "courtElementalCorrespondence": {key: data["courtElementalCorrespondence"][key] for key in prompt.court_keys},
+        "zodiacs": {key: data["zodiacs"][key] for key in prompt.zodiacs_keys},
+        "elements": {key: data["elements"][key] for key in prompt.elements},
+    }
+
+def draws(snapshot, count: int) -> list:
+    index = snapshot.index
+    rng = random.Random(7)
+    rows = []
+    for _ in range(count):
+        spread_key = rng.choice(index.spread_keys)
+        card_count = index.spreads[spread_key].card_count
+        rows.append((spread_key, rng.sample(index.card_keys[0], card_count), [rng.random() < 0.5 for _ in range(card_count)], rng.random() < 0.5))
+    return rows
+
+# 构建count个结果时新分配的字节数 / count
+def bytes_per_result(build, rows: list) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [build(row) for row in rows]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return (after - before) / len(rows)
+
+def per_call_us(function, items: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+def main(quick: bool = False) -> dict:
+    snapshot = DeckStore.shared().snapshot
+    rows = draws(snapshot, 500 if quick else 2000)
+    repeat = 3 if quick else 7
+
+    legacy = [legacy_tarot_info(snapshot, *row) for row in rows]
+    compact = [TarotInfo(snapshot, *row) for row in rows]
+    contents = [TarotContent(result_texts=["牌面显示你正站在新的起点。"] * 8, tarot_text="", tarot_info=info, is_complete=True) for info in compact]
+
+    results = {
+        "legacy_bytes": bytes_per_result(lambda row: legacy_tarot_info(snapshot, *row), rows),
+        "compact_bytes": bytes_per_result(lambda row: TarotInfo(snapshot, *row), rows),
+        "legacy_json_us": per_call_us(lambda info: json.dumps(info, ensure_ascii=False), legacy, repeat),
+        "compact_json_us": per_call_us(lambda info: json.dumps(info.to_json(), ensure_ascii=False), compact, repeat),
+        "compact_bytes_us": per_call_us(TarotInfo.to_bytes, compact, repeat),
+        "from_json_us": per_call_us(lambda data: TarotInfo.from_json(data, snapshot), [info.to_json() for info in compact], repeat),
+        "from_bytes_us": per_call_us(lambda data: TarotInfo.from_bytes(data, snapshot), [info.to_bytes() for info in compact], repeat),
+        "content_json_us": per_call_us(lambda content: json.dumps(content.to_json(), ensure_ascii=False), contents, repeat),
+        "legacy_json_size": sum(len(json.dumps(info, ensure_ascii=False).encode()) for info in legacy) / len(legacy),
+        "compact_json_size": sum(len(json.dumps(info.to_json()).encode()) for info in compact) / len(compact),
+        "compact_binary_size": sum(len(info.to_bytes()) for info in compact) / len(compact),
+        "legacy_pickle_size": sum(len(pickle.dumps(info)) for info in legacy) / len(legacy),
+    }
+
+    print(f"memory per tarot_info   legacy {results['legacy_bytes']:8.0f} B   compact {results['compact_bytes']:8.0f} B")
+    print(f"serialize tarot_info    legacy json {results['legacy_json_us']:7.1f} us   compact json {results['compact_json_us']:6.2f} us   binary {results['compact_bytes_us']:6.2f} us")
+    print(f"deserialize             from json {results['from_json_us']:6.2f} us   from bytes {results['from_bytes_us']:6.2f} us")
+    print(f"serialized size         legacy json {results['legacy_json_size']:7.0f} B   compact json {results['compact_json_size']:5.0f} B   binary {results['compact_binary_size']:4.0f} B")
+    print(f"TarotContent.to_json + dumps {results['content_json_us']:6.2f} us")
+    return results
+
+if __name__ == "__main__":
+    args = parser("占卜结果的内存与序列化").parse_args()
+    write_results(args.json, {"result": main(args.quick)})
@@ -0,0 +1,83 @@
+# 大模型选择牌阵的基准: 解读用的大模型自由回答, 与限制输出为牌阵key、再换成小模型时的耗时与有效率
+# 模拟的Ollama按模型设置生成速度, 自由回答时像真实模型一样多说几句
+# 同时检查本地选择器(SpreadSelector)在标注提问上的覆盖率与正确率, 本地选错的牌阵不会再交给大模型
+# 运行: python -m benchmarks.bench_select [--json results.json]
+import time, random, asyncio
+from tarot import Tarot
+from tarot_deck import DeckStore
+from tarot_metrics import TarotMetrics
+from tarot_selector import SpreadSelector
+from benchmarks.common import latency_stats, parser, write_results
+from benchmarks.mock_ollama import MockOllama
+from benchmarks.spread_questions import CALIBRATION_QUESTIONS, HOLDOUT_QUESTIONS
+
+QUESTIONS = ("我最近的工作运势如何？", "我和他的感情会有结果吗", "下个月适合换工作吗", "我的重复梦境试图传达什么？", "今年的财运怎么样", "我该如何面对现在的困境")
+# 大模型与小模型每秒生成的token数
+MODEL_RATES = {"large": 40.0, "small": 300.0}
+VERBOSE_REPLY = "好的,根据你的问题,我为你选择的牌阵是: {}\n这个牌阵能帮助你看清现状与未来的走向,请静下心来,专注于你的问题"
+
+# 名称 -> Tarot的参数
+CONFIGS = {
+    "large_free": dict(select_options=None, structured_select=False),
+    "large_structured": dict(),
+    "small_structured": dict(select_model="small"),
+}
+
+# 本地选择器容易选错的提问, 必须交给大模型或选中可以接受的牌阵
+HARD_QUESTIONS = ("我的事业运势", "我应该换工作吗")
+
+# 本地选择器直接决定的比例(覆盖率)与决定的牌阵在标注中的比例(正确率)
+def local_accuracy(questions: dict) -> dict:
+    selector = SpreadSelector(DeckStore.shared().snapshot.data["spreads"])
+    decided = correct = 0
+    wrong = {}
+    for question, accepted in questions.items():
+        spread_key = selector.select(question)
+        selector._cache.clear()
+        if spread_key is None:
+            continue
+        decided += 1
+        if spread_key in accepted:
+            correct += 1
+        else:
+            wrong[question] = spread_key
+    return {"questions": len(questions), "coverage": decided / len(questions), "agreement": correct / decided if decided else 1.0, "wrong": wrong}
+
+def check_hard_questions():
+    for question in HARD_QUESTIONS:
+        spread_key = SpreadSelector(DeckStore.shared().snapshot.data["spreads"]).select(question)
+        if spread_key is not None and spread_key not in CALIBRATION_QUESTIONS[question]:
+            raise AssertionError(f"本地选择器把 {question} 选为 {spread_key}")
+
+async def run(selections: int) -> dict:
+    results = {"selections": selections, "model_rates": MODEL_RATES}
+    async with MockOllama(latency=0.02, parallel=4, select_reply=VERBOSE_REPLY, model_rates=MODEL_RATES) as server:
+        for name, options in CONFIGS.items():
+            tarot = Tarot("large", server.url, local_select=False, metrics=TarotMetrics(), **options)
+            spreads = tarot.tarot_data["spreads"]
+            rng = random.Random(3)
+            latencies = []
+            valid = 0
+            for _ in range(selections):
+                start = time.perf_counter()
+                spread_key = await tarot.select_spreads_llm(rng.choice(QUESTIONS))
+                latencies.append(time.perf_counter() - start)
+                valid += spread_key in spreads
+            await tarot.close()
+            results[name] = {"latency": latency_stats(latencies), "valid": valid / selections}
+    return results
+
+def main(quick: bool = False) -> dict:
+    check_hard_questions()
+    results = asyncio.run(run(5 if quick else 20))
+    results["local"] = {"calibration": local_accuracy(CALIBRATION_QUESTIONS), "holdout": local_accuracy(HOLDOUT_QUESTIONS)}
+    for name in CONFIGS:
+        row = results[name]
+        print(f"{name:17s} p50 {row['latency']['p50_ms']:7.1f} ms  p95 {row['latency']['p95_ms']:7.1f} ms  valid keys {row['valid']:.0%}")
+    for name, row in results["local"].items():
+        print(f"local {name:11s} coverage {row['coverage']:4.0%}  agreement {row['agreement']:4.0%}  wrong {row['wrong']}")
+    return results
+
+if __name__ == "__main__":
+    args = parser("选择牌阵的耗时").parse_args()
+    write_results(args.json, {"select": main(args.quick)})
@@ -0,0 +1,72 @@
+# 追问的基准: 占卜后用追问会话提问, 与重新占卜相同问题的首句延迟、总延迟与需要计算的提示词长度
+# 模拟的Ollama按prompt_rate计算提示词, 并像Ollama一样复用每个生成位置上次的对话前缀, 两台主机测试追问是否发回原主机
+# 运行: python -m benchmarks.bench_session [--json results.json]
+import time, asyncio
+from tarot import Tarot, TarotContent
+from tarot_metrics import TarotMetrics
+from benchmarks.common import latency_stats, parser, write_results
+from benchmarks.mock_ollama import MockOllama
+
+QUESTIONS = ("我最近的工作运势如何？", "我和他的感情会有结果吗", "下个月适合换工作吗", "今年的财运怎么样")
+FOLLOW_UPS = ("那我应该主动争取吗", "需要注意哪些人", "什么时候会有转机")
+SPREAD_KEY = "universalThreeCard"
+
+# 运行流式请求, 返回(首句延迟, 总延迟)
+async def timed(stream) -> tuple:
+    start = time.perf_counter()
+    first = None
+    async for __ in stream:
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+async def run(sessions: int, prompt_rate: float) -> dict:
+    servers = [MockOllama(latency=0.02, token_rate=400, parallel=2, prompt_rate=prompt_rate) for _ in range(2)]
+    for server in servers:
+        await server.start()
+    tarot = Tarot("mock", [server.url for server in servers], metrics=TarotMetrics())
+
+    samples = {"reading": [], "fresh": [], "follow_up": []}
+    prompt_chars = {"fresh": [], "follow_up": []}
+    failures = 0
+    for index in range(sessions):
+        result = TarotContent()
+        await timed(tarot.divination_stream(QUESTIONS[index % len(QUESTIONS)], result=result, spread_key=SPREAD_KEY, keep_session=True))
+        failures += not result.is_complete
+        session_id = result.session_id
+
+        for question in FOLLOW_UPS:
+            # 重新占卜同一个问题, 需要计算完整的提示词
+            fresh = TarotContent()
+            samples["fresh"].append(await timed(tarot.divination_stream(question, result=fresh, spread_key=SPREAD_KEY)))
+            prompt_chars["fresh"].append(fresh.usage.get("prompt_eval_count", 0))
+
+            follow_up = TarotContent()
+            samples["follow_up"].append(await timed(tarot.follow_up_stream(session_id, question, result=follow_up)))
+            prompt_chars["follow_up"].append(follow_up.usage.get("prompt_eval_count", 0))
+            failures += not (fresh.is_complete and follow_up.is_complete)
+
+    await tarot.client.close()
+    for server in servers:
+        await server.close()
+
+    results = {"sessions": sessions, "prompt_rate": prompt_rate, "failures": failures}
+    for name in ("fresh", "follow_up"):
+        results[name] = {
+            "first_sentence": latency_stats([sample[0] for sample in samples[name]]),
+            "latency": latency_stats([sample[1] for sample in samples[name]]),
+            "prompt_chars": sum(prompt_chars[name]) / len(prompt_chars[name]),
+        }
+    return results
+
+def main(quick: bool = False) -> dict:
+    results = asyncio.run(run(3 if quick else 10, 2000.0))
+    for name in ("fresh", "follow_up"):
+        row = results[name]
+        print(f"{name:10s} first sentence p50 {row['first_sentence']['p50_ms']:7.1f} ms  total p50 {row['latency']['p50_ms']:7.1f} ms  p95 {row['latency']['p95_ms']:7.1f} ms  prompt chars evaluated {row['prompt_chars']:7.1f}")
+    print(f"failures {results['failures']}")
+    return results
+
+if __name__ == "__main__":
+    args = parser("追问与重新占卜的延迟").parse_args()
+    write_results(args.json, {"session": main(args.quick)})
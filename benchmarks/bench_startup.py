@@ -0,0 +1,52 @@
+# 启动的基准: 导入tarot的耗时, 以及模型冷加载时预热与不预热的第一次占卜延迟
+# 模型加载用模拟的Ollama服务的load_time模拟
+# 运行: python -m benchmarks.bench_startup [--json results.json]
+import sys, time, asyncio, subprocess
+from benchmarks.mock_ollama import MockOllama
+from benchmarks.common import parser, write_results
+
+QUESTION = "我最近的工作运势如何？"
+
+# 在新的解释器中导入, 返回耗时(秒)与导入的重量级依赖
+def import_time() -> tuple:
+    code = "import sys, time\nstart = time.perf_counter()\nimport tarot\nprint(time.perf_counter() - start)\nprint(','.join(name for name in ('ollama', 'httpx', 'PIL', 'emoji') if name in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split("\n")
+    return float(output[0]), output[1]
+
+async def first_reading(load_time: float, warmup: bool) -> dict:
+    from tarot import Tarot
+
+    async with MockOllama(latency=0.05, token_rate=400, load_time=load_time) as server:
+        start = time.perf_counter()
+        tarot = Tarot("mock", server.url)
+        results = {"construct_ms": (time.perf_counter() - start) * 1e3}
+
+        if warmup:
+            timings = await tarot.warmup()
+            results["warmup_ms"] = timings["total"] * 1e3
+
+        start = time.perf_counter()
+        result = await tarot.divination(QUESTION, queue_timeout=None)
+        results["first_reading_ms"] = (time.perf_counter() - start) * 1e3
+        results["ready_ms"] = results["construct_ms"] + results.get("warmup_ms", 0.0)
+        assert result.is_complete, result.failure_detail
+        await tarot.client.close()
+    return results
+
+def main(quick: bool = False) -> dict:
+    samples = [import_time() for _ in range(3 if quick else 7)]
+    seconds = sorted(sample[0] for sample in samples)
+    results = {"import_ms": seconds[len(seconds) // 2] * 1e3, "import_min_ms": seconds[0] * 1e3}
+    print(f"import tarot       {results['import_ms']:8.1f} ms (min {results['import_min_ms']:.1f} ms), heavy modules loaded: {samples[0][1] or 'none'}")
+
+    load_time = 0.5 if quick else 2.0
+    for name, warmup in (("cold", False), ("warm", True)):
+        run = asyncio.run(first_reading(load_time, warmup))
+        for key, value in run.items():
+            results[f"{name}_{key}"] = value
+        print(f"{name:5s} model load {load_time:.1f}s  warmup {run.get('warmup_ms', 0.0):8.1f} ms  first reading {run['first_reading_ms']:8.1f} ms")
+    return results
+
+if __name__ == "__main__":
+    args = parser("导入耗时与第一次占卜的延迟").parse_args()
+    write_results(args.json, {"startup": main(args.quick)})
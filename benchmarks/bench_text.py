@@ -0,0 +1,96 @@
+# 文本清洗的微基准: 去除emoji、去AI味替换、分句, 以及流式清洗
+# 运行: python -m benchmarks.bench_text [--json results.json]
+import re, random, timeit
+import emoji
+from tarot_config import REPLACE_STRING_TO_EMPTY
+from tarot import TarotUtils, TarotStreamCleaner
+from benchmarks.common import parser, write_results
+
+# 用户的提问
+QUESTION = "🌈我最近的工作运势如何？😭会不会被裁员啊🙏"
+
+# 模拟大模型的解读, 包含需要去掉的连接词与重复的标点
+READING = ("首先,从第一张牌来看,逆位的宝剑五说明你最近在工作中有些心结难解。。其次,正位的星币九显示你的付出终将得到回报!!"
+           "但是,你需要注意沟通方式,,避免不必要的冲突。\n然后,宫廷元素土提醒你保持务实,同时不要忽视自己的感受？？"
+           "综上所述,这段时间适合稳扎稳打,最重要的是相信自己的直觉…。总的来说,机会就在眼前。") * 4
+
+# 长篇解读, 接近num_predict上限时的输出长度
+LONG_READING = READING * 25
+
+# 去掉词后拼出新词的解读: 旧实现逐词replace会继续去掉拼出的"综上所述", 单遍清洗只去掉原文中的词(见TextCleaner)
+CASCADE_READING = "好其次所述综上因此所述接着,"
+
+# 逐词replace再用正则合并标点的旧实现, 作为对照
+def legacy_replace_string(msg: str) -> str:
+    for string in REPLACE_STRING_TO_EMPTY:
+        msg = msg.replace(string, "")
+    return re.sub(r'(([？?！!。.，,]))[，,。.！!？?…、]+', r'\1', msg)
+
+# 先demojize再逐个replace的旧实现, 作为对照
+def legacy_remove_emojis(text: str) -> str:
+    result_text = emoji.demojize(text)
+    for matche in re.findall(r":[a-z]+[_*[a-z]*]*[-*[a-z]*[_*[a-z]*]*]*:", result_text):
+        result_text = result_text.replace(matche, "")
+    return result_text
+
+# 与大模型流式输出相近的片段长度
+def split_chunks(text: str) -> list:
+    rng = random.Random(0)
+    chunks = []
+    index = 0
+    while index < len(text):
+        size = rng.randint(1, 3)
+        chunks.append(text[index:index + size])
+        index += size
+    return chunks
+
+def stream_clean(chunks: list) -> list:
+    cleaner = TarotStreamCleaner()
+    result = []
+    for chunk in chunks:
+        result.extend(cleaner.feed(chunk))
+    result.extend(cleaner.flush())
+    return result
+
+def main(quick: bool = False) -> dict:
+    number = 200 if quick else 2000
+
+    chunks = split_chunks(READING)
+    long_chunks = split_chunks(LONG_READING)
+
+    cases = {
+        "remove_emojis": lambda: TarotUtils.remove_emojis(QUESTION),
+        "legacy_remove_emojis": lambda: legacy_remove_emojis(QUESTION),
+        "replace_string": lambda: TarotUtils.replace_string(READING),
+        "legacy_replace_string": lambda: legacy_replace_string(READING),
+        "split_sentences": lambda: TarotUtils.split_sentences(READING),
+        "replace_and_split": lambda: TarotUtils.split_sentences(TarotUtils.replace_string(READING)),
+        "stream_clean": lambda: stream_clean(chunks),
+        "long_replace_string": lambda: TarotUtils.replace_string(LONG_READING),
+        "long_legacy_replace_string": lambda: legacy_replace_string(LONG_READING),
+        "long_stream_clean": lambda: stream_clean(long_chunks),
+    }
+
+    # 新旧实现与流式清洗的结果必须一致
+    assert TarotUtils.remove_emojis(QUESTION) == legacy_remove_emojis(QUESTION)
+    assert TarotUtils.replace_string(LONG_READING) == legacy_replace_string(LONG_READING)
+    assert stream_clean(chunks) == TarotUtils.split_sentences(TarotUtils.replace_string(READING))
+    assert stream_clean(long_chunks) == TarotUtils.split_sentences(TarotUtils.replace_string(LONG_READING))
+    # 唯一已知的差异: 流式与一次性清洗一致, 与旧实现不同
+    assert legacy_replace_string(CASCADE_READING) == "好所述,"
+    assert TarotUtils.replace_string(CASCADE_READING) == "好所述综上所述,"
+    assert stream_clean(split_chunks(CASCADE_READING)) == TarotUtils.split_sentences(TarotUtils.replace_string(CASCADE_READING))
+
+    results = {"reading_chars": len(READING), "stream_chunks": len(chunks), "long_reading_chars": len(LONG_READING)}
+    for name, case in cases.items():
+        case()
+        # 长文本的用例减少次数
+        case_number = max(number // 25, 1) if name.startswith("long_") else number
+        best = min(timeit.repeat(case, number=case_number, repeat=5)) / case_number
+        results[f"{name}_us"] = best * 1e6
+        print(f"{name:26s} {best * 1e6:9.2f} us")
+    return results
+
+if __name__ == "__main__":
+    args = parser("文本清洗的耗时").parse_args()
+    write_results(args.json, {"text": main(args.quick)})
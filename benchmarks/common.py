@@ -0,0 +1,55 @@
+# 基准测试的公共工具: 百分位统计与机器可读的结果输出
+import sys, json, math, time, argparse, platform, subprocess
+
+# 排序后取百分位(最近秩)
+def percentile(ordered: list, percent: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(max(math.ceil(percent / 100 * len(ordered)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+# 耗时样本(秒)的统计, 结果单位为毫秒
+def latency_stats(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1e3 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1e3,
+        "p95_ms": percentile(ordered, 95) * 1e3,
+        "p99_ms": percentile(ordered, 99) * 1e3,
+        "max_ms": ordered[-1] * 1e3 if ordered else 0.0,
+    }
+
+# 当前代码的版本, 便于比较不同提交的结果
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metadata() -> dict:
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+def parser(description: str) -> argparse.ArgumentParser:
+    result = argparse.ArgumentParser(description=description)
+    result.add_argument("--json", metavar="PATH", help="把结果写入json文件, -为标准输出")
+    result.add_argument("--quick", action="store_true", help="减少次数, 用于快速检查")
+    return result
+
+# 写入结果: {"meta": {...}, "benchmarks": {名称: 结果}}
+def write_results(path: str, benchmarks: dict):
+    if not path:
+        return
+    data = {"meta": metadata(), "benchmarks": benchmarks}
+    if path == "-":
+        json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
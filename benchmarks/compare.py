@@ -0,0 +1,67 @@
+# 比较两次基准的结果, 列出变化超过阈值的指标, 有退化时返回1
+# 运行: python -m benchmarks.compare old.json new.json [--threshold 10]
+import sys, json, argparse
+
+# 指标名的后缀 -> 是否越大越好
+DIRECTIONS = (("per_sec", True), ("_ms", False), ("_us", False), ("_tokens", False))
+
+def flatten(data, prefix: str = "") -> dict:
+    result = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            result.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, list):
+        for index, value in enumerate(data):
+            # 列表元素用其中的名称或并发数区分
+            label = value.get("spread", value.get("concurrency", index)) if isinstance(value, dict) else index
+            result.update(flatten(value, f"{prefix}[{label}]"))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        result[prefix] = float(data)
+    return result
+
+def direction(name: str):
+    leaf = name.rsplit(".", 1)[-1]
+    for suffix, higher_is_better in DIRECTIONS:
+        if leaf.endswith(suffix):
+            return higher_is_better
+    return None
+
+def compare(old: dict, new: dict, threshold: float) -> tuple:
+    old_values = flatten(old["benchmarks"])
+    new_values = flatten(new["benchmarks"])
+    regressions = []
+    improvements = []
+    for name, old_value in old_values.items():
+        higher_is_better = direction(name)
+        new_value = new_values.get(name)
+        if higher_is_better is None or new_value is None or old_value == 0:
+            continue
+        change = (new_value - old_value) / old_value * 100
+        if abs(change) < threshold:
+            continue
+        better = change > 0 if higher_is_better else change < 0
+        (improvements if better else regressions).append((name, old_value, new_value, change))
+    return regressions, improvements
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="比较两次基准的结果")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="变化的百分比阈值")
+    args = parser.parse_args()
+
+    with open(args.old, 'r', encoding='utf-8') as file:
+        old = json.load(file)
+    with open(args.new, 'r', encoding='utf-8') as file:
+        new = json.load(file)
+
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    regressions, improvements = compare(old, new, args.threshold)
+    for title, rows in (("regressions", regressions), ("improvements", improvements)):
+        print(f"{title}: {len(rows)}")
+        for name, old_value, new_value, change in sorted(rows, key=lambda row: -abs(row[3])):
+            print(f"  {name:60s} {old_value:12.3f} -> {new_value:12.3f}  {change:+7.1f}%")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# 模拟的Ollama HTTP服务, 只依赖asyncio, 用于在没有GPU的机器上测试连接池与做基准测试
+# 支持 /api/chat, /api/generate(均支持流式), /api/ps, /api/version, 可以设置延迟、生成速度、提示词计算速度、模型加载时间与故障
+# 运行: python -m benchmarks.mock_ollama --port 11435
+import os, re, json, time, asyncio
+from collections import deque
+
+# 默认的解读内容
+DEFAULT_REPLY = "亲爱的求问者,牌面显示你正站在新的起点。过去的经历让你积累了足够的力量,现在是时候迈出下一步了。请相信自己的直觉,保持耐心与专注。"
+
+# 从选择牌阵的系统提示词中找到第一个牌阵
+SPREAD_PATTERN = re.compile(r'\n(\w+): \[')
+
+class MockOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, token_rate: float = 200.0, parallel: int = 4, reply: str = DEFAULT_REPLY, load_time: float = 0.0, prompt_rate: float = 0.0, select_reply: str = "{}", model_rates: dict = None):
+        self.host: str = host
+        self.port: int = port # 0为随机端口
+        self.latency: float = latency # 首个token前的延迟(秒), 模拟prompt eval
+        self.token_rate: float = token_rate # 每秒生成的token数, 每个字符算一个token
+        self.reply: str = reply
+        self.select_reply: str = select_reply # 选择牌阵时自由回答的内容, {}为牌阵key
+        self.model_rates: dict = model_rates or {} # 模型 -> 每秒生成的token数, 模拟大小不同的模型, 未列出的使用token_rate
+        self.parallel: int = parallel # 同时生成的请求数, 与OLLAMA_NUM_PARALLEL相同, 其余请求排队
+        self.load_time: float = load_time # 模型第一次被请求时的加载时间(秒), 之后常驻直到keep_alive为0
+        self.prompt_rate: float = prompt_rate # 每秒计算的提示词token数, 0为不计算提示词的耗时
+        # 与Ollama相同, 每个生成位置保留上一次的提示词与回答, 新的提示词与其相同的前缀不再计算
+        self.prefixes: deque = deque(maxlen=parallel)
+        self.loaded: set = set() # 已加载的模型
+        self.failing: bool = False # 为True时所有请求返回500
+        self.drops: int = 0 # 接下来这么多个生成请求不回应直接断开连接, 模拟连接错误
+        self.stalls: int = 0 # 接下来这么多个生成请求额外等待stall_time秒, 模拟偶发的慢请求
+        self.stall_time: float = 0.0
+        self.requests: int = 0
+        self.active: int = 0 # 正在处理的请求数
+        self._server: asyncio.Server = None
+        self._slots: asyncio.Semaphore = None
+        self._writers: set = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "MockOllama":
+        self._slots = asyncio.Semaphore(self.parallel)
+        self._server = await asyncio.start_server(self.__handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # 模拟主机宕机, 已建立的长连接也断开
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "MockOllama":
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    # 一个连接上可以有多个请求(keep-alive)
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, __ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                body = json.loads(await reader.readexactly(length)) if length else {}
+
+                self.requests += 1
+                self.active += 1
+                try:
+                    await self.__route(method, path, body, writer)
+                finally:
+                    self.active -= 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # 客户端断开或服务关闭
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def __route(self, method: str, path: str, body: dict, writer: asyncio.StreamWriter):
+        if self.failing:
+            return await self.__respond(writer, 500, {"error": "mock failure"})
+        if path == "/api/version":
+            return await self.__respond(writer, 200, {"version": "0.0.0-mock"})
+        if path == "/api/ps":
+            return await self.__respond(writer, 200, {"models": [{"name": model, "model": model} for model in sorted(self.loaded)]})
+        if path in ("/api/chat", "/api/generate") and method == "POST":
+            if self.drops > 0:
+                self.drops -= 1
+                writer.transport.abort()
+                return
+            if self.stalls > 0:
+                self.stalls -= 1
+                await asyncio.sleep(self.stall_time)
+            async with self._slots:
+                return await self.__generate(path == "/api/chat", body, writer)
+        return await self.__respond(writer, 404, {"error": f"{path} not found"})
+
+    def __reply_text(self, is_chat: bool, body: dict) -> str:
+        if is_chat:
+            for message in body.get("messages") or []:
+                if message.get("role") == "system":
+                    match = SPREAD_PATTERN.search(message.get("content", ""))
+                    if match is not None:
+                        return self.__formatted(match.group(1), body.get("format")) if body.get("format") else self.select_reply.format(match.group(1))
+        return self.reply
+
+    # 结构化输出: 按JSON Schema的第一个属性输出{属性: 内容}, 内容不在enum中时取第一个
+    @staticmethod
+    def __formatted(text: str, schema) -> str:
+        if not isinstance(schema, dict) or not schema.get("properties"):
+            return json.dumps({"response": text}, ensure_ascii=False)
+        name, prop = next(iter(schema["properties"].items()))
+        enum = prop.get("enum")
+        if enum and text not in enum:
+            text = enum[0]
+        return json.dumps({name: text}, ensure_ascii=False)
+
+    # 提示词按字符计算, 对话中每条消息为"角色:内容"
+    @staticmethod
+    def __prompt_text(is_chat: bool, body: dict) -> str:
+        if is_chat:
+            return "".join(f"{message.get('role')}:{message.get('content')}\n" for message in body.get("messages") or [])
+        return body.get("prompt") or ""
+
+    async def __generate(self, is_chat: bool, body: dict, writer: asyncio.StreamWriter):
+        start = time.perf_counter_ns()
+        model = body.get("model", "")
+        load_duration = 0
+        if model not in self.loaded:
+            await asyncio.sleep(self.load_time)
+            self.loaded.add(model)
+            load_duration = time.perf_counter_ns() - start
+        if body.get("keep_alive") in (0, "0", "0s"):
+            self.loaded.discard(model)
+
+        # 与Ollama相同, 没有提示词时只加载模型
+        if not body.get("messages") and not body.get("prompt"):
+            result = {"model": model, "created_at": "1970-01-01T00:00:00Z", "done": True, "done_reason": "load", "load_duration": load_duration, "total_duration": load_duration}
+            if is_chat:
+                result["message"] = {"role": "assistant", "content": ""}
+            else:
+                result["response"] = ""
+            return await self.__respond(writer, 200, result)
+
+        text = self.__reply_text(is_chat, body)
+        prompt = self.__prompt_text(is_chat, body)
+        cached = max((len(os.path.commonprefix([prefix, prompt])) for prefix in self.prefixes), default=0)
+        # 每个字符算一个token
+        tokens = list(text)
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+            text = "".join(tokens)
+
+        self.prefixes.append(prompt + self.__prompt_text(is_chat, {"messages": [{"role": "assistant", "content": text}]}))
+
+        await asyncio.sleep(self.latency + ((len(prompt) - cached) / self.prompt_rate if self.prompt_rate > 0 else 0))
+        prompt_eval_duration = time.perf_counter_ns() - start - load_duration
+
+        def part(content: str, done: bool) -> dict:
+            result = {"model": body.get("model", ""), "created_at": "1970-01-01T00:00:00Z", "done": done}
+            if is_chat:
+                result["message"] = {"role": "assistant", "content": content}
+            else:
+                result["response"] = content
+            if done:
+                total = time.perf_counter_ns() - start
+                result.update(done_reason="stop", total_duration=total, load_duration=load_duration, prompt_eval_count=len(prompt) - cached, prompt_eval_duration=prompt_eval_duration, eval_count=len(tokens), eval_duration=total - load_duration - prompt_eval_duration)
+                if not is_chat:
+                    result["context"] = list(range(len(prompt) + len(tokens)))
+            return result
+
+        token_rate = self.model_rates.get(model, self.token_rate)
+        delay = 1 / token_rate if token_rate > 0 else 0
+        if not body.get("stream", True):
+            await asyncio.sleep(delay * len(tokens))
+            return await self.__respond(writer, 200, part(text, True))
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for token in tokens:
+            await asyncio.sleep(delay)
+            self.__write_chunk(writer, part(token, False))
+            await writer.drain()
+        self.__write_chunk(writer, part("", True))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def __write_chunk(writer: asyncio.StreamWriter, data: dict):
+        line = json.dumps(data, ensure_ascii=False).encode() + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+    @staticmethod
+    async def __respond(writer: asyncio.StreamWriter, status: int, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        reason = {200: "OK", 404: "Not Found", 500: "Internal Server Error"}.get(status, "")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await writer.drain()
+
+async def serve(host: str, port: int, latency: float, token_rate: float, parallel: int, load_time: float, prompt_rate: float):
+    async with MockOllama(host, port, latency, token_rate, parallel, load_time=load_time, prompt_rate=prompt_rate) as server:
+        print(f"mock ollama listening on {server.url}")
+        await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="模拟的Ollama服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.05, help="首个token前的延迟(秒)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="每秒生成的token数")
+    parser.add_argument("--parallel", type=int, default=4, help="同时生成的请求数")
+    parser.add_argument("--load-time", type=float, default=0.0, help="模型的加载时间(秒)")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="每秒计算的提示词token数, 0为不计算")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency, args.token_rate, args.parallel, args.load_time, args.prompt_rate))
+    except KeyboardInterrupt:
+        pass
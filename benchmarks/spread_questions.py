@@ -0,0 +1,121 @@
+# 标注了合适牌阵的提问, 用于校准与检查本地牌阵选择器(SpreadSelector), 见bench_select
+# 每个提问对应可以接受的牌阵key, 本地选择器返回其中之一或None(交给大模型)都算正确
+
+LOVE = ("iLoveBecauseSpread", "emotionalDevelopmentSpread", "loverPyramid", "testingLoveSpread", "loveTree", "sincerityOfOther", "inspirationCorresponds", "loverVenusArray", "loveGuidance", "loveCross", "bothPartiesInnerSelves", "emotionalRealm", "gypsyCrossArray", "loveProspects", "loveStarArray", "passiveLove", "crossCardArray")
+CAREER = ("careerDevelopment", "careerPotential", "careerPyramid", "workProblemArray", "careerPyramidCardArray")
+REUNION = ("compositeCardArray", "loveRecovery", "brokenMirrorReunion", "loverReturns")
+ROMANCE = ("fiveCardRomanticLuck", "romanticLuck")
+NEW_LOVE = ("newRomance", "newLoveFormation", "loveGuidance", "successor", "loverPyramid", "loveProspects")
+SOULMATE = ("zhengyuanArray", "zhengyuanTriangle", "futureLover", "lifePartner")
+HEART = ("sincerityOfOther", "inspirationCorresponds", "bothPartiesInnerSelves", "passiveLove", "loverReturns", "emotionalRealm")
+DAY = ("everydaySpread", "eventsOfTheDaySpread", "simpleOneCard", "goalsSpread")
+YEAR = ("twelveMonthArray", "lifeFortune")
+MONEY = ("opportunityCardArray", "luckSpread", "lifeFortune", "twelveMonthArray")
+CHOICE = ("choiceCardArray", "chooseOneArray", "oneOutOfThree", "decisionBoardArray", "preactionAssessment", "hopeStarArray", "notOnlyButAlsoSpread", "annikinIssueSpread", "designatedIssues", "futureDoorplateArray")
+SHOULD = ("chooseOneArray", "preactionAssessment", "hopeStarArray", "choiceCardArray", "decisionBoardArray")
+PRESSURE = ("adjustPressure", "relaxYourself", "bodyMindSoul")
+HEALTH = ("bodyMindSoul", "bodyEnergy", "fourElements")
+PEOPLE = ("interpersonalRelationship", "keycardArray", "crossCardArray")
+
+# 校准SUITABLE_FOR_WEIGHT、SPREAD_SELECT_THRESHOLD与SPREAD_SELECT_MARGIN时使用的提问
+CALIBRATION_QUESTIONS = {
+    "我的事业运势": CAREER,
+    "我应该换工作吗": CAREER + SHOULD,
+    "我和他的感情会有结果吗": LOVE + NEW_LOVE,
+    "他到底爱不爱我": HEART + LOVE,
+    "我们的感情未来会怎样发展": LOVE + NEW_LOVE,
+    "我的爱情运势": LOVE + ROMANCE + NEW_LOVE,
+    "我最近的桃花运怎么样": ROMANCE + NEW_LOVE,
+    "今年下半年的桃花运势": ROMANCE + YEAR,
+    "前任还会回来找我吗": REUNION,
+    "我们还有复合的可能吗": REUNION,
+    "分手后还能挽回吗": REUNION,
+    "我的正缘什么时候出现": SOULMATE + NEW_LOVE,
+    "未来的另一半是什么样的人": SOULMATE,
+    "我该不该向喜欢的人告白": ("confessionArray",) + SHOULD,
+    "告白能成功吗": ("confessionArray",),
+    "我们是不是应该分手": ("breakupJudgment", "separatingAndBondingSpread") + SHOULD + LOVE,
+    "我和老公的婚姻会稳定吗": ("heartOfMarriage",) + LOVE,
+    "我们适合结婚吗": ("heartOfMarriage", "lifePartner") + LOVE + SHOULD,
+    "新认识的人会发展成恋人吗": NEW_LOVE,
+    "对方心里是怎么想我的": HEART,
+    "暗恋的人喜欢我吗": ("fiveCardRomanticLuck",) + HEART,
+    "我的工作前景如何": CAREER,
+    "我适合转行吗": CAREER + SHOULD,
+    "我能升职加薪吗": CAREER,
+    "最近工作压力很大怎么办": PRESSURE + CAREER + ("taskMoodSpread",),
+    "今天上班的状态和心情": ("taskMoodSpread",) + DAY,
+    "我适合创业吗": ("careerPyramidCardArray", "decisionBoardArray") + CAREER + SHOULD,
+    "职业规划应该往哪个方向走": CAREER,
+    "新工作的面试能通过吗": CAREER + ("simpleOneCard", "fastSolution"),
+    "我的考试能通过吗": ("academicFortune", "simpleOneCard", "fastSolution"),
+    "这学期的学习成绩会提高吗": ("academicFortune",),
+    "考研能上岸吗": ("academicFortune",),
+    "今日运势": DAY,
+    "今天运势如何": DAY,
+    "今天会发生什么事": DAY,
+    "这一周的运势": ("weeklySpread",),
+    "接下来五周的运势": ("luckyFiveWeek", "weeklySpread"),
+    "今年的整体运势": YEAR,
+    "明年的运势怎么样": YEAR,
+    "我的财运": MONEY,
+    "今年的财运怎么样": MONEY,
+    "这笔投资能赚钱吗": MONEY + SHOULD + ("decisionBoardArray",),
+    "我最近的运气好吗": ("luckSpread",) + DAY + YEAR,
+    "两份offer选哪一个": CHOICE,
+    "A和B应该选哪个": CHOICE,
+    "三个选择中哪个最好": ("oneOutOfThree",) + CHOICE,
+    "我应该搬家吗": SHOULD + CHOICE,
+    "要不要出国留学": SHOULD + CHOICE + ("academicFortune",),
+    "我的猫最近怎么了": ("petSpread",),
+    "我家狗狗的健康状况": ("petSpread",),
+    "我丢的钥匙在哪里": ("searchingForItemsArray",),
+    "丢失的东西能找回来吗": ("searchingForItemsArray",),
+    "我的重复梦境试图传达什么": ("dreamMatrix",),
+    "昨晚的梦有什么含义": ("dreamMatrix",),
+    "我的前世是什么样的": ("thisLifeArray", "spiritsOfTheCircle"),
+    "最近压力太大了怎么放松": PRESSURE,
+    "我的身体健康状况如何": HEALTH,
+    "身心能量平衡吗": HEALTH,
+    "和同事的关系怎么改善": PEOPLE + CAREER,
+    "怎么处理和朋友的矛盾": PEOPLE + ("problemSolvingSpread",),
+    "我的愿望能实现吗": ("wishArray", "pharaohsGateArray"),
+    "怎样才能实现我的梦想": ("wishArray", "pharaohsGateArray", "annikinGoalSpread", "goalsSpread"),
+    "如何改变我的限制性信念": ("beliefPowerArray",),
+    "我的灵性成长方向": ("sixPointedStar", "minervasWisdomArray", "angelGuidance", "spiritsOfTheCircle"),
+    "天使想给我什么指引": ("angelGuidance",),
+    "这个项目今年能顺利推进吗": ("fourSeasonsArray", "designatedIssues") + CAREER + YEAR,
+    "我现在遇到的困境怎么解决": ("problemSolvingSpread", "directCore", "designatedIssues", "annikinGoalSpread", "pearlNecklaceArray", "sixStarSpoon", "keycardArray", "annikinIssueSpread"),
+    "人生下一步该怎么走": ("theNextStep", "lifeFortune", "pentagramArray", "futureDoorplateArray"),
+    "我的人生运势": ("lifeFortune", "gypsyTraditional"),
+    "今天我该注意什么": DAY,
+}
+
+# 校准时没有使用的提问, 检查是否过拟合
+HOLDOUT_QUESTIONS = {
+    "我跟女朋友最近总吵架,感情还能维持吗": LOVE + ("breakupJudgment",),
+    "喜欢的人对我有没有好感": HEART + ROMANCE,
+    "前男友还爱我吗": REUNION + HEART,
+    "什么时候能遇到真爱": SOULMATE + NEW_LOVE + ROMANCE,
+    "这份工作适合我吗": CAREER + SHOULD,
+    "领导会提拔我吗": CAREER,
+    "换个城市发展好不好": SHOULD + CHOICE + CAREER,
+    "期末考试能考好吗": ("academicFortune", "simpleOneCard", "fastSolution"),
+    "下个月的财运": MONEY + ("luckyFiveWeek",),
+    "股票该不该卖": SHOULD + MONEY,
+    "本周需要注意什么": ("weeklySpread",) + DAY,
+    "明天的运势": DAY,
+    "宠物生病了会好吗": ("petSpread",),
+    "钱包丢了还能找到吗": ("searchingForItemsArray",),
+    "梦见蛇是什么意思": ("dreamMatrix",),
+    "最近总是焦虑怎么办": PRESSURE,
+    "和室友的关系怎么处理": PEOPLE,
+    "我的心愿什么时候能达成": ("wishArray", "pharaohsGateArray"),
+    "婚后生活会幸福吗": ("heartOfMarriage",) + LOVE,
+    "年度运势预测": YEAR,
+    "开店能成功吗": ("careerPyramidCardArray", "decisionBoardArray") + CAREER + MONEY,
+    "两个男生我该选谁": CHOICE + LOVE,
+    "我和家人的关系": PEOPLE,
+    "身体最近不太舒服": HEALTH,
+    "我该如何提升自己": ("annikinGoalSpread", "beliefPowerArray", "successor", "careerDevelopment", "goalsSpread"),
+}
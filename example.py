@@ -13,14 +13,13 @@ async def example_div():
     tarot = Tarot(MODEL, URL)
     question = "我的重复梦境试图传达什么？" # 想要询问的问题
     is_astrology = False # 是否开启塔罗牌 + 占星，False为经典塔罗牌模式
-    result: TarotContent = await tarot.divination(question, is_astrology, card_select=0)
-    
-    data = result.tarot_info
-    print(data)
-    cards_list = [value for __,value in data["cards"].items()]
     tarot_draw = TarotDraw("resources")
-    result_draw = await tarot_draw.draw(cards_list, data["spread"], data["is_reversed_list"])
-    result_draw.save("output.png")
+    # 牌阵图片与大模型解读同时进行
+    result, result_draw = await tarot.divination_with_image(question, is_astrology, card_select=0, tarot_draw=tarot_draw, image_format="JPEG")
+    
+    if result_draw is not None:
+        with open("output.jpg", "wb") as file:
+            file.write(result_draw)
     
     if result.is_complete:
         print(result.tarot_text)
@@ -33,8 +32,27 @@ async def example_div():
     else:
         print(result.failure_text)
 
+async def example_div_stream():
+    tarot = Tarot(MODEL, URL)
+    question = "我的重复梦境试图传达什么？" # 想要询问的问题
+    result = TarotContent()
+    is_first = True
+    
+    # 每生成完一句话就立即输出, 不必等待整段解读完成
+    async for out_text in tarot.divination_stream(question, False, card_select=0, result=result):
+        if is_first:
+            print(result.tarot_text)
+            is_first = False
+        print(out_text)
+    
+    if result.is_complete:
+        print(result.complete_text)
+    else:
+        print(result.failure_text)
+
 async def main():
     await example_div() # 占卜
+    # await example_div_stream() # 流式占卜
 
 if __name__ == "__main__":
     asyncio.run(main())
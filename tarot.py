@@ -1,63 +1,200 @@
-import json, re, random, math, asyncio
+from __future__ import annotations
+import os, io, re, sys, json, time, random, math, asyncio, itertools
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from tarot_config import *
-import emoji, ollama
-from PIL import Image
+from tarot_assets import AssetCache, asset_cache, atlas_image
+from tarot_selector import SpreadSelector
+from tarot_text import TextStream, message_cleaner, reading_cleaner, punctuation_cleaner
+from tarot_deck import DeckIndex, DeckSnapshot, DeckStore, TarotInfo
+from tarot_backend import Affinity, OllamaBackend, OllamaPool, Deadline, RequestPolicy, is_format_rejected
+from tarot_metrics import TarotMetrics, reading_metrics, stage, usage_of
+from tarot_cache import InterpretationCache
+from tarot_session import TarotSession, SessionStore
 
 DEFAULT_CONNECT_URL = "localhost:11434"
 
 class TarotContent:
-    def __init__(self, failure_tips: str = None, complete_text: str = None, result_texts: list[str] = None, tarot_text: str = None, tarot_info: dict = None, is_complete: bool = False):
+    __slots__ = ("result_texts", "failure_text", "tarot_text", "complete_text", "is_complete", "tarot_info", "spread_key", "queue_position", "failure_reason", "failure_detail", "timings", "usage", "cached", "session_id")
+    # to_json中原样输出的字段
+    JSON_FIELDS = ("is_complete", "spread_key", "tarot_text", "result_texts", "complete_text", "cached", "session_id", "queue_position", "failure_reason", "failure_text", "failure_detail", "timings", "usage")
+
+    def __init__(self, failure_tips: str = None, complete_text: str = None, result_texts: list[str] = None, tarot_text: str = None, tarot_info: TarotInfo = None, is_complete: bool = False):
         self.result_texts: list[str] = result_texts
         self.failure_text = failure_tips
         self.tarot_text = tarot_text
         self.complete_text = complete_text
         self.is_complete: bool = is_complete
-        self.tarot_info: dict = tarot_info
+        self.tarot_info: TarotInfo = tarot_info # 抽牌结果, 也可以当作原来的dict使用, 见TarotInfo
+        self.spread_key: str = None # 使用的牌阵
+        self.queue_position: int = 0 # 排队时前面的人数, 0为无需排队
+        self.failure_reason: str = None # 失败原因, 见TarotFailure
+        self.failure_detail: str = None # 失败时的错误信息
+        self.timings: dict[str, float] = {} # 各阶段耗时(秒), 见Tarot.divination
+        self.usage: dict = {} # 解读请求中Ollama返回的token数与耗时(纳秒)
+        self.cached: bool = False # 解读是否来自缓存
+        self.session_id: str = None # 追问会话的id, 见Tarot.follow_up
+
+    def fail(self, reason: str, failure_text: str, detail: str = None):
+        self.is_complete = False
+        self.failure_reason = reason
+        self.failure_text = failure_text
+        self.failure_detail = detail
+
+    # 可以直接json.dumps的dict, 抽牌结果只包含牌阵与牌的key
+    def to_json(self) -> dict:
+        data = {name: getattr(self, name) for name in self.JSON_FIELDS}
+        data["tarot_info"] = self.tarot_info.to_json() if self.tarot_info is not None else None
+        return data
+
+    # snapshot为抽牌时使用的牌组, 默认使用共享牌组当前的数据
+    @classmethod
+    def from_json(cls, data: dict, snapshot: DeckSnapshot = None) -> "TarotContent":
+        result = cls()
+        for name in cls.JSON_FIELDS:
+            if name in data:
+                setattr(result, name, data[name])
+        if data.get("tarot_info") is not None:
+            result.tarot_info = TarotInfo.from_json(data["tarot_info"], snapshot if snapshot is not None else DeckStore.shared().snapshot)
+        return result
+
+class TarotFailure:
+    """TarotContent.failure_reason的取值"""
+    EMPTY_MESSAGE = "empty_message" # 提问为空
+    TOO_LONG = "too_long" # 提问太长
+    INVALID_SPREAD = "invalid_spread" # 指定的牌阵不存在
+    BUSY = "busy" # 占卜位与等待队列已满或排队超时
+    TIMEOUT = "timeout" # 超过占卜的截止时间
+    BACKEND_UNAVAILABLE = "backend_unavailable" # 连接不上大模型
+    BACKEND_ERROR = "backend_error" # 大模型返回错误
+    DRAW_FAILED = "draw_failed" # 牌阵图片绘制失败
+    SESSION_EXPIRED = "session_expired" # 追问会话不存在或已失效
+    CANCELLED = "cancelled"
+    INTERNAL_ERROR = "internal_error"
+
+    @staticmethod
+    def classify(error: BaseException) -> str:
+        # 还没有导入httpx/ollama时错误不可能来自它们, 不为分类而导入
+        httpx, ollama = sys.modules.get("httpx"), sys.modules.get("ollama")
+        if isinstance(error, asyncio.TimeoutError) or (httpx is not None and isinstance(error, httpx.TimeoutException)):
+            return TarotFailure.TIMEOUT
+        if isinstance(error, asyncio.CancelledError):
+            return TarotFailure.CANCELLED
+        if isinstance(error, ConnectionError) or (httpx is not None and isinstance(error, httpx.TransportError)):
+            return TarotFailure.BACKEND_UNAVAILABLE
+        if ollama is not None and isinstance(error, ollama.ResponseError):
+            return TarotFailure.BACKEND_ERROR
+        return TarotFailure.INTERNAL_ERROR
 
 class TarotUtils:
     @staticmethod
     def clean_redundant_punctuation(text: str):
         # 规则：匹配【？、！、，】后面连续出现的标点，并只保留第一个标点
-        text = re.sub(r'(([？?！!。.，,]))[，,。.！!？?…、]+', r'\1', text)
-        return text
+        return punctuation_cleaner.clean(text)
     
     @staticmethod
     def remove_emojis(text : str):
-        # 把emoji变成字符串形式 比如🌈变成:rainbow:
-        result_text = emoji.demojize(text)
-        
-        # 设置规则,匹配string里的":xxx:"
-        pattern = r":[a-z]+[_*[a-z]*]*[-*[a-z]*[_*[a-z]*]*]*:"
-        matches = re.findall(pattern, result_text)
-        
-        # 去除emoji
-        for matche in matches:
-            result_text = result_text.replace(matche, "")
-            
-        return result_text
+        # 按emoji的码位直接去除
+        return message_cleaner.clean(text)
 
     @staticmethod
     def replace_string(msg: str):
-        result: str = msg
-        for string in REPLACE_STRING_TO_EMPTY:
-            result = result.replace(string, "")
-            
-        result = TarotUtils.clean_redundant_punctuation(result)
-        return result
+        # 去AI味与合并重复标点在同一遍中完成
+        return reading_cleaner.clean(msg)
+
+    @staticmethod
+    def split_sentences(text: str) -> list[str]:
+        # 按换行与句号分句, 去掉句子首尾多余的标点
+        result_texts = []
+        for sentence in re.split(r'[\n。]', text):
+            if len(sentence.strip()) > 0:
+                result_texts.append(sentence.strip().strip("。,，.").lstrip("？?!！").strip())
+        return result_texts
+
+    # split_sentences的逆操作, 缓存只保存分好的句子, 命中时用它还原成保存在会话中的回答
+    @staticmethod
+    def join_sentences(result_texts: list[str]) -> str:
+        return "".join(f"{text}。" for text in result_texts)
+
+    # 从选择牌阵的回答中取出牌阵key, 结构化输出为{"spread": key}, 不支持结构化输出的模型仍按纯文本处理
+    @staticmethod
+    def spread_key_of(content: str) -> str:
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get("spread"), str):
+            return data["spread"]
+        return TarotUtils.keep_english_digits(content.strip())
 
     @staticmethod
     def keep_english_digits(text):
         # 匹配非英文、非数字的字符并替换为空字符串
         return re.sub(r'[^a-zA-Z0-9]', '', text)
 
+class TarotStreamCleaner:
+    """流式文本清洗
+
+    不断喂入大模型输出的片段, 先做与 TarotUtils.replace_string 相同的增量清洗,
+    清洗后的文本中每当一句话的分隔符到达, 返回之前完整的句子
+    """
+    # 句子分隔符
+    DELIMITERS = "\n。"
+
+    def __init__(self):
+        self.stream: TextStream = reading_cleaner.stream()
+        self.buffer: str = "" # 已清洗但还没有分句的文本
+
+    def feed(self, chunk: str) -> list[str]:
+        text = self.stream.feed(chunk)
+
+        # 清洗后分隔符后面不会再合并标点, 最后一个分隔符之前的句子已经确定
+        end = max(map(text.rfind, self.DELIMITERS)) if text else -1
+        if end < 0:
+            self.buffer += text
+            return []
+
+        text, self.buffer = self.buffer + text[:end + 1], text[end + 1:]
+        return TarotUtils.split_sentences(text)
+
+    def flush(self) -> list[str]:
+        text, self.buffer = self.buffer + self.stream.flush(), ""
+        return TarotUtils.split_sentences(text)
+
 class TarotDraw:
-    def __init__(self, tarot_dir: str):
+    # 进程共享的绘制线程池/进程池
+    _shared_executor: Executor = None
+
+    def __init__(self, tarot_dir: str, cache: AssetCache = None, executor: Executor = None):
         self.tarot_dir: str = tarot_dir
+        self.cache: AssetCache = cache if cache is not None else asset_cache # 默认使用进程共享的缓存
+        self.executor: Executor = executor if executor is not None else TarotDraw.shared_executor() # 图片处理不在事件循环中进行
 
-    async def draw(self, cards: list[dict], spread: dict, is_reversed_list: list) -> Image:
-        wallpaper_path = f"{self.tarot_dir}/wallpaper.png"
+    # 按DRAW_EXECUTOR创建进程共享的线程池或进程池
+    @classmethod
+    def shared_executor(cls) -> Executor:
+        if cls._shared_executor is None:
+            if DRAW_EXECUTOR == "process":
+                cls._shared_executor = ProcessPoolExecutor(max_workers=DRAW_WORKERS)
+            else:
+                cls._shared_executor = ThreadPoolExecutor(max_workers=DRAW_WORKERS, thread_name_prefix="tarot-draw")
+        return cls._shared_executor
+
+    # 进程池中的任务使用各自进程的缓存
+    def _worker_cache(self) -> AssetCache:
+        return None if isinstance(self.executor, ProcessPoolExecutor) else self.cache
+
+    # cards也可以是占卜结果的tarot_info(TarotInfo), 此时不需要spread与is_reversed_list
+    # image_format为"JPEG"/"WEBP"/"PNG"时直接返回编码后的bytes, 为None时返回Image
+    # tier为RENDER_TIERS中的分辨率档位, 在缩小后的画布上直接绘制
+    async def draw(self, cards: list[dict] | TarotInfo, spread: dict = None, is_reversed_list: list = None, image_format: str = None, quality: int = DRAW_QUALITY, tier: str = "full") -> Image.Image | bytes:
+        if isinstance(cards, TarotInfo):
+            cards, spread, is_reversed_list = cards.cards, cards.spread, cards.is_reversed
+        factor = RENDER_TIERS[tier]
+        if image_format is not None:
+            image_format = TarotDraw._image_format(image_format)
         
-        base_img = Image.open(wallpaper_path).convert("RGBA")
+        wallpaper_path = f"{self.tarot_dir}/wallpaper.png"
         
         card_dir = f"{self.tarot_dir}/cards"
         
@@ -68,369 +205,987 @@ class TarotDraw:
             card = cards[index]
             card_id = card["id"]
             card_path = f"{card_dir}/{card_id}.jpg"
-            task = self._process_card(card_path, args, is_reversed_list[index])
+            task = self._process_card(card_path, args, is_reversed_list[index], factor)
             card_tasks.append(task)
         
         processed_cards = await asyncio.gather(*card_tasks)
         
         # Composite all cards onto base image
-        for card_img, position in processed_cards:
-            base_img.alpha_composite(card_img, dest=position)
-        
-        return base_img
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, TarotDraw._compose, wallpaper_path, processed_cards, self._worker_cache(), factor, image_format, quality)
 
-    async def _process_card(self, card_path: str, args: dict, is_reversed: bool) -> tuple:
-        card_img = Image.open(card_path).convert("RGBA")
+    # 预先解码背景图与牌面, 并生成spreads中所有位置的正逆位牌面
+    # 使用进程池时只会预热执行到任务的子进程
+    async def warmup(self, spreads: list[dict] = (), include_reversed: bool = True, tiers: tuple = ("full",)):
+        loop = asyncio.get_running_loop()
+        cache = self._worker_cache()
+        
+        card_dir = f"{self.tarot_dir}/cards"
+        card_paths = [f"{card_dir}/{name}" for name in sorted(os.listdir(card_dir)) if name.endswith(".jpg")]
+        
+        tasks = [loop.run_in_executor(self.executor, TarotDraw._load_image, path, cache) for path in card_paths]
+        tasks += [loop.run_in_executor(self.executor, TarotDraw._load_wallpaper, f"{self.tarot_dir}/wallpaper.png", cache, RENDER_TIERS[tier]) for tier in tiers]
+        await asyncio.gather(*tasks)
         
+        orientations = (False, True) if include_reversed else (False,)
+        for spread in spreads:
+            for tier in tiers:
+                tasks = [self._process_card(card_path, args, is_reversed, RENDER_TIERS[tier]) for args in spread["draw"] for card_path in card_paths for is_reversed in orientations]
+                await asyncio.gather(*tasks)
+
+    # factor为画布缩放比例, 位置与牌面大小随之缩放
+    async def _process_card(self, card_path: str, args: dict, is_reversed: bool, factor: float = 1.0) -> tuple:
         position_args = args["position"]
         rotate = args["rotate"]
-        scale = args["scale"]
-        
-        if is_reversed:
-            card_img = card_img.rotate(180, expand=True, resample=Image.Resampling.BICUBIC)
-        if not math.isclose(rotate, 0.0):
-            card_img = card_img.rotate(rotate, expand=True, resample=Image.Resampling.BICUBIC)
-        if not math.isclose(scale, 1.0):
-            new_size = (int(card_img.width * scale), int(card_img.height * scale))
-            resample = Image.Resampling.LANCZOS if scale < 1.0 else Image.Resampling.BICUBIC
-            card_img = card_img.resize(new_size, resample=resample)
-        
-        position = (int(position_args[0] - card_img.width / 2), int(position_args[1] - card_img.height / 2))
+        scale = args["scale"] * factor
+        
+        loop = asyncio.get_running_loop()
+        card_img = await loop.run_in_executor(self.executor, TarotDraw._card_sprite, card_path, rotate, scale, bool(is_reversed), self._worker_cache())
+        
+        position = (int(position_args[0] * factor - card_img.width / 2), int(position_args[1] * factor - card_img.height / 2))
         return (card_img, position)
 
+    # 统一图片格式名称
+    @staticmethod
+    def _image_format(image_format: str) -> str:
+        image_format = image_format.upper()
+        if image_format == "JPG":
+            image_format = "JPEG"
+        if image_format not in ("JPEG", "WEBP", "PNG"):
+            raise ValueError(f"unsupported image format: {image_format}")
+        return image_format
+
+    # 以下静态方法在线程池/进程池中执行, cache为None时使用所在进程的共享缓存
+
+    # 读取解码后的RGBA图片, reduce大于1时读取整数倍缩小的版本
+    @staticmethod
+    def _load_image(path: str, cache: AssetCache = None, reduce: int = 1) -> Image:
+        # 优先使用内存映射的图集
+        image = atlas_image(path, reduce=reduce)
+        if image is not None:
+            return image
+        
+        from PIL import Image
+        cache = cache if cache is not None else asset_cache
+        if reduce > 1:
+            return cache.get_or_create(("image", path, reduce), lambda: TarotDraw._load_image(path, cache).reduce(reduce))
+        return cache.get_or_create(("image", path), lambda: Image.open(path).convert("RGBA"))
+
+    # 读取旋转缩放后的牌面
+    @staticmethod
+    def _card_sprite(card_path: str, rotate: float, scale: float, is_reversed: bool, cache: AssetCache = None) -> Image:
+        cache = cache if cache is not None else asset_cache
+        return cache.get_or_create(("sprite", card_path, is_reversed, rotate, scale), lambda: TarotDraw._transform_card(card_path, rotate, scale, is_reversed, cache))
+
+    # 旋转缩放牌面
+    # 逆位翻转、旋转与缩放合并为一次仿射变换, 在目标分辨率的SPRITE_SUPERSAMPLE倍画布上采样后再缩小到目标尺寸,
+    # 不再对整张原图做两次旋转, 输出尺寸与依次旋转180°、旋转rotate、缩放scale的结果一致
+    @staticmethod
+    def _transform_card(card_path: str, rotate: float, scale: float, is_reversed: bool, cache: AssetCache = None) -> Image:
+        from PIL import Image
+        width, height = TarotDraw._load_image(card_path, cache).size
+        
+        angle = (rotate + 180 if is_reversed else rotate) % 360
+        
+        # 90°的整数倍只需缩放与无损翻转
+        for right_angle, method in ((0, None), (90, Image.Transpose.ROTATE_90), (180, Image.Transpose.ROTATE_180), (270, Image.Transpose.ROTATE_270), (360, None)):
+            if math.isclose(angle, right_angle):
+                reduce = TarotDraw._reduce_factor(scale)
+                # 图集中有逆位牌面时无需再翻转
+                card_img = atlas_image(card_path, True, reduce) if method == Image.Transpose.ROTATE_180 else None
+                if card_img is not None:
+                    method = None
+                else:
+                    card_img = TarotDraw._load_image(card_path, cache, reduce)
+                if (card_img.width, card_img.height) != (width, height) or not math.isclose(scale, 1.0):
+                    resample = Image.Resampling.LANCZOS if scale < 1.0 else Image.Resampling.BICUBIC
+                    card_img = card_img.resize((int(width * scale), int(height * scale)), resample=resample)
+                return card_img.transpose(method) if method is not None else card_img
+        
+        rotated_width, rotated_height = TarotDraw._rotated_size(width, height, rotate)
+        out_size = (int(rotated_width * scale), int(rotated_height * scale))
+        
+        supersample = SPRITE_SUPERSAMPLE if scale < 1.0 else 1
+        work_scale = scale * supersample
+        work_size = (out_size[0] * supersample, out_size[1] * supersample)
+        card_img = TarotDraw._load_image(card_path, cache, TarotDraw._reduce_factor(work_scale))
+        
+        # 工作画布坐标到输入坐标的仿射矩阵, 两者中心对齐
+        radians = -math.radians(angle)
+        cos, sin = math.cos(radians), math.sin(radians)
+        ratio_x = card_img.width / width / work_scale
+        ratio_y = card_img.height / height / work_scale
+        in_x, in_y = card_img.width / 2, card_img.height / 2
+        out_x, out_y = work_size[0] / 2, work_size[1] / 2
+        matrix = (
+            cos * ratio_x, sin * ratio_x, in_x - (cos * out_x + sin * out_y) * ratio_x,
+            -sin * ratio_y, cos * ratio_y, in_y - (-sin * out_x + cos * out_y) * ratio_y,
+        )
+        
+        if supersample > 1:
+            # 超采样后再抗锯齿缩小, 双线性插值即可
+            card_img = card_img.transform(work_size, Image.Transform.AFFINE, matrix, resample=Image.Resampling.BILINEAR)
+            return card_img.resize(out_size, resample=Image.Resampling.LANCZOS)
+        return card_img.transform(work_size, Image.Transform.AFFINE, matrix, resample=Image.Resampling.BICUBIC)
+
+    # 缩放到scale时可以先用的整数倍缩小图, 保证缩小图仍不低于目标分辨率的1.5倍
+    @staticmethod
+    def _reduce_factor(scale: float) -> int:
+        factor = 1
+        while scale * factor * 2 * 1.5 <= 1.0:
+            factor *= 2
+        return factor
+
+    # 与Image.rotate(expand=True)相同的外接矩形尺寸
+    @staticmethod
+    def _rotated_size(width: int, height: int, rotate: float) -> tuple:
+        radians = -math.radians(rotate % 360.0)
+        cos, sin = round(math.cos(radians), 15), round(math.sin(radians), 15)
+        center_x, center_y = width / 2, height / 2
+        xx = []
+        yy = []
+        for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+            xx.append(cos * (x - center_x) + sin * (y - center_y))
+            yy.append(-sin * (x - center_x) + cos * (y - center_y))
+        return (math.ceil(max(xx)) - math.floor(min(xx)), math.ceil(max(yy)) - math.floor(min(yy)))
+
+    # 读取缩放到画布比例的背景图
+    @staticmethod
+    def _load_wallpaper(path: str, cache: AssetCache = None, factor: float = 1.0) -> Image:
+        from PIL import Image
+        cache = cache if cache is not None else asset_cache
+        wallpaper = TarotDraw._load_image(path, cache)
+        if math.isclose(factor, 1.0):
+            return wallpaper
+        size = (int(wallpaper.width * factor), int(wallpaper.height * factor))
+        return cache.get_or_create(("wallpaper", path, factor), lambda: wallpaper.resize(size, resample=Image.Resampling.LANCZOS))
+
+    # 按顺序把牌面贴到背景图上, image_format不为None时编码为bytes
+    @staticmethod
+    def _compose(wallpaper_path: str, processed_cards: list, cache: AssetCache = None, factor: float = 1.0, image_format: str = None, quality: int = DRAW_QUALITY) -> Image.Image | bytes:
+        # 缓存中的图片是共享的, 需要复制一份再绘制
+        base_img = TarotDraw._load_wallpaper(wallpaper_path, cache, factor).copy()
+        for card_img, position in processed_cards:
+            base_img.alpha_composite(card_img, dest=position)
+        
+        if image_format is None:
+            return base_img
+        
+        # 背景图不透明, 去掉alpha通道可以减小体积并加快编码
+        buffer = io.BytesIO()
+        base_img = base_img.convert("RGB")
+        if image_format == "PNG":
+            base_img.save(buffer, format="PNG", compress_level=DRAW_PNG_COMPRESS_LEVEL)
+        else:
+            base_img.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue()
+
+class TarotScheduler:
+    """有界的异步请求调度器
+
+    同时最多进行 max_concurrency 个占卜, 其余请求按先来后到进入长度为 max_queue 的等待队列,
+    排队超过 queue_timeout 秒或队列已满时才会被拒绝
+    """
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE_SIZE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_concurrency: int = max(1, max_concurrency)
+        self.max_queue: int = max(0, max_queue)
+        self.queue_timeout: float = queue_timeout
+        self.running: int = 0 # 正在占卜的数量
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        # 正在排队的数量
+        return len(self._waiters)
+
+    @property
+    def is_full(self) -> bool:
+        # 占卜位与等待队列均已满
+        return self.running >= self.max_concurrency and self.queue_depth >= self.max_queue
+
+    def position(self, waiter: asyncio.Future) -> int:
+        # 排在该请求前面的人数, 不在队列中返回-1
+        try:
+            return self._waiters.index(waiter)
+        except ValueError:
+            return -1
+
+    # 获取占卜位, 队列已满或排队超时返回False
+    async def acquire(self, timeout: float = None, on_queued=None) -> bool:
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            return True
+
+        if self.queue_depth >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if on_queued is not None:
+            on_queued(len(self._waiters) - 1)
+
+        if timeout is None:
+            timeout = self.queue_timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.__abandon(waiter)
+        except asyncio.CancelledError:
+            if self.__abandon(waiter):
+                self.release()
+            raise
+
+    # 放弃排队, 若在放弃的同时已被分配到占卜位则返回True
+    def __abandon(self, waiter: asyncio.Future) -> bool:
+        if waiter.done() and not waiter.cancelled():
+            return True
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    # 释放占卜位, 直接交给队首的请求
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.running -= 1
+
 class Tarot:
-    def __init__(self, model: str, url: str = DEFAULT_CONNECT_URL):
-        self.is_busy = False # 是否繁忙
-        self.tarot_data = None
+    # url为Ollama地址, 也可以是地址或{"host", "model", "api_key"}的列表, 请求会分配给最空闲的主机
+    # reading_timeout为每次占卜的截止时间(秒), policy为大模型请求的重试与对冲策略
+    # metrics为耗时与用量统计, 默认使用进程共享的统计
+    # cache为小牌阵的解读缓存, 默认不缓存
+    # keep_alive为模型在Ollama中常驻的时间, 随每次请求发送
+    # sessions为追问会话, 默认每个Tarot单独保存
+    # 选择牌阵与解读可以使用不同的模型与主机: select_model/select_url为选择牌阵的模型与Ollama地址, None为与解读相同,
+    # 主机在url中指定了model时以主机的为准. select_options/reading_options为两个阶段的请求参数(Ollama的options)
+    # structured_select为True时选择牌阵的回答被限制为牌阵key之一
+    def __init__(self, model: str, url: str | list = DEFAULT_CONNECT_URL, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE_SIZE, queue_timeout: float = QUEUE_TIMEOUT, local_select: bool = LOCAL_SPREAD_SELECT, store: DeckStore = None, reading_timeout: float = READING_TIMEOUT, policy: RequestPolicy = None, metrics: TarotMetrics = None, cache: InterpretationCache = None, keep_alive: str | float = MODEL_KEEP_ALIVE, sessions: SessionStore = None, select_model: str = SELECT_MODEL, select_url: str | list = None, select_options: dict = SELECT_OPTIONS, reading_options: dict = READING_OPTIONS, structured_select: bool = SELECT_STRUCTURED_OUTPUT):
+        self.scheduler = TarotScheduler(max_concurrency, max_queue, queue_timeout) # 请求调度
+        self.reading_timeout = reading_timeout
+        self.policy = policy if policy is not None else RequestPolicy()
+        self.metrics = metrics if metrics is not None else reading_metrics
         
-        with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
-            self.tarot_data = json.load(file)
+        # 取值函数以Tarot为参数, 统计只保存弱引用, close后或被回收时移除
+        self.metrics.add_gauge("tarot_running", "Readings holding a slot.", lambda tarot: tarot.scheduler.running, owner=self)
+        self.metrics.add_gauge("tarot_queue_depth", "Readings waiting for a slot.", lambda tarot: tarot.scheduler.queue_depth, owner=self)
+        self.metrics.add_gauge("tarot_llm_retries_total", "LLM requests retried since start.", lambda tarot: tarot.policy.retried, "counter", self)
+        self.metrics.add_gauge("tarot_llm_hedged_total", "Hedged LLM requests since start.", lambda tarot: tarot.policy.hedged, "counter", self)
+        self.metrics.add_gauge("tarot_cache_hits_total", "Readings answered from the interpretation cache.", lambda tarot: tarot.cache.hits if tarot.cache is not None else 0, "counter", self)
+        self.metrics.add_gauge("tarot_cache_misses_total", "Cacheable readings sent to the LLM.", lambda tarot: tarot.cache.misses if tarot.cache is not None else 0, "counter", self)
+        self.metrics.add_gauge("tarot_cache_entries", "Interpretations stored in the cache.", lambda tarot: tarot.cache.entries if tarot.cache is not None else 0, owner=self)
+        self.metrics.add_gauge("tarot_sessions", "Follow-up sessions kept in memory.", lambda tarot: len(tarot.sessions), owner=self)
+        self.metrics.add_gauge("tarot_session_bytes", "Conversation text held by follow-up sessions.", lambda tarot: tarot.sessions.size, owner=self)
+        self.local_select = local_select # 是否先在本地选择牌阵
+        self.store = store if store is not None else DeckStore.shared() # 进程共享的牌组
+        self.cache = cache
+        self.sessions = sessions if sessions is not None else SessionStore()
         
         self.model = model
-        self.client = ollama.AsyncClient(host=url)
+        self.keep_alive = keep_alive
+        self.client = OllamaPool.from_hosts(url)
+        self.reading_options = reading_options
+        self._closing: set[asyncio.Task] = set() # updateClient替换后等待关闭的连接池
+        
+        self.select_model = select_model
+        self.select_client = OllamaPool.from_hosts(select_url) if select_url is not None else None
+        self.select_options = select_options
+        self.structured_select = structured_select
+
+    # 是否繁忙(占卜位与等待队列均已满)
+    @property
+    def is_busy(self) -> bool:
+        return self.scheduler.is_full
 
-    # 重新加载数据
+    # 正在排队的数量
+    @property
+    def queue_depth(self) -> int:
+        return self.scheduler.queue_depth
+
+    # 当前的牌组数据
+    @property
+    def tarot_data(self) -> dict:
+        return self.store.snapshot.data
+
+    # 预编译的牌组索引
+    @property
+    def deck_index(self) -> DeckIndex:
+        return self.store.snapshot.index
+
+    @property
+    def spread_selector(self) -> SpreadSelector:
+        return self.store.snapshot.selector
+
+    # 重新加载数据, 所有共享该牌组的Tarot都会使用新数据
     def reloadTarot(self):
-        with open(TAROT_DATA_PATH, 'r', encoding='utf-8') as file:
-            self.tarot_data = json.load(file)
+        self.store.reload()
+
+    # 在线程中重新加载数据, 不阻塞事件循环, 进行中的占卜仍使用旧数据
+    async def reloadTarotAsync(self):
+        await self.store.reload_async()
     
     # 更新链接客服端
-    def updateClient(self, model: str, url: str = DEFAULT_CONNECT_URL):
+    # select_model/select_url/select_options/reading_options为None时保持不变, 见__init__
+    # 被替换的连接池在正在进行的请求结束后关闭, 原来有健康检查时新的连接池也会启动健康检查
+    def updateClient(self, model: str, url: str | list = DEFAULT_CONNECT_URL, select_model: str = None, select_url: str | list = None, select_options: dict = None, reading_options: dict = None):
+        old_clients = self.clients
         self.model = model
-        self.client = ollama.AsyncClient(host=url)
-
-    # 属性文本处理
-    def __handle_element_text(self, element, a_mod: bool = False, total_zodiacs_key: set = set()):
-        result_text = ""
-        
-        element_name_cn = element["name_cn"]
-                
-        gender = element["genderCN"]
-        color = ", ".join(element["colorsCN"])
-        animals = element['animals']
-        expression = element['expression']
-        attribute = element['attribute']
-        meaning = element['meaning']
-                
-        result_text += f"元素:{element_name_cn},能量属性:{gender},颜色:{color},生物:{animals},表达:{expression},属性:{attribute},含义:{meaning}"
-        if a_mod:
-            zodiac = element['zodiac']
-            total_zodiacs_key.update(zodiac)
-            zodiac_cn = ", ".join(element['zodiacCN'])
-            result_text += f",元素对应星座:{zodiac_cn}"
-        
-        return result_text
-
-    # 选择一套牌阵
-    async def select_spreads(self, message: str):
-        spreads_text = "可选的牌阵有:"
-        
-        spreads = self.tarot_data['spreads']
-        
-        for spread_id, info in spreads.items():
-            spreads_text += f"\n{spread_id}: [\"{info['name_cn']}\", \"{info['description_cn']}\"]"
+        self.client = OllamaPool.from_hosts(url)
+        if select_model is not None:
+            self.select_model = select_model
+        if select_url is not None:
+            self.select_client = OllamaPool.from_hosts(select_url)
+        if select_options is not None:
+            self.select_options = select_options
+        if reading_options is not None:
+            self.reading_options = reading_options
+        self.__retire_clients(old_clients)
+
+    def __retire_clients(self, old_clients: list[OllamaPool]):
+        health_checking = False
+        for client in old_clients:
+            if client in self.clients:
+                continue
+            health_checking = health_checking or client.health_checking
+            client.stop_health_checks()
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 没有运行中的事件循环时也没有进行中的请求, 连接随客户端一起回收
+                continue
+            task = loop.create_task(client.close(drain=True))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        if health_checking:
+            for client in self.clients:
+                client.start_health_checks()
+
+    # 选择牌阵使用的连接池
+    @property
+    def selection_client(self) -> OllamaPool:
+        return self.select_client if self.select_client is not None else self.client
+
+    # 所有连接池, 选择牌阵与解读使用同一个时只有一个
+    @property
+    def clients(self) -> list[OllamaPool]:
+        return [self.client] if self.select_client is None else [self.client, self.select_client]
+
+    # 关闭所有连接池
+    async def close(self):
+        self.metrics.remove_gauges(self)
+        for client in self.clients:
+            await client.close()
+        await asyncio.gather(*self._closing)
+
+    # 启动后、接收请求前预热, 返回各步骤的耗时(秒): deck, text, model, prime, draw, total
+    # 加载牌组并编译文本清洗的正则, 让每台主机加载模型并按keep_alive常驻,
+    # prime为True时把固定的系统提示词发给每台主机, 第一次占卜可以复用已计算的提示词前缀,
+    # tarot_draw不为None时同时预先解码背景图与牌面
+    # 预热失败的主机会被标记为不可用, 不会抛出异常
+    async def warmup(self, tarot_draw: TarotDraw = None, prime: bool = True) -> dict:
+        timings = {}
+        start = time.perf_counter()
+        
+        with stage(timings, "deck"):
+            snapshot = self.store.snapshot
+        with stage(timings, "text"):
+            for cleaner in (message_cleaner, reading_cleaner, punctuation_cleaner):
+                cleaner.pattern
+        
+        # 解码图片在线程池中进行, 与加载模型同时进行
+        draw_task: asyncio.Task = None
+        if tarot_draw is not None:
+            async def warmup_draw():
+                with stage(timings, "draw"):
+                    await tarot_draw.warmup()
+            draw_task = asyncio.ensure_future(warmup_draw())
+        
+        # 只有提示词前缀相同才能复用, 与占卜时的messages开头一致
+        reading_prompts = [[{"role": "system", "content": TAROT_MASTER_CONTENT(a_mod)}] for a_mod in (False, True)]
+        select_prompts = [[{"role": "system", "content": TAROT_SPREADS + snapshot.index.spreads_text}]]
+        
+        # (连接池, 主机, 模型, 提示词), 选择牌阵使用单独的模型或主机时分别预热
+        jobs = []
+        if self.select_client is None and self.select_model is None:
+            jobs += [(self.client, backend, backend.model or self.model, reading_prompts + select_prompts) for backend in self.client.backends]
+        else:
+            jobs += [(self.client, backend, backend.model or self.model, reading_prompts) for backend in self.client.backends]
+            jobs += [(self.selection_client, backend, backend.model or self.select_model or self.model, select_prompts) for backend in self.selection_client.backends]
+        
+        async def warmup_backend(backend: OllamaBackend, model: str, prompts: list):
+            with stage(timings, "model"):
+                await backend.client.generate(model=model, keep_alive=self.keep_alive)
+            if prime:
+                with stage(timings, "prime"):
+                    for messages in prompts:
+                        await backend.client.chat(model=model, messages=messages, options={"num_predict": 1}, keep_alive=self.keep_alive)
+        
+        try:
+            # 各主机同时进行, model与prime为各主机耗时之和
+            results = await asyncio.gather(*(warmup_backend(backend, model, prompts) for __, backend, model, prompts in jobs), return_exceptions=True)
+            for (client, backend, __, __), error in zip(jobs, results):
+                if isinstance(error, Exception):
+                    backend.mark_failure(error, client.failure_cooldown)
+                elif isinstance(error, BaseException):
+                    raise error
+                else:
+                    backend.mark_success()
+            if draw_task is not None:
+                await draw_task
+        finally:
+            if draw_task is not None and not draw_task.done():
+                draw_task.cancel()
+        
+        timings["total"] = time.perf_counter() - start
+        return timings
+
+    # 选择一套牌阵, 本地把握足够时不再询问大模型
+    async def select_spreads(self, message: str, snapshot: DeckSnapshot = None, deadline: Deadline = None):
+        if snapshot is None:
+            snapshot = self.store.snapshot
+        
+        if self.local_select:
+            spread_key = snapshot.selector.select(message)
+            if spread_key is not None:
+                return spread_key
+        
+        return await self.select_spreads_llm(message, snapshot, deadline)
+
+    # 让大模型选择一套牌阵, 使用选择牌阵的模型、主机与请求参数
+    # 回答是有效的牌阵key时记入本地选择器的缓存, 无法解析而使用默认牌阵时不记录
+    async def select_spreads_llm(self, message: str, snapshot: DeckSnapshot = None, deadline: Deadline = None):
+        if snapshot is None:
+            snapshot = self.store.snapshot
+        spreads = snapshot.data['spreads']
+        client = self.selection_client
+        model = self.select_model or self.model
+        # 结构化输出时模型只能生成牌阵列表中的key, client也可以是单个ollama.AsyncClient
+        output_format = snapshot.index.spread_schema if self.structured_select and getattr(client, "structured_output", True) else None
         
         messages = [
             {
                 "role": "system",
-                "content": TAROT_SPREADS + spreads_text,
+                "content": TAROT_SPREADS + snapshot.index.spreads_text,
             },
             {
                 "role": "user",
                 "content": message,
             },
         ]
-        response = await self.client.chat(model=self.model, messages=messages)
+        request = lambda output_format: self.policy.call("select", lambda: client.chat(model=model, messages=messages, format=output_format, options=self.select_options, keep_alive=self.keep_alive), deadline, SELECT_TIMEOUT)
+        try:
+            response = await request(output_format)
+        except Exception as error:
+            if output_format is None or not is_format_rejected(error):
+                raise
+            # 旧版Ollama不支持JSON Schema, 不限制格式重试一次, 成功后这个连接池不再使用结构化输出
+            # 其他原因的400(提示词有误、代理出错等)照常抛出, 不影响之后的结构化输出
+            response = await request(None)
+            client.structured_output = False
+        self.metrics.observe_usage("select", usage_of(response))
         
-        out_spread_key = TarotUtils.keep_english_digits(response['message']['content'].strip())
+        out_spread_key = TarotUtils.spread_key_of(response['message']['content'])
         
         if out_spread_key not in spreads:
-            out_spread_key = DEFAULT_SPREAD_KEY
+            return DEFAULT_SPREAD_KEY
         
+        snapshot.selector.remember(message, out_spread_key)
         return out_spread_key
         
-    def __getTarotInfo(self, spread_key, card_keys, elem_keys, court_elem_corr_keys, ast_mod_keys, zodiacs_keys, is_reversed_list):
-        datas = {
-            "spread": self.tarot_data['spreads'][spread_key],
-            "cards": {},
-            "is_reversed_list": is_reversed_list,
-            "astrologyModality": {},
-            "courtElementalCorrespondence": {},
-            "zodiacs": {},
-            "elements": {}
-        }
-        
-        for card_key in card_keys:
-            datas["cards"][card_key] = self.tarot_data["cards"][card_key]
-            
-        for elem_key in elem_keys:
-            datas["elements"][elem_key] = self.tarot_data["elements"][elem_key]
-            
-        for court_elem_corr_key in court_elem_corr_keys:
-            datas["courtElementalCorrespondence"][court_elem_corr_key] = self.tarot_data["courtElementalCorrespondence"][court_elem_corr_key]
-            
-        for ast_mod_key in ast_mod_keys:
-            datas["astrologyModality"][ast_mod_key] = self.tarot_data["astrologyModality"][ast_mod_key]
-            
-        for zodiacs_key in zodiacs_keys:
-            datas["zodiacs"][zodiacs_key] = self.tarot_data["zodiacs"][zodiacs_key]
+    # 排队获取占卜位, 失败时写入繁忙提示
+    async def __acquire(self, result: TarotContent, queue_timeout: float, on_queued) -> bool:
+        def queued(position: int):
+            result.queue_position = position + 1
+            if on_queued is not None:
+                on_queued(position)
         
-        return datas
+        with stage(result.timings, "queue"):
+            acquired = await self.scheduler.acquire(queue_timeout, queued)
+        if not acquired:
+            result.fail(TarotFailure.BUSY, random.choice(BUSY_TIPS))
+            return False
+        return True
 
     # user_message想要询问的信息, a_mod是否开启占星模式
-    # is_busy为是否繁忙
+    # is_busy为True时直接返回繁忙提示
     # card_select为卡牌选择模式,默认为78张塔罗牌全部选择,1为22张大阿尔卡那,2为56张小阿尔卡那
-    async def divination(self, user_message: str, a_mod: bool = False, is_busy: bool = None, card_select: int = 0) -> TarotContent:
-        if is_busy is not None:
-            self.is_busy = is_busy
+    # spread_key为指定的牌阵,默认根据提问选择
+    # queue_timeout为本次请求最长排队时间(秒),默认使用调度器的设置
+    # on_queued为需要排队时的回调,参数为前面排队的人数
+    # timeout为本次占卜的截止时间(秒),从拿到占卜位开始计算,默认使用reading_timeout
+    # 失败时result.failure_reason为TarotFailure中的原因
+    # result.timings为各阶段耗时(秒): queue, remove_emojis, select_spreads, build_prompt, cache, chat, first_token(流式), postprocess, draw, total
+    # 开启缓存且命中时result.cached为True, 不会调用大模型
+    # keep_session为True时保留这次占卜的对话, 成功后result.session_id为追问会话的id, 见follow_up
+    async def divination(self, user_message: str, a_mod: bool = False, is_busy: bool = None, card_select: int = 0, queue_timeout: float = None, on_queued=None, timeout: float = None, spread_key: str = None, keep_session: bool = False) -> TarotContent:
+        start = time.perf_counter()
         result: TarotContent = TarotContent()
-        result_texts = None
-        complete_text = None
-        failure_tips = None
-        tarot_info = None
-        tarot_text = None
-        is_complete = False
-        
-        #######################
-        # 基本塔罗牌
-        # 阵形
-        spreads = self.tarot_data['spreads']
-        # 塔罗牌
-        tarot_cards = self.tarot_data['cards']
-
-
-        # 元素
-        elements = self.tarot_data['elements']
-        # 宫廷
-        court_elemental_correspondence = self.tarot_data['courtElementalCorrespondence']
-
-        #######################
-        # 占星模式
-        # 占星术情态
-        astrology_modality = self.tarot_data['astrologyModality']
-        # 十二星座
-        zodiacs = self.tarot_data['zodiacs']
-        # if True:
-        is_reversed_list = []
+        
+        if is_busy:
+            result.fail(TarotFailure.BUSY, random.choice(BUSY_TIPS))
+            self.__finish(result, start)
+            return result
+        
+        if not await self.__acquire(result, queue_timeout, on_queued):
+            self.__finish(result, start)
+            return result
+        
+        try:
+            await self.__divination(result, user_message, a_mod, card_select, spread_key, self.__deadline(timeout), keep_session=keep_session)
+        finally:
+            self.scheduler.release()
+            self.__finish(result, start)
+        
+        return result
 
+    # divination的流式版本, 每生成完一句话就立即yield清洗后的句子
+    # 牌阵与抽牌结果会在第一句话之前写入result, 失败时result.failure_text不为空且不会yield任何内容
+    async def divination_stream(self, user_message: str, a_mod: bool = False, card_select: int = 0, result: TarotContent = None, queue_timeout: float = None, on_queued=None, timeout: float = None, spread_key: str = None, keep_session: bool = False):
+        start = time.perf_counter()
+        if result is None:
+            result = TarotContent()
+        
+        if not await self.__acquire(result, queue_timeout, on_queued):
+            self.__finish(result, start)
+            return
+        
         try:
-            if self.is_busy:
-                result.failure_text = random.choice(BUSY_TIPS)
-                return result
-                
-            self.is_busy = True
-            
-            user_message = user_message
-            user_message = TarotUtils.remove_emojis(user_message)
-            
-            # 啥啊这是
-            if len(user_message) <= 0:
-                result.failure_text = random.choice(NONE_TEXT_TIPS)
-                return result
-            elif len(user_message) > MAX_LENGTH:
-                result.failure_text = TOO_LONG_TIP
-                return result
-            
-            spread_key = await self.select_spreads(user_message)
-            
-            spread = spreads[spread_key]
-            
-            spread_name = spread["name_cn"]
-            spread_description = spread["description_cn"]
-            spread_positions = spread["positions"]
-            card_count = len(spread_positions)
-            
-            tarot_cards_keys = list(tarot_cards.keys())
-            if card_select == 1:
-                tarot_cards_keys = tarot_cards_keys[:22]
-            if card_select == 2:
-                tarot_cards_keys = tarot_cards_keys[-56:]
+            async for text in self.__divination_stream(result, user_message, a_mod, card_select, spread_key, self.__deadline(timeout), keep_session):
+                yield text
+        finally:
+            self.scheduler.release()
+            self.__finish(result, start)
 
-            random_cards = random.sample(tarot_cards_keys, card_count)
-            
-            # 塔罗
-            tarot_texts = f"塔罗牌阵讯息:\n{spread_name}: {spread_description}\n"
-            
-            show_text = f"{spread_name}: {spread_description}"
-            
-            total_court_elemental_correspondence_keys = set()
-            total_elements = set()
-            total_zodiacs_key = set()
+    # 占卜并同时绘制牌阵图片, 图片在抽完牌后立即开始绘制, 与大模型解读同时进行
+    # 返回(占卜结果, 牌阵图片), 任意一方失败时另一方会被取消, 图片为None
+    # image_format与tier见TarotDraw.draw
+    async def divination_with_image(self, user_message: str, a_mod: bool = False, card_select: int = 0, tarot_draw: TarotDraw = None, image_format: str = None, tier: str = "full", queue_timeout: float = None, on_queued=None, timeout: float = None, spread_key: str = None, keep_session: bool = False) -> tuple:
+        start = time.perf_counter()
+        if tarot_draw is None:
+            tarot_draw = TarotDraw(RESOURCES_PATH)
+        result: TarotContent = TarotContent()
+        draw_task: asyncio.Task = None
+        draw_start = 0.0
+        
+        if not await self.__acquire(result, queue_timeout, on_queued):
+            self.__finish(result, start)
+            return result, None
+        
+        try:
+            def start_draw():
+                nonlocal draw_task, draw_start
+                draw_start = time.perf_counter()
+                draw_task = asyncio.ensure_future(tarot_draw.draw(result.tarot_info, image_format=image_format, tier=tier))
+                draw_task.add_done_callback(on_drawn)
             
-            for index, card in enumerate(spread_positions):
-                name_cn = card["name_cn"]
-                description_cn = card["description_cn"]
-                tarot_texts += f"\n{index + 1}. {name_cn}: {description_cn}"
-                tarot_card_key = random_cards[index] # 塔罗牌索引
-                tarot_card = tarot_cards[tarot_card_key] # 塔罗牌
-                is_reversed = random.choice([True, False]) # 是否为逆位
-                is_reversed_list.append(is_reversed)
-                card_name = tarot_card["card_name_cn"] # 塔罗牌名字
-                card_id = tarot_card["id"]
-
-
-                # 第一元素
-                first_element = tarot_card["first_element"]
-                # 第二元素
-                second_element = tarot_card["second_element"]
-                # 宫廷元素
-                court_elemental = None
-
-                court_elemental_correspondence_keys = court_elemental_correspondence.keys()
-                
-                for court_elemental_correspondence_key in court_elemental_correspondence_keys:
-                    total_court_elemental_correspondence_keys.add(court_elemental_correspondence_key)
-                    # 宫廷牌属性
-                    if tarot_card_key.lower().startswith(court_elemental_correspondence_key):
-                        court_elemental = court_elemental_correspondence[court_elemental_correspondence_key]
-
-                card_description = ""
-
-                if is_reversed: # 逆位
-                    card_description = tarot_card["reversed_cn"]
-                    card_name = "逆" + card_name
-                else: # 正位
-                    card_description = tarot_card["upright_cn"]
-                    card_name = "正" + card_name
-                
-                show_text += f"\n#{index + 1} {name_cn}: {description_cn}\n{card_name}"
-                tarot_texts += f"\n{card_name}: {card_description}"
-                
-                if first_element:
-                    first_element_cn = tarot_card["first_element_cn"]
-                    total_elements.add(first_element)
-                    element = elements[first_element]
-                    tarot_texts += f"\n第一元素:{first_element_cn}," + self.__handle_element_text(element, a_mod, total_zodiacs_key)
-                if second_element:
-                    second_element_cn = tarot_card["second_element_cn"]
-                    total_elements.add(first_element)
-                    element = elements[first_element]
-                    tarot_texts += f"\n第二元素:{second_element_cn}," + self.__handle_element_text(element, a_mod, total_zodiacs_key)
-                if court_elemental:
-                    court_name = court_elemental["nameCN"]
-                    court_element = court_elemental["element"]
-                    court_element_cn = court_elemental["elementCN"]
-                    court_meaning = court_elemental["meaning"]
-                    total_elements.add(court_element)
-                    element = elements[court_element]
-                    tarot_texts += f"\n宫廷元素:{court_element_cn},{court_name}含义:{court_meaning}," + self.__handle_element_text(element, a_mod, total_zodiacs_key)
+            # 绘制失败时不必再等待大模型
+            def on_drawn(task: asyncio.Task):
+                if not task.cancelled():
+                    result.timings["draw"] = time.perf_counter() - draw_start
+                if not task.cancelled() and task.exception() is not None:
+                    result.fail(TarotFailure.DRAW_FAILED, ERROR_TIP, repr(task.exception()))
+                    reading.cancel()
             
-            spread_interpretation = spread["interpretation_method_cn"]
-            tarot_texts += f"\n阵型解释:{spread_interpretation}"
+            reading = asyncio.ensure_future(self.__divination(result, user_message, a_mod, card_select, spread_key, self.__deadline(timeout), start_draw, keep_session=keep_session))
+            # 等待解读结束但不接收它的取消, 解读只会因绘制失败被on_drawn取消, 此时result已记录DRAW_FAILED
+            try:
+                await asyncio.wait((reading,))
+            except asyncio.CancelledError as error:
+                # 调用方取消时一并取消解读
+                reading.cancel()
+                self.__failed(result, error)
+                raise
             
-            if "all" in total_zodiacs_key and a_mod:
-                total_zodiacs_key = {"Aries", "Leo", "Sagittarius", "Taurus","Virgo","Capricorn", "Gemini","Libra","Aquarius", "Cancer","Scorpio","Pisces"}
+            if reading.cancelled() or not result.is_complete or draw_task is None:
+                return result, None
             
-            # 占星
-            zodiacs_text = ""
+            try:
+                image = await draw_task
+            except Exception as error:
+                result.fail(TarotFailure.DRAW_FAILED, ERROR_TIP, repr(error))
+                return result, None
             
-            total_astrology_modality_keys = set()
+            return result, image
+        finally:
+            if draw_task is not None and not draw_task.done():
+                draw_task.cancel()
+            self.scheduler.release()
+            self.__finish(result, start)
+
+    # 在占卜后追问, 占卜时需要keep_session=True, session_id为占卜结果的result.session_id
+    # 不重新选择牌阵与抽牌, 只把新的问题加入之前的对话, 并发给解读时的主机以复用已计算的对话前缀
+    # 会话不存在或已失效时result.failure_reason为TarotFailure.SESSION_EXPIRED
+    # 牌阵与抽牌结果同占卜时一样写入result, result.timings: queue, remove_emojis, chat, first_token(流式), postprocess, total
+    # 其余参数与divination相同
+    async def follow_up(self, session_id: str, user_message: str, queue_timeout: float = None, on_queued=None, timeout: float = None) -> TarotContent:
+        start = time.perf_counter()
+        result: TarotContent = TarotContent()
+        
+        session = self.__session(result, session_id)
+        if session is None or not await self.__acquire(result, queue_timeout, on_queued):
+            self.__finish(result, start)
+            return result
+        
+        try:
+            await self.__follow_up(result, session, user_message, self.__deadline(timeout))
+        finally:
+            self.scheduler.release()
+            self.__finish(result, start)
+        
+        return result
+
+    # follow_up的流式版本, 与divination_stream相同
+    async def follow_up_stream(self, session_id: str, user_message: str, result: TarotContent = None, queue_timeout: float = None, on_queued=None, timeout: float = None):
+        start = time.perf_counter()
+        if result is None:
+            result = TarotContent()
+        
+        session = self.__session(result, session_id)
+        if session is None or not await self.__acquire(result, queue_timeout, on_queued):
+            self.__finish(result, start)
+            return
+        
+        try:
+            async for text in self.__follow_up_stream(result, session, user_message, self.__deadline(timeout)):
+                yield text
+        finally:
+            self.scheduler.release()
+            self.__finish(result, start)
+
+    # 结束追问会话
+    def close_session(self, session_id: str):
+        self.sessions.remove(session_id)
+
+    # 空闲时为小牌阵预先生成解读, 直到每种抽牌结果都存满缓存, 返回生成的解读数
+    # 有占卜进行中或排队时等待idle_interval秒再检查, 大模型出错或牌组重新加载时停止
+    # spread_keys默认为缓存接受的所有牌阵
+    async def pregenerate(self, questions: tuple = INTERPRETATION_CACHE_QUESTIONS, spread_keys: list = None, a_mod: bool = False, card_select: int = 0, idle_interval: float = INTERPRETATION_CACHE_IDLE_INTERVAL) -> int:
+        if self.cache is None:
+            return 0
+        
+        snapshot = self.store.snapshot
+        deck_index = snapshot.index
+        if spread_keys is None:
+            spread_keys = [spread_key for spread_key, spread in deck_index.spreads.items() if self.cache.accepts(spread.card_count)]
+        tarot_cards_keys = deck_index.card_keys.get(card_select, deck_index.card_keys[0])
+        
+        generated = 0
+        for question in questions:
+            user_message = TarotUtils.remove_emojis(question)
+            for spread_key in spread_keys:
+                card_count = deck_index.spreads[spread_key].card_count
+                for card_keys in itertools.permutations(tarot_cards_keys, card_count):
+                    for is_reversed_list in itertools.product((False, True), repeat=card_count):
+                        cache_key = self.__cache_key(snapshot, user_message, TarotInfo(snapshot, spread_key, card_keys, is_reversed_list, a_mod))
+                        while self.cache.count(cache_key) < self.cache.variants:
+                            # 只在空闲时占用占卜位
+                            while self.scheduler.running > 0 or self.scheduler.queue_depth > 0:
+                                await asyncio.sleep(idle_interval)
+                            await self.scheduler.acquire()
+                            
+                            result = TarotContent()
+                            try:
+                                await self.__divination(result, question, a_mod, card_select, spread_key, self.__deadline(), cards=(card_keys, is_reversed_list))
+                            finally:
+                                self.scheduler.release()
+                            # 牌组已重新加载时key也会变化, 交给下一次预先生成
+                            if not result.is_complete or not result.result_texts or self.store.snapshot is not snapshot:
+                                return generated
+                            generated += 1
+        return generated
+
+    # 占卜结束, 记录总耗时并汇总统计
+    def __finish(self, result: TarotContent, start: float):
+        result.timings["total"] = time.perf_counter() - start
+        self.metrics.observe_reading(result)
+
+    def __deadline(self, timeout: float = None) -> Deadline:
+        return Deadline(timeout if timeout is not None else self.reading_timeout)
+
+    # 记录失败原因, 已有原因(例如绘制失败导致取消)时保留
+    @staticmethod
+    def __failed(result: TarotContent, error: BaseException):
+        if result.failure_reason is None:
+            result.fail(TarotFailure.classify(error), ERROR_TIP, repr(error))
+
+    # on_prepared为抽完牌、调用大模型之前的回调
+    # cards为指定的(牌, 是否逆位)列表, 用于预先生成解读
+    # keep_session为True时成功后保留对话, 供追问使用
+    async def __divination(self, result: TarotContent, user_message: str, a_mod: bool, card_select: int, spread_key: str, deadline: Deadline, on_prepared=None, cards: tuple = None, keep_session: bool = False):
+        affinity = Affinity() if keep_session else None
+        try:
+            prepared = await self.__prepare(result, user_message, a_mod, card_select, spread_key, deadline, cards)
+            if prepared is None:
+                return result
+            messages, cache_key = prepared
             
+            if on_prepared is not None:
+                on_prepared()
             
-            if a_mod:
-                zodiacs_text = "占星讯息:"
-                zodiacs_text_info = ""
-                for zodiacs_key in total_zodiacs_key:
-                    zodiac = zodiacs[zodiacs_key]
-                    astrology_modality_key = zodiac['astrologyModality'] # 占星模式
-                    total_astrology_modality_keys.add(astrology_modality_key)
-                    
-                    zodiac_name = zodiac['zodiacCN'] # 星座名称
-                    astrology_modality_cn = zodiac['astrologyModalityCN'] # 占星模式cn
-                    element_cn = zodiac['elementCN'] # 元素
-                    season_cn = zodiac['seasonCN'] # 季节
-                    nature = zodiac['nature'] # 本质 
-                    ruling_body_modern = zodiac['rulingBodyModern'] # 现代守护星
-                    ruling_body_traditional = zodiac['rulingBodyTraditional'] # 古典守护星
-                    
-                    zodiacs_text_info += f"\n{zodiac_name}: {astrology_modality_cn}\n元素:{element_cn},季节:{season_cn},本质:{nature}"
-                    
-                    if ruling_body_traditional:
-                        zodiacs_text_info += f",现代守护星: {ruling_body_modern}, 古典守护星: {ruling_body_traditional}"
-                    else:
-                        zodiacs_text_info += f",守护星: {ruling_body_modern}"
-                
-                astrology_modality_info = ""
-                for total_astrology_modality_key in total_astrology_modality_keys:
-                    astrology_modality_value = astrology_modality[total_astrology_modality_key]
-                    name_cn = astrology_modality_value["name_cn"] # 占星模式cn
-                    card = astrology_modality_value["cardCN"] # 对应宫廷牌
-                    attribute = astrology_modality_value["attribute"] # 属性
-                    meaning = astrology_modality_value["meaning"] # 含义
-                    
-                    astrology_modality_info += f"\n{name_cn},对应宫廷牌:{card},属性:{attribute},含义:{meaning}"
-                
-                zodiacs_text += astrology_modality_info + zodiacs_text_info
+            if self.__from_cache(result, cache_key):
+                self.__keep_session(result, messages, TarotUtils.join_sentences(result.result_texts), a_mod, affinity)
+                return result
             
-            messages = [
-                {
-                    "role": "system",
-                    "content": TAROT_MASTER_CONTENT(a_mod), # 系统提示词
-                },
-                {
-                
-                    "role": "user",
-                    "content": USER_VL_MSG + user_message
-                }
-            ]
+            with stage(result.timings, "chat"):
+                response = await self.policy.call("reading", lambda: self.client.chat(model=self.model, messages=messages, options=self.reading_options, keep_alive=self.keep_alive, affinity=affinity), deadline)
+            result.usage = usage_of(response)
             
-            messages.append({
-                    "role": "assistant",
-                    "content": zodiacs_text # 占星讯息
-            })
+            with stage(result.timings, "postprocess"):
+                result.result_texts = TarotUtils.split_sentences(TarotUtils.replace_string(response["message"]["content"].strip()))
+            result.is_complete = True
+            result.complete_text = random.choice(COMPLETE_TEXT_TIPS)
+            self.__to_cache(result, cache_key)
+            self.__keep_session(result, messages, response["message"]["content"], a_mod, affinity)
+        except asyncio.CancelledError as error:
+            # 记录取消后继续向上抛出, 让wait_for与task.cancel()照常生效
+            self.__failed(result, error)
+            raise
+        except Exception as error:
+            self.__failed(result, error)
             
-            messages.extend([{
-                    "role": "assistant",
-                    "content": tarot_texts # 塔罗牌讯息
-                },
-                {
-                
-                    "role": "user",
-                    "content": USER_RA_MSG + user_message
-                }]
-            )
+        return result
+
+    async def __divination_stream(self, result: TarotContent, user_message: str, a_mod: bool, card_select: int, spread_key: str, deadline: Deadline, keep_session: bool = False):
+        affinity = Affinity() if keep_session else None
+        try:
+            prepared = await self.__prepare(result, user_message, a_mod, card_select, spread_key, deadline)
+            if prepared is None:
+                return
+            messages, cache_key = prepared
             
-            response = await self.client.chat(model=self.model, messages=messages)
+            if self.__from_cache(result, cache_key):
+                self.__keep_session(result, messages, TarotUtils.join_sentences(result.result_texts), a_mod, affinity)
+                for text in result.result_texts:
+                    yield text
+                return
             
-            out_texts = re.split(r'[\n。]', TarotUtils.replace_string(response["message"]["content"].strip()))
+            reply = []
+            async for text in self.__stream_reading(result, "reading", messages, deadline, affinity, reply):
+                yield text
             
-            result_texts = []
-            for text in out_texts:
-                if len(text.strip()) > 0:
-                    hand_txt = text.strip().strip("。,，.").lstrip("？?!！").strip()
-                    result_texts.append(hand_txt)
+            self.__to_cache(result, cache_key)
+            self.__keep_session(result, messages, "".join(reply), a_mod, affinity)
+        except asyncio.CancelledError as error:
+            self.__failed(result, error)
+            raise
+        except Exception as error:
+            self.__failed(result, error)
+
+    # 流式请求大模型并逐句yield清洗后的解读, 完成时写入result, reply收集大模型的原始输出
+    async def __stream_reading(self, result: TarotContent, stage_name: str, messages: list, deadline: Deadline, affinity: Affinity, reply: list):
+        cleaner = TarotStreamCleaner()
+        result_texts = []
+        
+        # chat包含调用方处理每句话的时间
+        chat_start = time.perf_counter()
+        async for chunk in self.policy.stream(stage_name, lambda: self.client.chat(model=self.model, messages=messages, stream=True, options=self.reading_options, keep_alive=self.keep_alive, affinity=affinity), deadline):
+            if "first_token" not in result.timings:
+                result.timings["first_token"] = time.perf_counter() - chat_start
+            if chunk.get("done"):
+                result.usage = usage_of(chunk)
+            content = chunk["message"]["content"]
+            reply.append(content)
+            with stage(result.timings, "postprocess"):
+                texts = cleaner.feed(content)
+            for text in texts:
+                result_texts.append(text)
+                yield text
+        result.timings["chat"] = time.perf_counter() - chat_start
+        
+        for text in cleaner.flush():
+            result_texts.append(text)
+            yield text
+        
+        result.result_texts = result_texts
+        result.is_complete = True
+        result.complete_text = random.choice(COMPLETE_TEXT_TIPS)
+
+    # 取出追问会话并把牌阵写入result, 不存在或已失效时写入失败原因并返回None
+    def __session(self, result: TarotContent, session_id: str) -> TarotSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            result.fail(TarotFailure.SESSION_EXPIRED, SESSION_EXPIRED_TIP, session_id)
+            return None
+        result.session_id = session.id
+        result.spread_key = session.spread_key
+        result.tarot_text = session.tarot_text
+        result.tarot_info = session.tarot_info
+        return session
+
+    # 成功后保存对话, reply为大模型的原始回答, affinity为None时不保存
+    def __keep_session(self, result: TarotContent, messages: list, reply: str, a_mod: bool, affinity: Affinity):
+        if affinity is None or not result.is_complete:
+            return
+        session = TarotSession(result.spread_key, result.tarot_text, result.tarot_info, a_mod, messages + [{"role": "assistant", "content": reply}], affinity)
+        result.session_id = self.sessions.add(session).id
+
+    async def __follow_up(self, result: TarotContent, session: TarotSession, user_message: str, deadline: Deadline):
+        try:
+            user_message = self.__check_message(result, user_message)
+            if user_message is None:
+                return result
             
-            datas = self.__getTarotInfo(spread_key, random_cards, total_elements, total_court_elemental_correspondence_keys, total_astrology_modality_keys, total_zodiacs_key, is_reversed_list)
+            # 同一个会话的追问依次进行, 后一个问题能看到前一个回答
+            async with session.lock:
+                question = {"role": "user", "content": USER_FOLLOW_UP_MSG + user_message}
+                messages = session.messages + [question]
+                with stage(result.timings, "chat"):
+                    response = await self.policy.call("follow_up", lambda: self.client.chat(model=self.model, messages=messages, options=self.reading_options, keep_alive=self.keep_alive, affinity=session.affinity), deadline)
+                result.usage = usage_of(response)
+                self.sessions.append(session, question, {"role": "assistant", "content": response["message"]["content"]})
             
-            result.result_texts = result_texts
-            result.tarot_text = show_text
+            with stage(result.timings, "postprocess"):
+                result.result_texts = TarotUtils.split_sentences(TarotUtils.replace_string(response["message"]["content"].strip()))
             result.is_complete = True
             result.complete_text = random.choice(COMPLETE_TEXT_TIPS)
-            result.tarot_info = datas
-        except:
-            result.failure_text = ERROR_TIP
-            return result
-        finally:
-            self.is_busy = False
-            
+        except asyncio.CancelledError as error:
+            # 记录取消后继续向上抛出, 让wait_for与task.cancel()照常生效
+            self.__failed(result, error)
+            raise
+        except Exception as error:
+            self.__failed(result, error)
+        
         return result
+
+    async def __follow_up_stream(self, result: TarotContent, session: TarotSession, user_message: str, deadline: Deadline):
+        try:
+            user_message = self.__check_message(result, user_message)
+            if user_message is None:
+                return
+            
+            async with session.lock:
+                question = {"role": "user", "content": USER_FOLLOW_UP_MSG + user_message}
+                reply = []
+                async for text in self.__stream_reading(result, "follow_up", session.messages + [question], deadline, session.affinity, reply):
+                    yield text
+                self.sessions.append(session, question, {"role": "assistant", "content": "".join(reply)})
+        except asyncio.CancelledError as error:
+            self.__failed(result, error)
+            raise
+        except Exception as error:
+            self.__failed(result, error)
+
+    # 去掉emoji并检查提问长度, 无效时写入失败原因并返回None
+    def __check_message(self, result: TarotContent, user_message: str) -> str:
+        with stage(result.timings, "remove_emojis"):
+            user_message = TarotUtils.remove_emojis(user_message)
+        
+        # 啥啊这是
+        if len(user_message) <= 0:
+            result.fail(TarotFailure.EMPTY_MESSAGE, random.choice(NONE_TEXT_TIPS))
+            return None
+        elif len(user_message) > MAX_LENGTH:
+            result.fail(TarotFailure.TOO_LONG, TOO_LONG_TIP)
+            return None
+        return user_message
+
+    # 抽牌并生成提示词, 返回(发给大模型的messages, 解读缓存的key), 无效提问返回None
+    async def __prepare(self, result: TarotContent, user_message: str, a_mod: bool, card_select: int, spread_key: str, deadline: Deadline, cards: tuple = None):
+        # 整个占卜过程使用同一份牌组数据
+        snapshot = self.store.snapshot
+        
+        user_message = self.__check_message(result, user_message)
+        if user_message is None:
+            return None
+        
+        if spread_key is None:
+            with stage(result.timings, "select_spreads"):
+                spread_key = await self.select_spreads(user_message, snapshot, deadline)
+        elif spread_key not in snapshot.index.spreads:
+            result.fail(TarotFailure.INVALID_SPREAD, ERROR_TIP, spread_key)
+            return None
+        
+        with stage(result.timings, "build_prompt"):
+            messages = self.__build_messages(result, snapshot, user_message, spread_key, a_mod, card_select, cards)
+        return messages, self.__cache_key(snapshot, user_message, result.tarot_info)
+
+    # 抽牌, 生成提示词与messages, 并把牌阵写入result
+    def __build_messages(self, result: TarotContent, snapshot: DeckSnapshot, user_message: str, spread_key: str, a_mod: bool, card_select: int, cards: tuple = None) -> list:
+        deck_index = snapshot.index
+        card_count = deck_index.spreads[spread_key].card_count
+        
+        if cards is not None:
+            random_cards, is_reversed_list = list(cards[0]), list(cards[1])
+        else:
+            # 卡牌选择模式
+            tarot_cards_keys = deck_index.card_keys.get(card_select, deck_index.card_keys[0])
+            random_cards = random.sample(tarot_cards_keys, card_count)
+            is_reversed_list = [random.choice([True, False]) for _ in range(card_count)] # 是否为逆位
+        
+        prompt = deck_index.build_prompt(spread_key, random_cards, is_reversed_list, a_mod)
+        tarot_texts = prompt.tarot_text # 塔罗
+        zodiacs_text = prompt.zodiacs_text # 占星
+        
+        messages = [
+            {
+                "role": "system",
+                "content": TAROT_MASTER_CONTENT(a_mod), # 系统提示词
+            },
+            {
+            
+                "role": "user",
+                "content": USER_VL_MSG + user_message
+            }
+        ]
+        
+        messages.append({
+                "role": "assistant",
+                "content": zodiacs_text # 占星讯息
+        })
+        
+        messages.extend([{
+                "role": "assistant",
+                "content": tarot_texts # 塔罗牌讯息
+            },
+            {
+            
+                "role": "user",
+                "content": USER_RA_MSG + user_message
+            }]
+        )
+        
+        result.tarot_text = prompt.show_text
+        result.spread_key = spread_key
+        result.tarot_info = TarotInfo(snapshot, spread_key, random_cards, is_reversed_list, a_mod)
+        
+        return messages
+
+    # 缓存的key, 未开启缓存或牌阵的牌数太多时返回None
+    def __cache_key(self, snapshot: DeckSnapshot, user_message: str, tarot_info: TarotInfo) -> str:
+        if self.cache is None or not self.cache.accepts(len(tarot_info.card_keys)):
+            return None
+        return InterpretationCache.key(user_message, tarot_info.spread_key, tarot_info.card_keys, tarot_info.is_reversed, tarot_info.a_mod, self.model, snapshot.source_hash, self.reading_options)
+
+    # 从缓存中取出解读, 命中时写入result并返回True
+    def __from_cache(self, result: TarotContent, cache_key: str) -> bool:
+        if cache_key is None:
+            return False
+        try:
+            with stage(result.timings, "cache"):
+                result_texts = self.cache.get(cache_key)
+        except Exception:
+            # 缓存出错不影响占卜
+            return False
+        if result_texts is None:
+            return False
+        
+        result.result_texts = result_texts
+        result.cached = True
+        result.is_complete = True
+        result.complete_text = random.choice(COMPLETE_TEXT_TIPS)
+        return True
+
+    def __to_cache(self, result: TarotContent, cache_key: str):
+        if cache_key is None or not result.result_texts:
+            return
+        try:
+            with stage(result.timings, "cache"):
+                self.cache.put(cache_key, result.result_texts)
+        except Exception:
+            pass
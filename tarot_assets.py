@@ -0,0 +1,235 @@
+from __future__ import annotations
+import os, json, mmap, threading
+from collections import OrderedDict
+from tarot_config import ASSET_CACHE_SIZE, ATLAS_NAME, ATLAS_REDUCES, RESOURCES_PATH
+
+class AssetCache:
+    """进程内的图片缓存
+
+    保存解码后的背景图、牌面以及旋转缩放后的牌面, 按内存预算(字节)做LRU淘汰,
+    缓存中的图片是共享的, 使用者不能修改
+    """
+    def __init__(self, budget: int = ASSET_CACHE_SIZE):
+        self.budget: int = budget # 内存预算(字节)
+        self.size: int = 0 # 已使用的内存(字节)
+        self.hits: int = 0
+        self.misses: int = 0
+        self._images: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._images
+
+    @staticmethod
+    def image_size(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key: tuple) -> Image.Image:
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._images.move_to_end(key)
+            return image
+
+    def put(self, key: tuple, image: Image.Image):
+        image_size = self.image_size(image)
+        # 超过预算的图片不缓存
+        if image_size > self.budget:
+            return
+
+        with self._lock:
+            old_image = self._images.pop(key, None)
+            if old_image is not None:
+                self.size -= self.image_size(old_image)
+
+            self._images[key] = image
+            self.size += image_size
+
+            while self.size > self.budget:
+                __, evicted = self._images.popitem(last=False)
+                self.size -= self.image_size(evicted)
+
+    # 读取缓存, 不存在时用factory生成并写入缓存
+    def get_or_create(self, key: tuple, factory) -> Image.Image:
+        image = self.get(key)
+        if image is None:
+            image = factory()
+            self.put(key, image)
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+# 进程共享的图片缓存
+asset_cache = AssetCache()
+
+class AssetAtlas:
+    """内存映射的图片图集
+
+    离线把解码后的背景图与牌面(以及可选的逆位、缩小版本)按原始RGBA拼接到一个文件,
+    并用json记录每张图片的偏移与尺寸. 各进程用mmap只读加载, 共享同一份物理内存, 启动时无需解码JPEG
+    """
+    VERSION = 1
+
+    def __init__(self, directory: str, index: dict, mapping: mmap.mmap):
+        self.directory: str = directory
+        self.index: dict = index
+        self._mapping: mmap.mmap = mapping
+        self._buffer = memoryview(mapping)
+        self.images: dict[tuple, Image.Image] = {}
+
+        from PIL import Image
+        for name, entry in index["entries"].items():
+            width, height = entry["size"]
+            offset = entry["offset"]
+            buffer = self._buffer[offset:offset + width * height * 4]
+            # 与mmap共享内存, 图片为只读
+            image = Image.frombuffer("RGBA", (width, height), buffer, "raw", "RGBA", 0, 1)
+            self.images[(os.path.join(directory, entry["source"]), entry.get("reversed", False), entry.get("reduce", 1))] = image
+
+    @staticmethod
+    def paths(directory: str) -> tuple:
+        return os.path.join(directory, f"{ATLAS_NAME}.rgba"), os.path.join(directory, f"{ATLAS_NAME}.json")
+
+    # 图集包含的源图片
+    @staticmethod
+    def sources(directory: str) -> list[str]:
+        card_dir = os.path.join(directory, "cards")
+        return ["wallpaper.png"] + [f"cards/{name}" for name in sorted(os.listdir(card_dir)) if name.endswith(".jpg")]
+
+    # 源图片的修改时间与大小
+    @staticmethod
+    def fingerprint(directory: str) -> dict:
+        result = {}
+        for source in AssetAtlas.sources(directory):
+            stat = os.stat(os.path.join(directory, source))
+            result[source] = [stat.st_mtime_ns, stat.st_size]
+        return result
+
+    # 图集与源图片是否一致
+    @staticmethod
+    def is_fresh(directory: str, index: dict = None) -> bool:
+        atlas_path, index_path = AssetAtlas.paths(directory)
+        try:
+            if index is None:
+                with open(index_path, 'r', encoding='utf-8') as file:
+                    index = json.load(file)
+            return index.get("version") == AssetAtlas.VERSION and index.get("sources") == AssetAtlas.fingerprint(directory) and os.path.getsize(atlas_path) == index.get("length")
+        except (OSError, ValueError):
+            return False
+
+    # 打开图集, 不存在或已过期时返回None
+    @staticmethod
+    def open(directory: str):
+        atlas_path, index_path = AssetAtlas.paths(directory)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if not AssetAtlas.is_fresh(directory, index):
+            return None
+
+        with open(atlas_path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return AssetAtlas(directory, index, mapping)
+
+    # 构建图集, 已是最新时直接返回False
+    # include_reversed为是否包含逆位牌面, reduces为额外保存的整数倍缩小版本
+    @staticmethod
+    def build(directory: str, include_reversed: bool = False, reduces: tuple = ATLAS_REDUCES, force: bool = False) -> bool:
+        from PIL import Image
+        atlas_path, index_path = AssetAtlas.paths(directory)
+        options = {"reversed": include_reversed, "reduces": list(reduces)}
+        if not force and AssetAtlas.is_fresh(directory):
+            with open(index_path, 'r', encoding='utf-8') as file:
+                if json.load(file).get("options") == options:
+                    return False
+
+        sources = AssetAtlas.fingerprint(directory)
+        entries = {}
+        offset = 0
+
+        # 先写临时文件再替换, 正在使用旧图集的进程不受影响
+        with open(atlas_path + ".tmp", 'wb') as file:
+            def append(name: str, image: Image.Image, **entry):
+                nonlocal offset
+                data = image.tobytes("raw", "RGBA")
+                file.write(data)
+                entries[name] = dict(entry, offset=offset, size=[image.width, image.height])
+                offset += len(data)
+
+            for source in sources:
+                image = Image.open(os.path.join(directory, source)).convert("RGBA")
+                append(source, image, source=source)
+                if not source.startswith("cards/"):
+                    continue
+
+                variants = [("", False, image)]
+                if include_reversed:
+                    reversed_image = image.transpose(Image.Transpose.ROTATE_180)
+                    append(f"{source}#reversed", reversed_image, source=source, reversed=True)
+                    variants.append(("#reversed", True, reversed_image))
+
+                for suffix, is_reversed, variant in variants:
+                    for reduce in reduces:
+                        append(f"{source}{suffix}@{reduce}", variant.reduce(reduce), source=source, reversed=is_reversed, reduce=reduce)
+
+        index = {"version": AssetAtlas.VERSION, "options": options, "sources": sources, "length": offset, "entries": entries}
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+
+        os.replace(atlas_path + ".tmp", atlas_path)
+        os.replace(index_path + ".tmp", index_path)
+        return True
+
+# 已打开的图集, 目录 -> 图集(不存在时为None)
+_atlases: dict[str, AssetAtlas] = {}
+_atlas_lock = threading.Lock()
+
+# 从图集中读取图片, 所在目录没有可用的图集时返回None
+def atlas_image(path: str, is_reversed: bool = False, reduce: int = 1) -> Image.Image:
+    path = os.path.abspath(path)
+    # 背景图在资源目录下, 牌面在资源目录的cards下
+    directory = os.path.dirname(path)
+    if os.path.basename(directory) == "cards":
+        directory = os.path.dirname(directory)
+
+    atlas = _atlases.get(directory, False)
+    if atlas is False:
+        with _atlas_lock:
+            atlas = _atlases.get(directory, False)
+            if atlas is False:
+                atlas = _atlases[directory] = AssetAtlas.open(directory)
+    if atlas is None:
+        return None
+    return atlas.images.get((path, is_reversed, reduce))
+
+# 丢弃已打开的图集, 下次读取时重新检查
+def reset_atlases():
+    with _atlas_lock:
+        _atlases.clear()
+
+if __name__ == "__main__":
+    import argparse, time
+
+    parser = argparse.ArgumentParser(description="构建牌面图集")
+    parser.add_argument("directory", nargs="?", default=RESOURCES_PATH, help="资源目录")
+    parser.add_argument("--reversed", action="store_true", help="同时保存逆位牌面")
+    parser.add_argument("--force", action="store_true", help="即使图集已是最新也重新构建")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    built = AssetAtlas.build(args.directory, include_reversed=args.reversed, force=args.force)
+    atlas_path, __ = AssetAtlas.paths(args.directory)
+    status = "built" if built else "up to date"
+    print(f"{atlas_path}: {status}, {os.path.getsize(atlas_path) / 1024 / 1024:.1f} MB, {time.perf_counter() - start:.2f}s")
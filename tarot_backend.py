@@ -0,0 +1,402 @@
+import sys, time, random, asyncio
+from collections import deque
+from tarot_config import BACKEND_HEALTH_INTERVAL, BACKEND_FAILURE_COOLDOWN, BACKEND_KEEPALIVE_CONNECTIONS, BACKEND_KEEPALIVE_EXPIRY
+from tarot_config import LLM_RETRIES, LLM_RETRY_BACKOFF, LLM_HEDGE_PERCENTILE, LLM_HEDGE_WINDOW, LLM_HEDGE_MIN_SAMPLES
+
+# 稍后或换一台主机可能会成功的错误
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+# 模型不存在, 只是这台主机没有拉取模型, 换一台主机可能会成功, 但重试同一台没有意义
+MISSING_MODEL_STATUS = 404
+
+def is_missing_model(error: BaseException) -> bool:
+    ollama = sys.modules.get("ollama")
+    return ollama is not None and isinstance(error, ollama.ResponseError) and error.status_code == MISSING_MODEL_STATUS
+
+# 旧版Ollama不支持JSON Schema格式的format, 返回400且错误信息提到format
+# (例如"json: cannot unmarshal object into Go struct field ChatRequest.format of type string"), 其他原因的400不算
+def is_format_rejected(error: BaseException) -> bool:
+    ollama = sys.modules.get("ollama")
+    return ollama is not None and isinstance(error, ollama.ResponseError) and error.status_code == 400 and "format" in str(error.error).lower()
+
+def is_retryable(error: BaseException) -> bool:
+    # 还没有导入httpx/ollama时错误不可能来自它们
+    httpx, ollama = sys.modules.get("httpx"), sys.modules.get("ollama")
+    if isinstance(error, ConnectionError) or (httpx is not None and isinstance(error, httpx.TransportError)):
+        return True
+    if ollama is not None and isinstance(error, ollama.ResponseError):
+        # 流式响应中的错误没有状态码
+        return error.status_code in RETRY_STATUS or error.status_code == -1
+    return False
+
+class OllamaBackend:
+    """连接池中的一台Ollama主机, 复用同一个HTTP连接池"""
+    def __init__(self, host: str, model: str = None, api_key: str = None):
+        self.host: str = host
+        self.model: str = model # 为None时使用Tarot的模型
+        self.api_key: str = api_key
+        self._client = None
+
+        self.outstanding: int = 0 # 正在进行的请求数
+        self.healthy: bool = True
+        self.failures: int = 0 # 连续失败次数
+        self.retry_at: float = 0.0 # 失败后冷却到此时间(time.monotonic)
+        self.last_error: BaseException = None
+
+    # 第一次请求时才创建客户端, 导入ollama与httpx较慢, 不拖慢启动
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            from utils import CustomAsyncClient
+            self._client = CustomAsyncClient(self.host, self.api_key, limits=httpx.Limits(max_keepalive_connections=BACKEND_KEEPALIVE_CONNECTIONS, keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY))
+        return self._client
+
+    def __repr__(self) -> str:
+        return f"OllamaBackend({self.host!r}, model={self.model!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+    # 是否可以接收请求
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.retry_at
+
+    def mark_success(self):
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+
+    def mark_failure(self, error: BaseException, cooldown: float):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = error
+        # 连续失败时冷却时间翻倍, 最多64倍
+        self.retry_at = time.monotonic() + cooldown * (2 ** min(self.failures - 1, 6))
+
+class Affinity:
+    """让一组请求尽量发给同一台主机, 例如同一次占卜的追问, 主机可以复用已计算的对话前缀
+
+    第一次请求后记录处理它的主机, 之后该主机可用时优先选择它
+    """
+    __slots__ = ("backend",)
+
+    def __init__(self):
+        self.backend: OllamaBackend = None
+
+class OllamaPool:
+    """多主机的Ollama连接池
+
+    与ollama.AsyncClient一样调用chat/generate, 每次请求发给正在进行的请求最少的可用主机,
+    连接失败或主机返回5xx时标记该主机并换下一台重试, 主机没有该模型(404)时换下一台但不标记该主机.
+    流式请求只在收到第一段内容之前重试.
+    请求可以带上affinity(见Affinity), 优先发给上次处理的主机
+    """
+    def __init__(self, backends: list[OllamaBackend], health_interval: float = BACKEND_HEALTH_INTERVAL, failure_cooldown: float = BACKEND_FAILURE_COOLDOWN):
+        if not backends:
+            raise ValueError("OllamaPool needs at least one backend")
+        self.backends: list[OllamaBackend] = backends
+        self.health_interval: float = health_interval
+        self.failure_cooldown: float = failure_cooldown
+        self.structured_output: bool = True # 是否支持JSON Schema格式的format, 旧版Ollama拒绝后改为False
+        self._health_task: asyncio.Task = None
+
+    # hosts为主机地址, 或包含host/model/api_key的dict, 可以是列表
+    @classmethod
+    def from_hosts(cls, hosts, **kwargs) -> "OllamaPool":
+        if isinstance(hosts, (str, dict)):
+            hosts = [hosts]
+
+        backends = []
+        for host in hosts:
+            if isinstance(host, str):
+                backends.append(OllamaBackend(host))
+            else:
+                backends.append(OllamaBackend(host["host"], host.get("model"), host.get("api_key")))
+        return cls(backends, **kwargs)
+
+    # 选择正在进行的请求最少的可用主机, 数量相同时随机, 都不可用时选最早结束冷却的
+    # prefer可用时优先选择它
+    def pick(self, exclude: set = (), prefer: OllamaBackend = None) -> OllamaBackend:
+        now = time.monotonic()
+        if prefer is not None and prefer in self.backends and prefer not in exclude and prefer.available(now):
+            return prefer
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None
+
+        available = [backend for backend in candidates if backend.available(now)]
+        if not available:
+            return min(candidates, key=lambda backend: backend.retry_at)
+
+        least = min(backend.outstanding for backend in available)
+        return random.choice([backend for backend in available if backend.outstanding == least])
+
+    async def chat(self, model: str = "", messages=None, stream: bool = False, affinity: Affinity = None, **kwargs):
+        return await self.request("chat", model, stream, affinity, messages=messages, **kwargs)
+
+    async def generate(self, model: str = "", prompt: str = "", stream: bool = False, affinity: Affinity = None, **kwargs):
+        return await self.request("generate", model, stream, affinity, prompt=prompt, **kwargs)
+
+    # 发送请求, 失败时换主机重试, 每台主机最多尝试一次
+    async def request(self, method: str, model: str, stream: bool = False, affinity: Affinity = None, **kwargs):
+        if stream:
+            return self.__stream(method, model, affinity, kwargs)
+
+        tried = set()
+        while True:
+            backend = self.pick(tried, affinity.backend if affinity is not None else None)
+            tried.add(backend)
+            backend.outstanding += 1
+            try:
+                response = await getattr(backend.client, method)(model=backend.model or model, **kwargs)
+                backend.mark_success()
+                if affinity is not None:
+                    affinity.backend = backend
+                return response
+            except Exception as error:
+                if is_missing_model(error):
+                    # 主机本身正常, 不标记失败
+                    pass
+                elif is_retryable(error):
+                    backend.mark_failure(error, self.failure_cooldown)
+                else:
+                    raise
+                if len(tried) >= len(self.backends):
+                    raise
+            finally:
+                backend.outstanding -= 1
+
+    async def __stream(self, method: str, model: str, affinity: Affinity, kwargs: dict):
+        tried = set()
+        while True:
+            backend = self.pick(tried, affinity.backend if affinity is not None else None)
+            tried.add(backend)
+            backend.outstanding += 1
+            received = False
+            try:
+                async for chunk in await getattr(backend.client, method)(model=backend.model or model, stream=True, **kwargs):
+                    received = True
+                    yield chunk
+                backend.mark_success()
+                if affinity is not None:
+                    affinity.backend = backend
+                return
+            except Exception as error:
+                if is_missing_model(error):
+                    # 主机本身正常, 不标记失败
+                    pass
+                elif is_retryable(error):
+                    backend.mark_failure(error, self.failure_cooldown)
+                else:
+                    raise
+                # 已经输出的内容无法撤回
+                if received or len(tried) >= len(self.backends):
+                    raise
+            finally:
+                backend.outstanding -= 1
+
+    # 检查一台主机, 恢复冷却中的主机
+    async def check(self, backend: OllamaBackend) -> bool:
+        try:
+            await backend.client.ps()
+            backend.mark_success()
+            return True
+        except Exception as error:
+            backend.mark_failure(error, self.failure_cooldown)
+            return False
+
+    async def check_all(self) -> list[bool]:
+        return await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    # 定时健康检查
+    def start_health_checks(self, interval: float = None) -> asyncio.Task:
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self.__health_loop(interval or self.health_interval))
+        return self._health_task
+
+    @property
+    def health_checking(self) -> bool:
+        return self._health_task is not None and not self._health_task.done()
+
+    def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    async def __health_loop(self, interval: float):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(interval)
+
+    # drain为True时等正在进行的请求结束后再关闭连接
+    async def close(self, drain: bool = False):
+        self.stop_health_checks()
+        while drain and any(backend.outstanding for backend in self.backends):
+            await asyncio.sleep(0.1)
+        for backend in self.backends:
+            if backend._client is not None:
+                await backend._client.close()
+
+class Deadline:
+    """一次占卜的截止时间, 传给每个阶段, 各阶段的超时不会超过剩余时间"""
+    def __init__(self, timeout: float = None):
+        self.timeout: float = timeout
+        self.expires_at: float = None if timeout is None else time.monotonic() + timeout
+
+    # 剩余时间(秒), 不限制时为None
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    # 某个阶段可用的时间, 取阶段超时与剩余时间中较小的
+    def stage_timeout(self, timeout: float = None) -> float:
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return max(remaining, 0.0)
+        return max(min(timeout, remaining), 0.0)
+
+class LatencyTracker:
+    """最近若干次请求的耗时, 用于计算对冲请求的触发时间"""
+    def __init__(self, window: int = LLM_HEDGE_WINDOW):
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    # percentile为0到1之间的小数(0.95即p95), 样本不足时返回None
+    def percentile(self, percentile: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES) -> float:
+        if not 0 < percentile < 1:
+            raise ValueError(f"percentile must be between 0 and 1, got {percentile!r}")
+        if len(self.samples) < max(min_samples, 1):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+class RequestPolicy:
+    """大模型请求的超时、重试与对冲
+
+    连接错误、5xx与阶段超时会在截止时间内按指数退避重试, 其余错误直接抛出.
+    设置hedge_percentile(0到1之间的小数, 0.95即p95)后, 请求耗时超过该阶段历史耗时的这一分位时再发一个相同的请求(连接池会发给更空闲的主机),
+    取先返回的结果并取消另一个. 流式请求只重试, 不对冲
+    """
+    def __init__(self, retries: int = LLM_RETRIES, backoff: float = LLM_RETRY_BACKOFF, hedge_percentile: float = LLM_HEDGE_PERCENTILE, hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES, window: int = LLM_HEDGE_WINDOW):
+        # 写成95之类的百分数时阈值会落在最慢的样本上, 对冲几乎不会触发, 直接报错
+        if hedge_percentile is not None and not 0 < hedge_percentile < 1:
+            raise ValueError(f"hedge_percentile must be between 0 and 1 (e.g. 0.95), got {hedge_percentile!r}")
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.hedge_percentile: float = hedge_percentile
+        self.hedge_min_samples: int = hedge_min_samples
+        self.window: int = window
+        self.latencies: dict[str, LatencyTracker] = {} # 阶段 -> 耗时
+        self.retried: int = 0 # 重试次数
+        self.hedged: int = 0 # 发出对冲请求的次数
+
+    def tracker(self, stage: str) -> LatencyTracker:
+        tracker = self.latencies.get(stage)
+        if tracker is None:
+            tracker = self.latencies[stage] = LatencyTracker(self.window)
+        return tracker
+
+    @staticmethod
+    def is_transient(error: BaseException) -> bool:
+        return isinstance(error, asyncio.TimeoutError) or is_retryable(error)
+
+    # 第attempt次重试前的等待时间, 剩余时间不够时返回None
+    def __retry_delay(self, attempt: int, error: BaseException, deadline: Deadline) -> float:
+        if attempt >= self.retries or not self.is_transient(error):
+            return None
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        remaining = deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    # factory每次调用返回一个新的请求(协程)
+    async def call(self, stage: str, factory, deadline: Deadline = None, timeout: float = None):
+        if deadline is None:
+            deadline = Deadline()
+
+        attempt = 0
+        while True:
+            stage_timeout = deadline.stage_timeout(timeout)
+            if stage_timeout is not None and stage_timeout <= 0:
+                raise asyncio.TimeoutError(f"{stage} deadline exceeded")
+            try:
+                return await asyncio.wait_for(self.__hedged(stage, factory), stage_timeout)
+            except Exception as error:
+                delay = self.__retry_delay(attempt, error, deadline)
+                if delay is None:
+                    raise
+            self.retried += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def __hedged(self, stage: str, factory):
+        tracker = self.tracker(stage)
+        start = time.monotonic()
+        threshold = None
+        if self.hedge_percentile is not None:
+            threshold = tracker.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+        tasks = {asyncio.ensure_future(factory())}
+        try:
+            if threshold is not None:
+                done, __ = await asyncio.wait(tasks, timeout=threshold)
+                if not done:
+                    self.hedged += 1
+                    tasks.add(asyncio.ensure_future(factory()))
+
+            # 取先成功的结果, 都失败时抛出最后一个错误
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        tracker.record(time.monotonic() - start)
+                        return task.result()
+                if not pending:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # 流式请求, 每段内容都要在剩余时间内到达, 收到第一段内容前可以重试
+    async def stream(self, stage: str, factory, deadline: Deadline = None):
+        if deadline is None:
+            deadline = Deadline()
+
+        attempt = 0
+        while True:
+            received = False
+            iterator = None
+            start = time.monotonic()
+            try:
+                iterator = await asyncio.wait_for(factory(), deadline.stage_timeout())
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), deadline.stage_timeout())
+                    except StopAsyncIteration:
+                        break
+                    if not received:
+                        received = True
+                        # 首段内容的耗时与完整请求不可比, 单独记录, 不参与call的对冲阈值
+                        self.tracker(f"{stage}:first_chunk").record(time.monotonic() - start)
+                    yield chunk
+                return
+            except Exception as error:
+                delay = None if received else self.__retry_delay(attempt, error, deadline)
+                if delay is None:
+                    raise
+            finally:
+                if iterator is not None and hasattr(iterator, "aclose"):
+                    await iterator.aclose()
+            self.retried += 1
+            attempt += 1
+            await asyncio.sleep(delay)
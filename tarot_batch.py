@@ -0,0 +1,241 @@
+import os, json, time, asyncio
+from tarot import Tarot, TarotContent, TarotDraw, TarotFailure
+from tarot_config import BATCH_CONCURRENCY, BATCH_IMAGE_FORMAT, RESOURCES_PATH
+
+# 重新运行也不会有不同结果的失败, 断点续跑时不再重试
+FINAL_FAILURES = (TarotFailure.EMPTY_MESSAGE, TarotFailure.TOO_LONG, TarotFailure.INVALID_SPREAD, "invalid_request")
+
+# 字符串形式的a_mod
+FLAG_VALUES = {"true": True, "false": False, "1": True, "0": False, "yes": True, "no": False}
+# 卡牌选择模式: 0为全部78张, 1为大阿尔卡那, 2为小阿尔卡那
+CARD_SELECT_MODES = (0, 1, 2)
+
+class InvalidRequest(ValueError):
+    """输入的一行无法解析或参数无效, 带上已知的id, 写入输出时与该行对应"""
+    def __init__(self, request_id, message: str):
+        super().__init__(message)
+        self.request_id = request_id
+
+class BatchStats:
+    def __init__(self):
+        self.total: int = 0 # 输入的条数
+        self.skipped: int = 0 # 之前已完成而跳过的条数
+        self.completed: int = 0
+        self.failed: int = 0
+        self.elapsed: float = 0.0
+
+    def __repr__(self) -> str:
+        return f"BatchStats(total={self.total}, skipped={self.skipped}, completed={self.completed}, failed={self.failed}, elapsed={self.elapsed:.1f}s)"
+
+# 一条输入: {"id": 可选, "question": 提问, "a_mod": 占星模式, "card_select": 卡牌选择模式, "spread": 指定牌阵}
+# 没有id时使用行号(从1开始), 参数在解析时校验并转换, 无效时抛出InvalidRequest
+def parse_request(line: str, line_number: int) -> dict:
+    try:
+        request = json.loads(line)
+    except ValueError:
+        raise InvalidRequest(line_number, "invalid json")
+    if isinstance(request, str):
+        request = {"question": request}
+    if not isinstance(request, dict):
+        raise InvalidRequest(line_number, "a request needs a question")
+    request.setdefault("id", line_number)
+    # id用于断点续跑时比对, 只接受字符串与整数
+    if not isinstance(request["id"], (str, int)) or isinstance(request["id"], bool):
+        raise InvalidRequest(line_number, f"invalid id: {request['id']!r}")
+    if not isinstance(request.get("question"), str):
+        raise InvalidRequest(request["id"], "a request needs a question")
+
+    a_mod = request.get("a_mod", False)
+    if isinstance(a_mod, str):
+        a_mod = FLAG_VALUES.get(a_mod.strip().lower())
+    elif isinstance(a_mod, int) and a_mod in (0, 1):
+        a_mod = bool(a_mod)
+    if not isinstance(a_mod, bool):
+        raise InvalidRequest(request["id"], f"invalid a_mod: {request.get('a_mod')!r}")
+
+    card_select = request.get("card_select", 0)
+    if isinstance(card_select, str) and card_select.strip().isdigit():
+        card_select = int(card_select)
+    if type(card_select) is not int or card_select not in CARD_SELECT_MODES:
+        raise InvalidRequest(request["id"], f"invalid card_select: {request.get('card_select')!r}")
+
+    if not isinstance(request.get("spread"), (str, type(None))):
+        raise InvalidRequest(request["id"], f"invalid spread: {request.get('spread')!r}")
+
+    request["a_mod"], request["card_select"] = a_mod, card_select
+    return request
+
+# 占卜结果转为输出的一行
+def result_record(request: dict, result: TarotContent, image_path: str = None) -> dict:
+    tarot_info = result.tarot_info
+    return {
+        "id": request["id"],
+        "question": request["question"],
+        "is_complete": result.is_complete,
+        "spread": result.spread_key,
+        "cards": list(tarot_info.card_keys) if tarot_info is not None else [],
+        "is_reversed_list": tarot_info.is_reversed_list if tarot_info is not None else None,
+        "tarot_text": result.tarot_text,
+        "result_texts": result.result_texts,
+        "complete_text": result.complete_text,
+        "failure_reason": result.failure_reason,
+        "failure_text": result.failure_text,
+        "failure_detail": result.failure_detail,
+        "image": image_path,
+        "timings": result.timings,
+        "usage": result.usage,
+    }
+
+def failure_record(request_id, question: str, reason: str, detail: str) -> dict:
+    return {"id": request_id, "question": question, "is_complete": False, "failure_reason": reason, "failure_detail": detail}
+
+# 读取已有的输出, 返回已完成(或不必重试)的id, 中断时写了一半的行会被忽略
+def finished_ids(output_path: str) -> set:
+    finished = set()
+    try:
+        with open(output_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("is_complete") or record.get("failure_reason") in FINAL_FAILURES:
+                    finished.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return finished
+
+class BatchWriter:
+    """逐条追加写入结果, 每条写完立即落盘, 输出文件本身就是断点"""
+    def __init__(self, output_path: str):
+        # 上次中断时最后一行可能不完整, 先补一个换行
+        needs_newline = False
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with open(output_path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                needs_newline = file.read(1) != b"\n"
+
+        self.file = open(output_path, 'a', encoding='utf-8')
+        if needs_newline:
+            self.file.write("\n")
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+# 批量占卜
+# tarot_draw不为None时同时绘制牌阵图片, 保存为image_dir/{id}.{image_format}
+# resume为True时跳过输出中已完成的条目, 否则清空输出重新开始
+# on_result为每完成一条时的回调, 参数为输出的一行
+async def run_batch(tarot: Tarot, input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY, tarot_draw: TarotDraw = None, image_dir: str = None, image_format: str = BATCH_IMAGE_FORMAT, resume: bool = True, on_result=None) -> BatchStats:
+    stats = BatchStats()
+    start = time.perf_counter()
+
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+    finished = finished_ids(output_path)
+    if tarot_draw is not None:
+        image_dir = image_dir or os.path.splitext(output_path)[0] + "_images"
+        os.makedirs(image_dir, exist_ok=True)
+
+    writer = BatchWriter(output_path)
+    # 队列有上限, 大文件也不会一次读入内存
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def save_image(request: dict, image: bytes) -> str:
+        path = os.path.join(image_dir, f"{request['id']}.{image_format.lower()}")
+        def write():
+            with open(path, 'wb') as file:
+                file.write(image)
+        await asyncio.to_thread(write)
+        return path
+
+    async def run_one(request: dict) -> dict:
+        options = dict(a_mod=request["a_mod"], card_select=request["card_select"], spread_key=request.get("spread"), queue_timeout=None)
+        if tarot_draw is None:
+            return result_record(request, await tarot.divination(request["question"], **options))
+
+        result, image = await tarot.divination_with_image(request["question"], tarot_draw=tarot_draw, image_format=image_format, **options)
+        image_path = await save_image(request, image) if image is not None else None
+        return result_record(request, result, image_path)
+
+    async def worker():
+        while True:
+            request = await queue.get()
+            try:
+                if "error" in request:
+                    record = failure_record(request["id"], None, "invalid_request", request["error"])
+                else:
+                    try:
+                        record = await run_one(request)
+                    except Exception as error:
+                        record = failure_record(request["id"], request["question"], TarotFailure.INTERNAL_ERROR, repr(error))
+                writer.write(record)
+                if record["is_complete"]:
+                    stats.completed += 1
+                else:
+                    stats.failed += 1
+                if on_result is not None:
+                    on_result(record)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(concurrency, 1))]
+    try:
+        with open(input_path, 'r', encoding='utf-8') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                stats.total += 1
+                try:
+                    request = parse_request(line, line_number)
+                except InvalidRequest as error:
+                    request = {"id": error.request_id, "error": str(error)}
+                if request["id"] in finished:
+                    stats.skipped += 1
+                    continue
+                await queue.put(request)
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        writer.close()
+
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    from tarot import DEFAULT_CONNECT_URL
+
+    parser = argparse.ArgumentParser(description="批量占卜, 输入与输出均为JSONL, 中断后再次运行会跳过已完成的条目")
+    parser.add_argument("input", help="每行一个请求: {\"id\", \"question\", \"a_mod\", \"card_select\", \"spread\"}")
+    parser.add_argument("output", help="结果JSONL")
+    parser.add_argument("--model", required=True, help="模型名称")
+    parser.add_argument("--url", nargs="+", default=[DEFAULT_CONNECT_URL], help="Ollama地址, 可以有多个")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同时进行的占卜数")
+    parser.add_argument("--images", metavar="DIR", help="同时绘制牌阵图片并保存到该目录")
+    parser.add_argument("--image-format", default=BATCH_IMAGE_FORMAT, help="图片格式: JPEG, WEBP, PNG")
+    parser.add_argument("--restart", action="store_true", help="清空输出重新开始")
+    args = parser.parse_args()
+
+    async def main():
+        tarot = Tarot(args.model, args.url if len(args.url) > 1 else args.url[0], max_concurrency=args.concurrency, max_queue=args.concurrency)
+        tarot_draw = TarotDraw(RESOURCES_PATH) if args.images else None
+
+        def progress(record: dict):
+            status = "ok" if record["is_complete"] else record["failure_reason"]
+            print(f"{record['id']}: {status}", flush=True)
+
+        stats = await run_batch(tarot, args.input, args.output, args.concurrency, tarot_draw, args.images, args.image_format, not args.restart, progress)
+        print(stats)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("interrupted, run again to resume")
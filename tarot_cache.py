@@ -0,0 +1,109 @@
+import re, json, time, sqlite3, hashlib
+from tarot_config import INTERPRETATION_CACHE_PATH, INTERPRETATION_CACHE_TTL, INTERPRETATION_CACHE_MAX_ENTRIES, INTERPRETATION_CACHE_VARIANTS, INTERPRETATION_CACHE_MAX_CARDS
+
+class InterpretationCache:
+    """大模型解读的本地缓存
+
+    以规范化后的提问、牌阵、抽到的牌与正逆位、占星模式、模型、解读的请求参数与牌组版本为key, 保存在SQLite中.
+    同一个key最多保存variants条解读, 存满之前照常生成, 之后按最久未使用轮流返回, 避免回答千篇一律.
+    超过ttl的解读不再使用, 总条数超过max_entries时淘汰最久未使用的.
+    查询与写入都在调用线程中同步完成, 单次耗时在毫秒以内
+    """
+    # 只保留中文、英文与数字, 标点与空白不影响命中
+    NORMALIZE_PATTERN = re.compile(r'[^一-鿿a-z0-9]+')
+    # 每写入该次数清理一次过期的解读
+    PURGE_EVERY = 100
+
+    def __init__(self, path: str = INTERPRETATION_CACHE_PATH, ttl: float = INTERPRETATION_CACHE_TTL, max_entries: int = INTERPRETATION_CACHE_MAX_ENTRIES, variants: int = INTERPRETATION_CACHE_VARIANTS, max_cards: int = INTERPRETATION_CACHE_MAX_CARDS):
+        self.path: str = path
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.variants: int = max(variants, 1)
+        self.max_cards: int = max_cards
+        self.hits: int = 0
+        self.misses: int = 0
+        self._writes: int = 0
+        self._entries: int = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS readings (id INTEGER PRIMARY KEY, key TEXT NOT NULL, texts TEXT NOT NULL, created REAL NOT NULL, served REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS readings_key ON readings (key, served)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS readings_served ON readings (served)")
+        self.connection.commit()
+        self.purge()
+        self._entries = self.connection.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+    @property
+    def entries(self) -> int:
+        return self._entries
+
+    # 牌数不超过max_cards的牌阵才缓存
+    def accepts(self, card_count: int) -> bool:
+        return card_count <= self.max_cards
+
+    @classmethod
+    def normalize(cls, question: str) -> str:
+        return cls.NORMALIZE_PATTERN.sub("", question.lower())
+
+    @classmethod
+    # options为解读的请求参数(Ollama的options), temperature、num_predict等不同时生成的解读也不同
+    def key(cls, question: str, spread_key: str, card_keys: list, is_reversed_list: list, a_mod: bool, model: str, deck_hash: str = "", options: dict = None) -> str:
+        fields = [cls.normalize(question), spread_key, list(card_keys), [bool(is_reversed) for is_reversed in is_reversed_list], bool(a_mod), model, deck_hash]
+        # 使用模型默认参数时key与之前相同, 已缓存的解读仍然有效
+        if options:
+            fields.append(options)
+        raw = json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    # 已保存的有效解读数
+    def count(self, key: str) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM readings WHERE key = ? AND created >= ?", (key, time.time() - self.ttl)).fetchone()[0]
+
+    # 取出一条解读, 该key的解读还没有存满时返回None
+    def get(self, key: str) -> list[str] | None:
+        now = time.time()
+        rows = self.connection.execute("SELECT id, texts FROM readings WHERE key = ? AND created >= ? ORDER BY served LIMIT ?", (key, now - self.ttl, self.variants)).fetchall()
+        if len(rows) < self.variants:
+            self.misses += 1
+            return None
+
+        row_id, texts = rows[0]
+        self.connection.execute("UPDATE readings SET served = ?, hits = hits + 1 WHERE id = ?", (now, row_id))
+        self.connection.commit()
+        self.hits += 1
+        return json.loads(texts)
+
+    def put(self, key: str, texts: list[str]):
+        now = time.time()
+        self.connection.execute("INSERT INTO readings (key, texts, created, served) VALUES (?, ?, ?, ?)", (key, json.dumps(texts, ensure_ascii=False), now, now))
+        self._entries += 1
+
+        # 同一个key只保留最新的variants条
+        removed = self.connection.execute("DELETE FROM readings WHERE key = ? AND id NOT IN (SELECT id FROM readings WHERE key = ? ORDER BY created DESC LIMIT ?)", (key, key, self.variants)).rowcount
+        self._entries -= removed
+
+        # 超出总数时淘汰最久未使用的
+        if self._entries > self.max_entries:
+            removed = self.connection.execute("DELETE FROM readings WHERE id IN (SELECT id FROM readings ORDER BY served LIMIT ?)", (self._entries - self.max_entries,)).rowcount
+            self._entries -= removed
+        self.connection.commit()
+
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    # 清理过期的解读
+    def purge(self):
+        removed = self.connection.execute("DELETE FROM readings WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        self.connection.commit()
+        self._entries -= removed
+
+    def clear(self):
+        self.connection.execute("DELETE FROM readings")
+        self.connection.commit()
+        self._entries = 0
+
+    def close(self):
+        self.connection.close()
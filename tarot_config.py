@@ -1,15 +1,147 @@
 TAROT_DATA_PATH = "tarot_all_cn.json"
+# 牌组预编译缓存, 为None时不使用缓存
+TAROT_CACHE_PATH = "tarot_all_cn.cache"
+# 自动重新加载牌组时检查文件的间隔(秒)
+DECK_WATCH_INTERVAL = 2.0
+# 牌面与背景图片目录
+RESOURCES_PATH = "resources"
+# 图片缓存的内存上限(字节)
+ASSET_CACHE_SIZE = 256 * 1024 * 1024
+# 旋转牌面时的超采样倍数
+SPRITE_SUPERSAMPLE = 2
+# 牌面图集文件名(位于资源目录下), 用 python tarot_assets.py 构建
+ATLAS_NAME = "atlas"
+# 图集中额外保存的牌面整数倍缩小版本
+ATLAS_REDUCES = (2,)
+# 牌阵图片的分辨率档位, 值为相对原图的缩放比例
+RENDER_TIERS = {"full": 1.0, "preview": 0.5, "thumbnail": 0.25}
+# JPEG/WEBP编码质量
+DRAW_QUALITY = 85
+# PNG压缩等级(0-9), 越大越慢
+DRAW_PNG_COMPRESS_LEVEL = 3
+# 图片处理使用线程池"thread"或进程池"process"
+DRAW_EXECUTOR = "thread"
+# 图片处理的线程/进程数, None为自动
+DRAW_WORKERS = None
+
+# 最大同时占卜数
+MAX_CONCURRENCY = 2
+# 最大排队人数,超出后返回繁忙提示
+MAX_QUEUE_SIZE = 16
+# 最长排队时间(秒),超时后返回繁忙提示
+QUEUE_TIMEOUT = 120
 
 # 默认牌阵
 DEFAULT_SPREAD_KEY = "universalThreeCard"
 
+# 本地选择牌阵, 把握不足时才交给大模型选择
+LOCAL_SPREAD_SELECT = True
+# 本地选择牌阵的最低相似度
+SPREAD_SELECT_THRESHOLD = 0.2
+# 第一名需领先第二名的相似度
+SPREAD_SELECT_MARGIN = 0.05
+# 牌阵选择结果缓存数量
+SPREAD_SELECT_CACHE_SIZE = 1024
+
+# 塔罗牌讯息与占星讯息的token预算(估算值), None为不限制
+PROMPT_TOKEN_BUDGET = 2048
+# 超出预算时依次使用的缩减策略, 见DeckIndex
+PROMPT_SHRINK_POLICIES = ("brief_elements", "brief_positions", "brief_zodiacs", "drop_definitions")
+
+# 多主机连接池: 健康检查间隔(秒)
+BACKEND_HEALTH_INTERVAL = 10
+# 主机出错后的冷却时间(秒), 连续出错时翻倍, 健康检查成功后立即恢复
+BACKEND_FAILURE_COOLDOWN = 5
+# 每台主机保持的长连接数量
+BACKEND_KEEPALIVE_CONNECTIONS = 8
+# 空闲长连接的保持时间(秒)
+BACKEND_KEEPALIVE_EXPIRY = 120
+
+# 模型在Ollama中常驻的时间, 每次请求都会续期, 例如"30m", -1为一直常驻, None为使用Ollama的默认值(5分钟)
+MODEL_KEEP_ALIVE = "30m"
+# 一次占卜(选择牌阵与解读)的最长时间(秒), 不包括排队, None为不限制
+READING_TIMEOUT = 300
+# 大模型选择牌阵的最长时间(秒)
+SELECT_TIMEOUT = 30
+# 选择牌阵使用的模型, 只需输出一个牌阵key, 可以用比解读小得多的模型, None为与解读相同
+SELECT_MODEL = None
+# 选择牌阵的请求参数, 输出很短, 限制生成长度
+SELECT_OPTIONS = {"temperature": 0, "num_predict": 48}
+# 选择牌阵时用结构化输出把回答限制为牌阵key之一(需要Ollama 0.5以上), False为让模型自由回答
+SELECT_STRUCTURED_OUTPUT = True
+# 解读的请求参数, 例如{"temperature": 0.8, "num_ctx": 8192}, None为使用模型的默认值
+READING_OPTIONS = None
+# 大模型请求遇到连接错误、5xx或超时时的重试次数
+LLM_RETRIES = 2
+# 第一次重试前的等待时间(秒), 之后每次翻倍并加入随机抖动
+LLM_RETRY_BACKOFF = 0.5
+# 请求耗时超过最近耗时的该分位时再发一个相同的请求, 取先返回的结果, None为不对冲
+# 取0到1之间的小数, 例如0.95表示p95
+LLM_HEDGE_PERCENTILE = None
+# 计算百分位使用的最近请求数
+LLM_HEDGE_WINDOW = 200
+# 样本少于该数量时不对冲
+LLM_HEDGE_MIN_SAMPLES = 20
+
+# 各阶段耗时直方图的分桶(秒)
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 批量占卜同时进行的数量
+BATCH_CONCURRENCY = 4
+# 批量占卜保存的图片格式
+BATCH_IMAGE_FORMAT = "JPEG"
+
+# 解读缓存的SQLite文件
+INTERPRETATION_CACHE_PATH = "tarot_readings.sqlite3"
+# 解读缓存的有效期(秒)
+INTERPRETATION_CACHE_TTL = 7 * 24 * 3600
+# 解读缓存最多保存的条数, 超出时淘汰最久未使用的
+INTERPRETATION_CACHE_MAX_ENTRIES = 20000
+# 相同提问与抽牌结果保存的解读数, 存满之前继续生成新的解读, 之后轮流使用
+INTERPRETATION_CACHE_VARIANTS = 3
+# 只缓存不超过该牌数的牌阵, 牌数越多组合越多越难命中
+INTERPRETATION_CACHE_MAX_CARDS = 1
+# 空闲时预先生成解读的常见提问
+INTERPRETATION_CACHE_QUESTIONS = ("今日运势", "今天运势如何", "我的爱情运势", "我的事业运势", "我的财运")
+# 预先生成时, 有占卜进行中则等待该时间(秒)后再检查
+INTERPRETATION_CACHE_IDLE_INTERVAL = 5
+
+# 追问会话多久(秒)没有追问后失效
+SESSION_TTL = 30 * 60
+# 最多保存的追问会话数, 超出时淘汰最久未使用的
+SESSION_MAX_COUNT = 2000
+# 追问会话保存的对话文本的内存上限(字节)
+SESSION_MAX_BYTES = 64 * 1024 * 1024
+
+# HTTP服务监听的地址与端口
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 8000
+# HTTP服务的工作进程数, 多个进程监听同一个端口(需要系统支持SO_REUSEPORT)
+SERVER_WORKERS = 1
+# 繁忙时返回503, 无法估计等待时间时Retry-After的秒数
+SERVER_RETRY_AFTER = 5
+# 请求体的最大字节数
+SERVER_MAX_BODY = 64 * 1024
+# 请求头的最大数量
+SERVER_MAX_HEADERS = 100
+# 长连接空闲多久(秒)后断开
+SERVER_IDLE_TIMEOUT = 30
+# 停止服务时等待工作进程退出的秒数, 超时后强制结束
+SERVER_SHUTDOWN_TIMEOUT = 10
+
 # 去AI味
 REPLACE_STRING_TO_EMPTY = ("首先","其次","但是","可是","接着","最后","因此","然后","然而", "综上所述", "同时", "总之", "总的来说", "最重要的是")
+# 这些标点之后紧跟的重复标点会被去掉, 只保留第一个
+COLLAPSE_PUNCTUATION_LEADS = "？?！!。.，,"
+# 会被去掉的重复标点
+COLLAPSE_PUNCTUATION_FOLLOWS = "，,。.！!？?…、"
 
 # 问题询问的礼貌语
 USER_VL_MSG = "塔罗师您好,"
 # 请求分析
 USER_RA_MSG = "所以根据抽取到的塔罗牌与牌阵分析一下,"
+# 追问
+USER_FOLLOW_UP_MSG = "结合刚才抽到的牌,我还想问,"
 
 # 繁忙提示
 BUSY_TIPS = [
@@ -104,6 +236,9 @@ MAX_LENGTH = 150
 # 文本长度过长提示
 TOO_LONG_TIP = "汝的执念已超出梅尔卡巴光体承载极限...\n精简至三行以内,否则将触发记忆迷宫"
 
+# 追问会话不存在或已失效提示
+SESSION_EXPIRED_TIP = "这段占卜的因缘已经消散在星海之中...\n若仍有疑问,请重新洗牌,开启新的占卜"
+
 # 塔罗牌模式用语
 T_MODE = "" # "所有时间描述改为\"当[任意塔罗牌]进入[当前牌阵]的领域时\"\n例如: \"当恋人进入死神的领域时\""
 # 占星+塔罗牌模式用语
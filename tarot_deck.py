@@ -0,0 +1,583 @@
+# 预编译的牌组索引, 在tarot_all_cn.json加载时构建一次, 占卜时只需查表与拼接
+import os, re, sys, json, math, time, struct, marshal, hashlib, asyncio, threading
+from collections.abc import Mapping
+from tarot_config import TAROT_DATA_PATH, TAROT_CACHE_PATH, DECK_WATCH_INTERVAL, PROMPT_TOKEN_BUDGET, PROMPT_SHRINK_POLICIES
+from tarot_selector import SpreadSelector
+
+# 所有星座
+ALL_ZODIACS = ("Aries", "Leo", "Sagittarius", "Taurus", "Virgo", "Capricorn", "Gemini", "Libra", "Aquarius", "Cancer", "Scorpio", "Pisces")
+
+class CardRecord:
+    __slots__ = ("key", "id", "name_cn", "element_keys", "court_key", "zodiac_keys", "show_names", "texts", "element_text")
+
+    def __init__(self, key: str, id: int, name_cn: str, element_keys: tuple, court_key: str, zodiac_keys: tuple, show_names: tuple, texts: tuple, element_text: str):
+        self.key: str = key
+        self.id: int = id
+        self.name_cn: str = name_cn
+        self.element_keys: tuple = element_keys # 涉及的元素
+        self.court_key: str = court_key # 宫廷牌等级, 不是宫廷牌时为None
+        self.zodiac_keys: tuple = zodiac_keys # 占星模式下涉及的星座
+        self.show_names: tuple = show_names # [正位, 逆位]牌名
+        self.texts: tuple = texts # [正位, 逆位]的牌义
+        self.element_text: str = element_text # 引用元素讯息中的元素, 不重复元素的定义
+
+class SpreadRecord:
+    __slots__ = ("key", "name_cn", "card_count", "tarot_header", "show_header", "position_texts", "brief_position_texts", "show_position_texts", "interpretation_text", "data")
+
+    def __init__(self, key: str, spread: dict):
+        self.key: str = key
+        self.name_cn: str = spread["name_cn"]
+        self.data: dict = spread
+
+        spread_name = spread["name_cn"]
+        spread_description = spread["description_cn"]
+        positions = spread["positions"]
+
+        self.card_count: int = len(positions)
+        self.tarot_header: str = f"塔罗牌阵讯息:\n{spread_name}: {spread_description}\n"
+        self.show_header: str = f"{spread_name}: {spread_description}"
+        self.position_texts: tuple = tuple(f"\n{index + 1}. {position['name_cn']}: {position['description_cn']}" for index, position in enumerate(positions))
+        self.brief_position_texts: tuple = tuple(f"\n{index + 1}. {position['name_cn']}" for index, position in enumerate(positions))
+        self.show_position_texts: tuple = tuple(f"\n#{index + 1} {position['name_cn']}: {position['description_cn']}\n" for index, position in enumerate(positions))
+        self.interpretation_text: str = f"\n阵型解释:{spread['interpretation_method_cn']}"
+
+class PromptParts:
+    __slots__ = ("tarot_text", "show_text", "zodiacs_text", "elements", "court_keys", "astrology_modality_keys", "zodiacs_keys", "token_count", "shrink")
+
+    def __init__(self, tarot_text: str, show_text: str, zodiacs_text: str, elements: set, court_keys: tuple, astrology_modality_keys: set, zodiacs_keys: set, token_count: int = 0, shrink: tuple = ()):
+        self.tarot_text: str = tarot_text # 塔罗牌讯息
+        self.show_text: str = show_text # 展示给用户的牌阵
+        self.zodiacs_text: str = zodiacs_text # 占星讯息
+        self.elements: set = elements
+        self.court_keys: tuple = court_keys
+        self.astrology_modality_keys: set = astrology_modality_keys
+        self.zodiacs_keys: set = zodiacs_keys
+        self.token_count: int = token_count # 塔罗牌讯息与占星讯息的估算token数
+        self.shrink: tuple = shrink # 超出预算时使用的缩减策略
+
+# 中日韩文字
+CJK_PATTERN = re.compile(r'[　-〿一-鿿＀-￯]')
+
+# 估算token数, 不依赖模型的分词器: 中文约每字0.75个token, 其他字符约每4个字符1个token
+def estimate_tokens(text: str) -> int:
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return math.ceil(cjk_count * 0.75 + (len(text) - cjk_count) / 4)
+
+class DeckIndex:
+    """预编译的牌组索引
+
+    元素、宫廷牌、星座与星座模式的定义在一次占卜的提示词中只出现一次, 每张牌只引用元素名称.
+    提示词超出token预算时按PROMPT_SHRINK_POLICIES依次缩减:
+    brief_elements 元素只保留属性与含义, brief_positions 牌位不带描述,
+    brief_zodiacs 星座只保留模式与元素, drop_definitions 不再附带元素与宫廷牌的定义
+    """
+    SHRINK_POLICIES = ("brief_elements", "brief_positions", "brief_zodiacs", "drop_definitions")
+
+    def __init__(self, tarot_data: dict):
+        self.tarot_data: dict = tarot_data
+        # 提示词片段 -> 估算token数, 片段数量有限, 估算一次后查表
+        self.fragment_tokens: dict[str, int] = {}
+
+        elements = tarot_data["elements"]
+        court_elemental_correspondence = tarot_data["courtElementalCorrespondence"]
+
+        # 元素定义 [塔罗模式, 占星模式]
+        self.element_texts: dict[str, tuple] = {key: (self.__element_text(element, False), self.__element_text(element, True)) for key, element in elements.items()}
+        self.brief_element_texts: dict[str, str] = {key: f"\n{element['name_cn']}: {element['attribute']},{element['meaning']}" for key, element in elements.items()}
+        # 宫廷牌定义
+        self.court_keys: tuple = tuple(court_elemental_correspondence.keys())
+        self.court_texts: dict[str, str] = {key: f"\n{court['nameCN']}: 宫廷元素{court['elementCN']},含义:{court['meaning']}" for key, court in court_elemental_correspondence.items()}
+
+        self.cards: dict[str, CardRecord] = {}
+        for card_key, tarot_card in tarot_data["cards"].items():
+            self.cards[card_key] = self.__build_card(card_key, tarot_card, elements, court_elemental_correspondence)
+
+        # 卡牌选择模式 -> 可抽取的牌
+        card_keys = list(self.cards.keys())
+        self.card_keys: dict[int, list] = {0: card_keys, 1: card_keys[:22], 2: card_keys[-56:]}
+        # 牌与牌阵的序号, 用于紧凑的二进制序列化
+        self.card_numbers: dict[str, int] = {card_key: number for number, card_key in enumerate(card_keys)}
+
+        self.spreads: dict[str, SpreadRecord] = {key: SpreadRecord(key, spread) for key, spread in tarot_data["spreads"].items()}
+        self.spread_keys: tuple = tuple(self.spreads.keys())
+        self.spread_numbers: dict[str, int] = {spread_key: number for number, spread_key in enumerate(self.spread_keys)}
+
+        # 选择牌阵时提供给大模型的牌阵列表
+        self.spreads_text: str = "可选的牌阵有:" + "".join(f"\n{spread_id}: [\"{info['name_cn']}\", \"{info['description_cn']}\"]" for spread_id, info in tarot_data["spreads"].items())
+        # 选择牌阵时结构化输出的JSON Schema, 回答只能是{"spread": 牌阵key}
+        self.spread_schema: dict = {"type": "object", "properties": {"spread": {"type": "string", "enum": list(self.spread_keys)}}, "required": ["spread"]}
+
+        # 占星讯息 [完整, 简略]
+        self.zodiac_texts: dict[str, tuple] = {}
+        self.zodiac_modalities: dict[str, str] = {}
+        for zodiac_key, zodiac in tarot_data["zodiacs"].items():
+            self.zodiac_modalities[zodiac_key] = zodiac["astrologyModality"]
+            self.zodiac_texts[zodiac_key] = (self.__zodiac_text(zodiac), f"\n{zodiac['zodiacCN']}: {zodiac['astrologyModalityCN']},元素:{zodiac['elementCN']}")
+
+        self.astrology_modality_texts: dict[str, tuple] = {}
+        for modality_key, modality in tarot_data["astrologyModality"].items():
+            self.astrology_modality_texts[modality_key] = (f"\n{modality['name_cn']},对应宫廷牌:{modality['cardCN']},属性:{modality['attribute']},含义:{modality['meaning']}", f"\n{modality['name_cn']}: {modality['meaning']}")
+
+    # 属性文本处理
+    @staticmethod
+    def __element_text(element: dict, a_mod: bool) -> str:
+        color = ", ".join(element["colorsCN"])
+        result_text = f"\n{element['name_cn']}: 能量属性:{element['genderCN']},颜色:{color},生物:{element['animals']},表达:{element['expression']},属性:{element['attribute']},含义:{element['meaning']}"
+        if a_mod:
+            zodiac_cn = ", ".join(element['zodiacCN'])
+            result_text += f",元素对应星座:{zodiac_cn}"
+        return result_text
+
+    @staticmethod
+    def __zodiac_text(zodiac: dict) -> str:
+        text = f"\n{zodiac['zodiacCN']}: {zodiac['astrologyModalityCN']}\n元素:{zodiac['elementCN']},季节:{zodiac['seasonCN']},本质:{zodiac['nature']}"
+        if zodiac['rulingBodyTraditional']:
+            text += f",现代守护星: {zodiac['rulingBodyModern']}, 古典守护星: {zodiac['rulingBodyTraditional']}"
+        else:
+            text += f",守护星: {zodiac['rulingBodyModern']}"
+        return text
+
+    def __build_card(self, card_key: str, tarot_card: dict, elements: dict, court_elemental_correspondence: dict) -> CardRecord:
+        # 宫廷牌属性
+        court_key = None
+        for key in self.court_keys:
+            if card_key.lower().startswith(key):
+                court_key = key
+
+        element_keys = []
+        element_refs = []
+
+        first_element = tarot_card["first_element"]
+        second_element = tarot_card["second_element"]
+
+        if first_element:
+            element_keys.append(first_element)
+            element_refs.append(f"第一元素{tarot_card['first_element_cn']}")
+        if second_element:
+            element_keys.append(second_element)
+            element_refs.append(f"第二元素{tarot_card['second_element_cn']}")
+        if court_key is not None:
+            court_elemental = court_elemental_correspondence[court_key]
+            element_keys.append(court_elemental["element"])
+            element_refs.append(f"宫廷元素{court_elemental['elementCN']}({court_elemental['nameCN']})")
+
+        zodiac_keys = []
+        for element_key in element_keys:
+            zodiac_keys.extend(elements[element_key]["zodiac"])
+
+        show_names = ("正" + tarot_card["card_name_cn"], "逆" + tarot_card["card_name_cn"])
+        descriptions = (tarot_card["upright_cn"], tarot_card["reversed_cn"])
+        texts = tuple(f"\n{show_names[is_reversed]}: {descriptions[is_reversed]}" for is_reversed in (0, 1))
+        element_text = "\n" + ",".join(element_refs) if element_refs else ""
+
+        return CardRecord(card_key, tarot_card["id"], tarot_card["card_name_cn"], tuple(element_keys), court_key, tuple(zodiac_keys), show_names, texts, element_text)
+
+    # 生成一次占卜的提示词, 超出budget(估算token数)时依次使用policies中的缩减策略, budget为None时不限制
+    def build_prompt(self, spread_key: str, card_keys: list, is_reversed_list: list, a_mod: bool = False, budget: int = PROMPT_TOKEN_BUDGET, policies: tuple = PROMPT_SHRINK_POLICIES) -> PromptParts:
+        spread = self.spreads[spread_key]
+        cards = [self.cards[card_key] for card_key in card_keys]
+        a_mod = bool(a_mod)
+
+        show_texts = [spread.show_header]
+        total_elements = set()
+        court_keys = set()
+        total_zodiacs_key = set()
+
+        for index, card in enumerate(cards):
+            show_texts.append(spread.show_position_texts[index])
+            show_texts.append(card.show_names[is_reversed_list[index]])
+            total_elements.update(card.element_keys)
+            if card.court_key is not None:
+                court_keys.add(card.court_key)
+            if a_mod:
+                total_zodiacs_key.update(card.zodiac_keys)
+
+        # 按固定顺序输出定义, 同样的牌得到同样的提示词
+        elements = [key for key in self.element_texts if key in total_elements]
+        courts = [key for key in self.court_keys if key in court_keys]
+
+        total_astrology_modality_keys = set()
+        zodiacs = []
+        if a_mod:
+            if "all" in total_zodiacs_key:
+                total_zodiacs_key = set(ALL_ZODIACS)
+            zodiacs = [key for key in self.zodiac_texts if key in total_zodiacs_key]
+            total_astrology_modality_keys = {self.zodiac_modalities[key] for key in zodiacs}
+        modalities = [key for key in self.astrology_modality_texts if key in total_astrology_modality_keys]
+
+        shrink = []
+        tarot_texts, zodiacs_texts = self.__render(spread, cards, is_reversed_list, a_mod, elements, courts, zodiacs, modalities, shrink)
+        token_count = self.__count_tokens(tarot_texts, zodiacs_texts)
+
+        for policy in policies:
+            if budget is None or token_count <= budget:
+                break
+            shrink.append(policy)
+            tarot_texts, zodiacs_texts = self.__render(spread, cards, is_reversed_list, a_mod, elements, courts, zodiacs, modalities, shrink)
+            token_count = self.__count_tokens(tarot_texts, zodiacs_texts)
+
+        return PromptParts("".join(tarot_texts), "".join(show_texts), "".join(zodiacs_texts), total_elements, self.court_keys, total_astrology_modality_keys, total_zodiacs_key, token_count, tuple(shrink))
+
+    def __count_tokens(self, *fragment_lists: list) -> int:
+        fragment_tokens = self.fragment_tokens
+        token_count = 0
+        for fragments in fragment_lists:
+            for fragment in fragments:
+                tokens = fragment_tokens.get(fragment)
+                if tokens is None:
+                    tokens = fragment_tokens[fragment] = estimate_tokens(fragment)
+                token_count += tokens
+        return token_count
+
+    # 返回塔罗牌讯息与占星讯息的片段
+    def __render(self, spread: SpreadRecord, cards: list, is_reversed_list: list, a_mod: bool, elements: list, courts: list, zodiacs: list, modalities: list, shrink: list) -> tuple:
+        position_texts = spread.brief_position_texts if "brief_positions" in shrink else spread.position_texts
+
+        tarot_texts = [spread.tarot_header]
+        for index, card in enumerate(cards):
+            tarot_texts.append(position_texts[index])
+            tarot_texts.append(card.texts[is_reversed_list[index]])
+            tarot_texts.append(card.element_text)
+
+        if "drop_definitions" not in shrink:
+            if elements:
+                tarot_texts.append("\n\n元素讯息:")
+                if "brief_elements" in shrink:
+                    tarot_texts.extend(self.brief_element_texts[key] for key in elements)
+                else:
+                    tarot_texts.extend(self.element_texts[key][a_mod] for key in elements)
+            if courts:
+                tarot_texts.append("\n\n宫廷牌讯息:")
+                tarot_texts.extend(self.court_texts[key] for key in courts)
+
+        tarot_texts.append(spread.interpretation_text)
+
+        # 占星
+        zodiacs_texts = []
+        if a_mod:
+            brief = int("brief_zodiacs" in shrink)
+            zodiacs_texts.append("占星讯息:")
+            zodiacs_texts.extend(self.astrology_modality_texts[key][brief] for key in modalities)
+            zodiacs_texts.extend(self.zodiac_texts[key][brief] for key in zodiacs)
+
+        return tarot_texts, zodiacs_texts
+
+class DeckSnapshot:
+    """某一时刻的牌组数据, 创建后不再修改, 占卜开始时取用, 重新加载不影响进行中的占卜"""
+    __slots__ = ("data", "index", "selector", "source_hash", "load_time", "from_cache")
+
+    def __init__(self, data: dict, index: DeckIndex, selector: SpreadSelector, source_hash: str, load_time: float = 0.0, from_cache: bool = False):
+        self.data: dict = data # tarot_all_cn.json
+        self.index: DeckIndex = index
+        self.selector: SpreadSelector = selector
+        self.source_hash: str = source_hash
+        self.load_time: float = load_time # 加载耗时(秒)
+        self.from_cache: bool = from_cache # 是否读取自预编译缓存
+
+class TarotInfo(Mapping):
+    """一次抽牌的结果
+
+    只保存牌阵与牌的key(与牌组中的key是同一个字符串)、正逆位与占星模式, 以及所用牌组的引用,
+    牌、牌阵、元素与星座的数据在取用时才从牌组展开, 不随结果复制.
+    可以像原来的tarot_info dict一样使用: info["cards"], info["spread"], info["is_reversed_list"]等, expand()返回完整的dict.
+    to_json/to_bytes为紧凑的序列化, 读取时需要同一份牌组
+    """
+    __slots__ = ("spread_key", "card_keys", "is_reversed", "a_mod", "snapshot")
+    FIELDS = ("spread", "cards", "is_reversed_list", "astrologyModality", "courtElementalCorrespondence", "zodiacs", "elements")
+    # 二进制格式: 版本, 牌组sha256的前4字节, 牌阵序号, 标志(占星模式), 牌数, 每张牌1字节(低7位为序号, 最高位为逆位)
+    BINARY_HEADER = struct.Struct(">B4sHBB")
+    BINARY_VERSION = 1
+
+    def __init__(self, snapshot: DeckSnapshot, spread_key: str, card_keys: tuple, is_reversed_list: tuple, a_mod: bool = False):
+        self.snapshot: DeckSnapshot = snapshot
+        self.spread_key: str = spread_key
+        self.card_keys: tuple = tuple(card_keys)
+        self.is_reversed: tuple = tuple(bool(is_reversed) for is_reversed in is_reversed_list)
+        self.a_mod: bool = bool(a_mod)
+
+    def __repr__(self) -> str:
+        return f"TarotInfo({self.spread_key!r}, {list(self.card_keys)!r}, {list(self.is_reversed)!r}, a_mod={self.a_mod})"
+
+    def __getitem__(self, name: str):
+        data = self.snapshot.data
+        if name == "spread":
+            return data["spreads"][self.spread_key]
+        if name == "cards":
+            return {card_key: data["cards"][card_key] for card_key in self.card_keys}
+        if name == "is_reversed_list":
+            return list(self.is_reversed)
+        if name == "courtElementalCorrespondence":
+            # 与提示词相同, 包括全部宫廷牌
+            return dict(data[name])
+        if name not in self.FIELDS:
+            raise KeyError(name)
+
+        elements, zodiacs = self.__related_keys()
+        if name == "elements":
+            keys = elements
+        elif name == "zodiacs":
+            keys = zodiacs
+        else:
+            keys = {self.snapshot.index.zodiac_modalities[key] for key in zodiacs}
+        return {key: value for key, value in data[name].items() if key in keys}
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    # 抽到的牌涉及的元素与星座(占星模式)
+    def __related_keys(self) -> tuple:
+        cards = self.snapshot.index.cards
+        elements, zodiacs = set(), set()
+        for card_key in self.card_keys:
+            card = cards[card_key]
+            elements.update(card.element_keys)
+            if self.a_mod:
+                zodiacs.update(card.zodiac_keys)
+        if "all" in zodiacs:
+            zodiacs = set(ALL_ZODIACS)
+        return elements, zodiacs
+
+    @property
+    def spread(self) -> dict:
+        return self.snapshot.data["spreads"][self.spread_key]
+
+    # 按牌位顺序的牌
+    @property
+    def cards(self) -> list[dict]:
+        cards = self.snapshot.data["cards"]
+        return [cards[card_key] for card_key in self.card_keys]
+
+    @property
+    def is_reversed_list(self) -> list:
+        return list(self.is_reversed)
+
+    # 原来的完整tarot_info dict
+    def expand(self) -> dict:
+        return {name: self[name] for name in self.FIELDS}
+
+    def to_json(self) -> dict:
+        return {"spread": self.spread_key, "cards": list(self.card_keys), "is_reversed_list": list(self.is_reversed), "a_mod": self.a_mod}
+
+    @classmethod
+    def from_json(cls, data: dict, snapshot: DeckSnapshot) -> "TarotInfo":
+        try:
+            return cls.validated(snapshot, data["spread"], data["cards"], data["is_reversed_list"], data.get("a_mod", False))
+        except (KeyError, TypeError):
+            raise ValueError("invalid tarot info")
+
+    def to_bytes(self) -> bytes:
+        index = self.snapshot.index
+        numbers = [index.card_numbers[card_key] for card_key in self.card_keys]
+        if max(numbers, default=0) > 0x7F or len(numbers) > 0xFF:
+            raise ValueError("deck is too large for the binary format")
+        header = self.BINARY_HEADER.pack(self.BINARY_VERSION, bytes.fromhex(self.snapshot.source_hash[:8]), index.spread_numbers[self.spread_key], int(self.a_mod), len(numbers))
+        return header + bytes(number | (0x80 if is_reversed else 0) for number, is_reversed in zip(numbers, self.is_reversed))
+
+    # 牌组与写入时不同时抛出ValueError
+    @classmethod
+    def from_bytes(cls, data: bytes, snapshot: DeckSnapshot) -> "TarotInfo":
+        size = cls.BINARY_HEADER.size
+        try:
+            version, deck_hash, spread_number, flags, card_count = cls.BINARY_HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError("invalid tarot info")
+        if version != cls.BINARY_VERSION or len(data) != size + card_count:
+            raise ValueError("invalid tarot info")
+        if deck_hash != bytes.fromhex(snapshot.source_hash[:8]):
+            raise ValueError("tarot info was written with a different deck")
+
+        index = snapshot.index
+        card_keys = index.card_keys[0]
+        try:
+            return cls.validated(snapshot, index.spread_keys[spread_number], [card_keys[byte & 0x7F] for byte in data[size:]], [bool(byte & 0x80) for byte in data[size:]], flags & 1)
+        except IndexError:
+            raise ValueError("invalid tarot info")
+
+    # 检查牌阵与牌是否存在、牌数是否与牌阵一致
+    @classmethod
+    def validated(cls, snapshot: DeckSnapshot, spread_key: str, card_keys: list, is_reversed_list: list, a_mod: bool = False) -> "TarotInfo":
+        index = snapshot.index
+        spread = index.spreads.get(spread_key)
+        if spread is None:
+            raise ValueError(f"unknown spread {spread_key}")
+        if len(card_keys) != spread.card_count:
+            raise ValueError(f"spread {spread_key} needs {spread.card_count} cards")
+        if len(is_reversed_list) != len(card_keys):
+            raise ValueError("is_reversed_list must match cards")
+        for card_key in card_keys:
+            if card_key not in index.cards:
+                raise ValueError(f"unknown card {card_key}")
+        # 使用牌组中的字符串, 不另外保存一份
+        return cls(snapshot, spread_key, [index.cards[card_key].key for card_key in card_keys], is_reversed_list, a_mod)
+
+# 预编译缓存的文件头长度
+CACHE_HEADER = struct.Struct("<I")
+
+class DeckStore:
+    """进程共享的牌组
+
+    第一次加载后把解析好的牌组数据与SpreadSelector的索引一起写入预编译缓存,
+    之后源文件的修改时间与大小和缓存记录的一致时直接从缓存恢复, 不再读取与解析JSON;
+    不一致时才读取源文件计算sha256, 内容没变则复用缓存并更新记录, 变了则重新解析并重写缓存.
+    DeckIndex由恢复的数据重新构建(约2ms), 它含有对象, 不放进缓存.
+    缓存用marshal保存纯数据(dict/list/str/float/bytes), SpreadSelector的倒排索引保存为数组的字节, 读取时不会像pickle那样执行任何代码.
+    重新加载在线程中进行, 完成后原子替换snapshot
+    """
+    CACHE_VERSION = 3
+    # 源文件路径 -> 共享的DeckStore
+    _shared: dict = {}
+
+    def __init__(self, path: str = TAROT_DATA_PATH, cache_path: str = TAROT_CACHE_PATH):
+        self.path: str = path
+        self.cache_path: str = cache_path
+        self._snapshot: DeckSnapshot = None
+        self._watch_task: asyncio.Task = None
+        self._reload_lock = threading.Lock()
+
+    # 按源文件路径共享的DeckStore, 首次调用时同步加载
+    @classmethod
+    def shared(cls, path: str = TAROT_DATA_PATH, cache_path: str = TAROT_CACHE_PATH) -> "DeckStore":
+        store = cls._shared.get(path)
+        if store is None:
+            store = cls._shared[path] = cls(path, cache_path)
+        return store
+
+    @property
+    def snapshot(self) -> DeckSnapshot:
+        if self._snapshot is None:
+            self.reload()
+        return self._snapshot
+
+    # 缓存的格式由SpreadSelector的代码决定, 代码改动后缓存也要失效
+    @classmethod
+    def cache_version(cls) -> str:
+        version = cls.__dict__.get("_cache_version")
+        if version is None:
+            digest = hashlib.sha256(str(cls.CACHE_VERSION).encode())
+            for module in (sys.modules[__name__], sys.modules[SpreadSelector.__module__]):
+                with open(module.__file__, 'rb') as file:
+                    digest.update(file.read())
+            version = cls._cache_version = digest.hexdigest()
+        return version
+
+    def __stat(self) -> tuple:
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # 读取预编译缓存, 返回(文件头, 缓存内容), 不可用时返回None
+    # 缓存为: 文件头长度(uint32) + 文件头 + 内容, 先解析并校验文件头, 版本不一致时不再解析后面的内容
+    def __read_cache(self) -> tuple:
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path, 'rb') as file:
+                content = memoryview(file.read())
+            header_size, = CACHE_HEADER.unpack_from(content)
+            body_start = CACHE_HEADER.size + header_size
+            header = marshal.loads(content[CACHE_HEADER.size:body_start])
+            if not isinstance(header, dict) or header.get("version") != DeckStore.cache_version() or not isinstance(header.get("sha256"), str):
+                return None
+            return header, content[body_start:]
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return None
+
+    # 从缓存内容恢复(牌组数据, SpreadSelector), 格式错误时返回None
+    @staticmethod
+    def __restore(body: memoryview) -> tuple:
+        try:
+            cached = marshal.loads(body)
+            if not isinstance(cached, dict) or not isinstance(cached.get("data"), dict) or not isinstance(cached.get("selector"), dict):
+                return None
+            return cached["data"], SpreadSelector.from_json(cached["selector"])
+        except (EOFError, ValueError, TypeError, KeyError):
+            return None
+
+    def __save_cache(self, stat: tuple, source_hash: str, data: dict, selector: SpreadSelector):
+        if self.cache_path is None:
+            return
+        header = {"version": DeckStore.cache_version(), "mtime_ns": stat[0], "size": stat[1], "sha256": source_hash}
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            header = marshal.dumps(header)
+            with open(temp_path, 'wb') as file:
+                file.write(CACHE_HEADER.pack(len(header)))
+                file.write(header)
+                file.write(marshal.dumps({"data": data, "selector": selector.to_json()}))
+            os.replace(temp_path, self.cache_path)
+        except (OSError, ValueError):
+            # 缓存只是加速, 写不了就算了
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    # 解析源文件并构建SpreadSelector
+    @staticmethod
+    def __parse(raw: bytes) -> tuple:
+        data = json.loads(raw.decode('utf-8'))
+        return data, SpreadSelector(data['spreads'])
+
+    # 加载一份新的snapshot(不替换当前snapshot)
+    def load(self) -> DeckSnapshot:
+        start = time.perf_counter()
+        stat = self.__stat()
+        cache = self.__read_cache()
+        restored = None
+        if cache is not None:
+            header, body = cache
+            # 修改时间与大小一致时直接信任缓存, 不再读取源文件
+            if (header.get("mtime_ns"), header.get("size")) == stat:
+                restored = self.__restore(body)
+                source_hash = header.get("sha256")
+
+        if restored is None:
+            with open(self.path, 'rb') as file:
+                raw = file.read()
+            stat = self.__stat()
+            source_hash = hashlib.sha256(raw).hexdigest()
+            # 只是修改时间变了(例如重新检出)时内容仍可复用, 更新文件头即可
+            if cache is not None and cache[0].get("sha256") == source_hash:
+                restored = self.__restore(cache[1])
+            data, selector = restored or self.__parse(raw)
+            self.__save_cache(stat, source_hash, data, selector)
+        else:
+            data, selector = restored
+
+        return DeckSnapshot(data, DeckIndex(data), selector, source_hash, time.perf_counter() - start, restored is not None)
+
+    # 同步重新加载
+    def reload(self) -> DeckSnapshot:
+        with self._reload_lock:
+            self._snapshot = self.load()
+        return self._snapshot
+
+    # 在线程中重新加载, 不阻塞事件循环
+    async def reload_async(self) -> DeckSnapshot:
+        return await asyncio.to_thread(self.reload)
+
+    # 定时检查源文件, 有变化时自动重新加载
+    def start_watching(self, interval: float = DECK_WATCH_INTERVAL) -> asyncio.Task:
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.get_running_loop().create_task(self.__watch(interval))
+        return self._watch_task
+
+    def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    async def __watch(self, interval: float):
+        last_stat = self.__stat()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                stat = self.__stat()
+                if stat != last_stat:
+                    last_stat = stat
+                    await self.reload_async()
+            except Exception:
+                # 文件正在写入或格式错误时保留旧的snapshot, 下次再试
+                last_stat = None
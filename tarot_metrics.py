@@ -0,0 +1,161 @@
+import time, weakref
+from contextlib import contextmanager
+from tarot_config import METRICS_BUCKETS
+
+# Ollama响应中的用量字段, 时间单位为纳秒
+USAGE_FIELDS = ("prompt_eval_count", "eval_count", "total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+
+# 记录一个阶段的耗时(秒)到timings, 同名阶段累加
+@contextmanager
+def stage(timings: dict, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+# 从Ollama的响应(或流式响应的最后一段)中取出用量
+def usage_of(response) -> dict:
+    usage = {}
+    for field in USAGE_FIELDS:
+        value = response.get(field)
+        if value is not None:
+            usage[field] = value
+    return usage
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets: tuple = buckets
+        self.counts: list[int] = [0] * len(buckets)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+class TarotMetrics:
+    """占卜的耗时与用量统计
+
+    每次占卜结束时汇总TarotContent.timings与usage, 调用注册的钩子, 并可以导出Prometheus文本格式
+    """
+    def __init__(self, buckets: tuple = METRICS_BUCKETS):
+        self.buckets: tuple = buckets
+        self.stage_seconds: dict[str, Histogram] = {} # 阶段 -> 耗时
+        self.readings: dict[str, int] = {} # 结果(complete或失败原因) -> 次数
+        self.tokens: dict[tuple, int] = {} # (阶段, prompt/eval) -> token数
+        self.llm_seconds: dict[tuple, float] = {} # (阶段, load/prompt_eval/eval) -> 秒
+        self.gauges: dict[str, tuple] = {} # 名称 -> (说明, 类型, [(取值函数, 所属对象的弱引用)])
+        self.hooks: list = []
+
+    # 注册钩子, 每次占卜结束时以TarotContent调用
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    # 注册即时取值的指标, 例如排队人数, 同名指标导出各取值函数之和, kind为gauge或counter
+    # owner不为None时只保存它的弱引用并以owner调用getter, owner被回收后指标自动移除, 不会让统计对象留住owner
+    def add_gauge(self, name: str, help_text: str, getter, kind: str = "gauge", owner=None):
+        if name not in self.gauges:
+            self.gauges[name] = (help_text, kind, [])
+        self.gauges[name][2].append((getter, weakref.ref(owner) if owner is not None else None))
+
+    # 移除owner注册的全部指标
+    def remove_gauges(self, owner):
+        for name, (__, __, entries) in list(self.gauges.items()):
+            entries[:] = [(getter, ref) for getter, ref in entries if ref is None or ref() not in (None, owner)]
+            if not entries:
+                del self.gauges[name]
+
+    # 指标的当前值, 顺便清理owner已被回收的取值函数
+    def __gauge_value(self, entries: list):
+        value = 0
+        for getter, ref in list(entries):
+            if ref is None:
+                value += getter()
+                continue
+            owner = ref()
+            if owner is None:
+                entries.remove((getter, ref))
+            else:
+                value += getter(owner)
+        return value
+
+    def observe_stage(self, name: str, seconds: float):
+        histogram = self.stage_seconds.get(name)
+        if histogram is None:
+            histogram = self.stage_seconds[name] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    # 记录一次大模型请求的用量, stage为select或reading
+    def observe_usage(self, stage_name: str, usage: dict):
+        for kind, field in (("prompt", "prompt_eval_count"), ("eval", "eval_count")):
+            count = usage.get(field)
+            if count is not None:
+                self.tokens[(stage_name, kind)] = self.tokens.get((stage_name, kind), 0) + count
+        for kind in ("load", "prompt_eval", "eval"):
+            duration = usage.get(f"{kind}_duration")
+            if duration is not None:
+                self.llm_seconds[(stage_name, kind)] = self.llm_seconds.get((stage_name, kind), 0.0) + duration / 1e9
+
+    # 一次占卜结束
+    def observe_reading(self, result):
+        for name, seconds in result.timings.items():
+            self.observe_stage(name, seconds)
+        if result.usage:
+            self.observe_usage("reading", result.usage)
+
+        outcome = "complete" if result.is_complete else (result.failure_reason or "unknown")
+        self.readings[outcome] = self.readings.get(outcome, 0) + 1
+
+        for hook in self.hooks:
+            try:
+                hook(result)
+            except Exception:
+                # 钩子出错不影响占卜
+                pass
+
+    # Prometheus文本格式
+    def render(self) -> str:
+        lines = []
+
+        lines.append("# HELP tarot_stage_seconds Time spent in each stage of a reading.")
+        lines.append("# TYPE tarot_stage_seconds histogram")
+        for name, histogram in sorted(self.stage_seconds.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'tarot_stage_seconds_bucket{{stage="{name}",le="{bound:g}"}} {count}')
+            lines.append(f'tarot_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'tarot_stage_seconds_sum{{stage="{name}"}} {histogram.sum:.6f}')
+            lines.append(f'tarot_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+
+        lines.append("# HELP tarot_readings_total Finished readings by outcome.")
+        lines.append("# TYPE tarot_readings_total counter")
+        for outcome, count in sorted(self.readings.items()):
+            lines.append(f'tarot_readings_total{{outcome="{outcome}"}} {count}')
+
+        lines.append("# HELP tarot_llm_tokens_total Tokens reported by Ollama.")
+        lines.append("# TYPE tarot_llm_tokens_total counter")
+        for (stage_name, kind), count in sorted(self.tokens.items()):
+            lines.append(f'tarot_llm_tokens_total{{stage="{stage_name}",kind="{kind}"}} {count}')
+
+        lines.append("# HELP tarot_llm_seconds_total Time reported by Ollama.")
+        lines.append("# TYPE tarot_llm_seconds_total counter")
+        for (stage_name, kind), seconds in sorted(self.llm_seconds.items()):
+            lines.append(f'tarot_llm_seconds_total{{stage="{stage_name}",kind="{kind}"}} {seconds:.6f}')
+
+        for name, (help_text, kind, entries) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {self.__gauge_value(entries)}")
+
+        return "\n".join(lines) + "\n"
+
+# 进程共享的统计
+reading_metrics = TarotMetrics()
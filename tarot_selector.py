@@ -0,0 +1,176 @@
+import re, sys, math, array
+from collections import OrderedDict
+from tarot_config import SPREAD_SELECT_THRESHOLD, SPREAD_SELECT_MARGIN, SPREAD_SELECT_CACHE_SIZE
+
+class SpreadSelector:
+    """本地牌阵选择器
+
+    用牌阵的名称、描述与适用场景建立中文字符 n-gram 的 TF-IDF 索引,
+    提问与牌阵的余弦相似度足够高且明显领先第二名时直接选定牌阵,
+    否则返回None交给大模型选择
+    """
+    # 只保留中文、英文与数字
+    NORMALIZE_PATTERN = re.compile(r'[^一-鿿a-z0-9]+')
+    # 适用场景在牌阵文本中重复的次数, 用benchmarks/spread_questions.py中标注的提问校准
+    SUITABLE_FOR_WEIGHT = 4
+
+    def __init__(self, spreads: dict, threshold: float = SPREAD_SELECT_THRESHOLD, margin: float = SPREAD_SELECT_MARGIN, cache_size: int = SPREAD_SELECT_CACHE_SIZE, ngram: tuple = (1, 2, 3)):
+        self.threshold: float = threshold
+        self.margin: float = margin
+        self.cache_size: int = cache_size
+        self.ngram: tuple = ngram
+        self._cache: OrderedDict[str, str] = OrderedDict()
+
+        documents = {spread_key: self.__spread_text(spread) for spread_key, spread in spreads.items()}
+
+        # 文档频率
+        doc_freq: dict[str, int] = {}
+        doc_grams: dict[str, dict[str, int]] = {}
+        for spread_key, text in documents.items():
+            grams = self.__grams(text)
+            doc_grams[spread_key] = grams
+            for gram in grams:
+                doc_freq[gram] = doc_freq.get(gram, 0) + 1
+
+        count = len(documents)
+        idf: dict[str, float] = {gram: math.log((count + 1) / (freq + 1)) + 1 for gram, freq in doc_freq.items()}
+
+        # 倒排索引: gram -> [(牌阵序号, 归一化后的权重)]
+        self.spread_keys: tuple = tuple(documents.keys())
+        postings: dict[str, list[tuple[int, float]]] = {gram: [] for gram in idf}
+        for spread_number, grams in enumerate(doc_grams.values()):
+            vector = {gram: tf * idf[gram] for gram, tf in grams.items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            for gram, weight in vector.items():
+                postings[gram].append((spread_number, weight / norm))
+
+        # 展平成数组: 第i个gram的倒排表为posting_spreads/posting_weights[offsets[i]:offsets[i + 1]]
+        # 数组可以整块写入预编译缓存, 恢复时不用逐个创建元组与浮点数对象
+        self.gram_ids: dict[str, int] = {gram: gram_id for gram_id, gram in enumerate(idf)}
+        self.idf: array.array = array.array('d', idf.values())
+        self.offsets: array.array = array.array('I', [0])
+        self.posting_spreads: array.array = array.array('H')
+        self.posting_weights: array.array = array.array('d')
+        for gram_postings in postings.values():
+            for spread_number, weight in gram_postings:
+                self.posting_spreads.append(spread_number)
+                self.posting_weights.append(weight)
+            self.offsets.append(len(self.posting_spreads))
+
+    # 索引的纯数据形式, 用于牌组的预编译缓存; 数组按本机字节序保存
+    def to_json(self) -> dict:
+        return {
+            "ngram": list(self.ngram),
+            "byteorder": sys.byteorder,
+            "spread_keys": list(self.spread_keys),
+            # gram只含中文、英文与数字, 用空格连接
+            "grams": " ".join(self.gram_ids),
+            "idf": self.idf.tobytes(),
+            "offsets": self.offsets.tobytes(),
+            "posting_spreads": self.posting_spreads.tobytes(),
+            "posting_weights": self.posting_weights.tobytes(),
+        }
+
+    # 从to_json的结果恢复索引, 不重新计算TF-IDF, 格式不对时抛出ValueError
+    @classmethod
+    def from_json(cls, data: dict, threshold: float = SPREAD_SELECT_THRESHOLD, margin: float = SPREAD_SELECT_MARGIN, cache_size: int = SPREAD_SELECT_CACHE_SIZE) -> "SpreadSelector":
+        try:
+            if data["byteorder"] != sys.byteorder:
+                raise ValueError("invalid selector data")
+            ngram, spread_keys, grams = tuple(data["ngram"]), tuple(data["spread_keys"]), data["grams"].split(" ")
+            arrays = {}
+            for name, typecode in (("idf", 'd'), ("offsets", 'I'), ("posting_spreads", 'H'), ("posting_weights", 'd')):
+                arrays[name] = array.array(typecode)
+                arrays[name].frombytes(data[name])
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError("invalid selector data")
+        offsets, posting_spreads = arrays["offsets"], arrays["posting_spreads"]
+        if len(arrays["idf"]) != len(grams) or len(offsets) != len(grams) + 1 or offsets[-1] != len(posting_spreads) or len(posting_spreads) != len(arrays["posting_weights"]) \
+                or max(offsets) > len(posting_spreads) or (posting_spreads and max(posting_spreads) >= len(spread_keys)):
+            raise ValueError("invalid selector data")
+
+        selector = cls.__new__(cls)
+        selector.threshold = threshold
+        selector.margin = margin
+        selector.cache_size = cache_size
+        selector.ngram = ngram
+        selector._cache = OrderedDict()
+        selector.spread_keys = spread_keys
+        selector.gram_ids = {gram: gram_id for gram_id, gram in enumerate(grams)}
+        for name, values in arrays.items():
+            setattr(selector, name, values)
+        return selector
+
+    @staticmethod
+    def __spread_text(spread: dict) -> str:
+        # 名称与适用场景更能代表牌阵的用途, 重复以提高权重; 适用场景最能区分用途相近的牌阵(例如工作情绪与职业发展)
+        suitable_for = " ".join(spread.get("suitable_for_cn", []))
+        return " ".join((spread["name_cn"], spread["name_cn"], spread["description_cn"]) + (suitable_for,) * SpreadSelector.SUITABLE_FOR_WEIGHT)
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        return cls.NORMALIZE_PATTERN.sub(" ", text.lower()).strip()
+
+    def __grams(self, text: str) -> dict[str, int]:
+        grams: dict[str, int] = {}
+        for word in self.normalize(text).split():
+            for n in self.ngram:
+                for index in range(len(word) - n + 1):
+                    gram = word[index:index + n]
+                    grams[gram] = grams.get(gram, 0) + 1
+        return grams
+
+    # 计算提问与所有牌阵的相似度, 从高到低排序
+    def score(self, question: str) -> list[tuple[str, float]]:
+        vector: dict[int, float] = {}
+        for gram, tf in self.__grams(question).items():
+            gram_id = self.gram_ids.get(gram)
+            if gram_id is not None:
+                vector[gram_id] = tf * self.idf[gram_id]
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if norm <= 0:
+            return []
+
+        scores: dict[str, float] = {}
+        for gram_id, weight in vector.items():
+            for position in range(self.offsets[gram_id], self.offsets[gram_id + 1]):
+                spread_key = self.spread_keys[self.posting_spreads[position]]
+                scores[spread_key] = scores.get(spread_key, 0.0) + weight * self.posting_weights[position] / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    # 选择牌阵, 把握不足时返回None
+    def select(self, question: str) -> str:
+        key = self.normalize(question)
+        spread_key = self.lookup(key)
+        if spread_key is not None:
+            return spread_key
+
+        scores = self.score(key)
+        if not scores:
+            return None
+
+        top_key, top_score = scores[0]
+        second_score = scores[1][1] if len(scores) > 1 else 0.0
+        if top_score < self.threshold or top_score - second_score < self.margin:
+            return None
+
+        self.remember(key, top_key)
+        return top_key
+
+    # 查询LRU缓存
+    def lookup(self, question: str) -> str:
+        key = self.normalize(question)
+        spread_key = self._cache.get(key)
+        if spread_key is not None:
+            self._cache.move_to_end(key)
+        return spread_key
+
+    # 写入LRU缓存(例如大模型选出的牌阵)
+    def remember(self, question: str, spread_key: str):
+        if self.cache_size <= 0:
+            return
+        key = self.normalize(question)
+        self._cache[key] = spread_key
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
@@ -0,0 +1,467 @@
+# 基于asyncio的HTTP服务, 只依赖标准库
+# POST /reading          占卜, 返回JSON
+# POST /reading/stream   占卜, 以Server-Sent Events逐句返回
+# POST /follow_up        在占卜后追问(占卜时需要"session": true), POST /follow_up/stream 追问的流式版本
+# GET  /image            绘制牌阵图片, 参数: spread, cards(逗号分隔), reversed(逗号分隔的0/1), format, tier
+# GET  /health           运行状态, GET /metrics Prometheus文本格式的统计
+# 运行: python tarot_server.py --model MODEL --url HOST [--workers 4]
+import os, json, time, socket, signal, asyncio
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from tarot import Tarot, TarotContent, TarotDraw, TarotFailure, TarotInfo
+from tarot_config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_RETRY_AFTER, SERVER_MAX_BODY, SERVER_MAX_HEADERS, SERVER_IDLE_TIMEOUT, SERVER_SHUTDOWN_TIMEOUT, RESOURCES_PATH, RENDER_TIERS
+
+# 失败原因 -> HTTP状态码
+FAILURE_STATUS = {
+    TarotFailure.EMPTY_MESSAGE: 400,
+    TarotFailure.TOO_LONG: 400,
+    TarotFailure.INVALID_SPREAD: 400,
+    TarotFailure.SESSION_EXPIRED: 404,
+    TarotFailure.BUSY: 503,
+    TarotFailure.TIMEOUT: 504,
+    TarotFailure.BACKEND_UNAVAILABLE: 502,
+    TarotFailure.BACKEND_ERROR: 502,
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error", 501: "Not Implemented", 502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+IMAGE_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status: int = status
+        self.message: str = message
+
+class HttpRequest:
+    __slots__ = ("method", "path", "query", "version", "headers", "body")
+
+    def __init__(self, method: str, target: str, version: str, headers: dict, body: bytes):
+        url = urlsplit(target)
+        self.method: str = method
+        self.version: str = version
+        self.path: str = url.path
+        self.query: dict = dict(parse_qsl(url.query))
+        self.headers: dict = headers
+        self.body: bytes = body
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "invalid json")
+        if not isinstance(data, dict):
+            raise HttpError(400, "expected a json object")
+        return data
+
+    # HTTP/1.1默认保持连接, HTTP/1.0只在明确要求时保持
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+class TarotServer:
+    """Tarot的HTTP前端
+
+    占卜位与等待队列都满时直接返回503与Retry-After, 由客户端稍后重试, 不再返回繁忙提示文本.
+    牌阵图片在TarotDraw的线程池中绘制, 不阻塞事件循环
+    """
+    def __init__(self, tarot: Tarot, tarot_draw: TarotDraw = None, host: str = SERVER_HOST, port: int = SERVER_PORT, retry_after: float = SERVER_RETRY_AFTER, max_body: int = SERVER_MAX_BODY, idle_timeout: float = SERVER_IDLE_TIMEOUT, max_headers: int = SERVER_MAX_HEADERS):
+        self.tarot: Tarot = tarot
+        self.tarot_draw: TarotDraw = tarot_draw if tarot_draw is not None else TarotDraw(RESOURCES_PATH)
+        self.host: str = host
+        self.port: int = port # 0为随机端口
+        self.retry_after: float = retry_after
+        self.max_body: int = max_body
+        self.idle_timeout: float = idle_timeout
+        self.max_headers: int = max_headers
+        self.requests: int = 0
+        self.rejected: int = 0 # 因繁忙返回503的次数
+        self._server: asyncio.Server = None
+        self._writers: set = set()
+
+        self.tarot.metrics.add_gauge("tarot_http_requests_total", "HTTP requests handled by this worker.", lambda server: server.requests, "counter", self)
+        self.tarot.metrics.add_gauge("tarot_http_rejected_total", "HTTP requests rejected with 503 because the worker was saturated.", lambda server: server.rejected, "counter", self)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # reuse_port为True时多个进程可以监听同一个端口, 由系统分配连接
+    async def start(self, reuse_port: bool = False) -> "TarotServer":
+        self._server = await asyncio.start_server(self.__handle, self.host, self.port, reuse_port=reuse_port or None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self.tarot.metrics.remove_gauges(self)
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "TarotServer":
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    # 一个连接上可以有多个请求(keep-alive)
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self.__read_request(reader)
+                except HttpError as error:
+                    await self.__send_json(writer, error.status, {"error": error.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                self.requests += 1
+                try:
+                    keep_alive = await self.__route(request, writer)
+                except HttpError as error:
+                    keep_alive = await self.__send_json(writer, error.status, {"error": error.message}, keep_alive=request.keep_alive)
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as error:
+                    keep_alive = await self.__send_json(writer, 500, {"error": repr(error)}, keep_alive=False)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # 客户端断开或服务关闭
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def __read_request(self, reader: asyncio.StreamReader) -> HttpRequest:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "invalid request line")
+
+        headers = {}
+        count = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            count += 1
+            if count > self.max_headers:
+                raise HttpError(431, "too many headers")
+            name, __, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        # 不支持分块传输, 不读取请求体就无法知道下一个请求从哪里开始, 返回错误后关闭连接
+        if "transfer-encoding" in headers:
+            raise HttpError(501, "transfer-encoding is not supported, send content-length")
+
+        # 只接受十进制数字, 负数与"+1"、"1_000"之类int能解析的写法都视为无效
+        length = headers.get("content-length") or "0"
+        if not (length.isascii() and length.isdigit()):
+            raise HttpError(400, "invalid content-length")
+        length = int(length)
+        if length > self.max_body:
+            raise HttpError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return HttpRequest(method.upper(), target, version.strip().upper(), headers, body)
+
+    # 返回是否保持连接
+    async def __route(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        routes = {
+            "/reading": ("POST", self.__reading),
+            "/reading/stream": ("POST", self.__reading_stream),
+            "/follow_up": ("POST", self.__follow_up),
+            "/follow_up/stream": ("POST", self.__follow_up_stream),
+            "/image": ("GET", self.__image),
+            "/health": ("GET", self.__health),
+            "/metrics": ("GET", self.__metrics),
+        }
+        route = routes.get(request.path)
+        if route is None:
+            raise HttpError(404, f"{request.path} not found")
+        method, handler = route
+        if request.method != method:
+            raise HttpError(405, f"use {method}")
+        return await handler(request, writer)
+
+    # 根据最近的占卜耗时估计需要等待的秒数
+    def __retry_after(self) -> int:
+        histogram = self.tarot.metrics.stage_seconds.get("total")
+        if histogram is None or histogram.count == 0:
+            return int(self.retry_after)
+        scheduler = self.tarot.scheduler
+        waiting = (scheduler.queue_depth + 1) / scheduler.max_concurrency
+        return max(1, min(int(histogram.sum / histogram.count * waiting + 0.5), 300))
+
+    async def __busy(self, writer: asyncio.StreamWriter, keep_alive: bool) -> bool:
+        self.rejected += 1
+        return await self.__send_json(writer, 503, {"error": TarotFailure.BUSY}, {"Retry-After": str(self.__retry_after())}, keep_alive)
+
+    # 请求体: {"question": 提问, "a_mod": 占星模式, "card_select": 卡牌选择模式, "spread": 指定牌阵, "session": 保留追问会话}
+    @staticmethod
+    def __reading_options(request: HttpRequest) -> tuple:
+        data = request.json()
+        question = data.get("question")
+        if not isinstance(question, str):
+            raise HttpError(400, "question is required")
+        try:
+            options = dict(a_mod=bool(data.get("a_mod", False)), card_select=int(data.get("card_select", 0)), spread_key=data.get("spread"), keep_session=bool(data.get("session", False)))
+        except (TypeError, ValueError):
+            raise HttpError(400, "invalid card_select")
+        return question, options
+
+    # 请求体: {"session_id": 占卜返回的会话id, "question": 追问}
+    @staticmethod
+    def __follow_up_options(request: HttpRequest) -> tuple:
+        data = request.json()
+        session_id, question = data.get("session_id"), data.get("question")
+        if not isinstance(session_id, str) or not isinstance(question, str):
+            raise HttpError(400, "session_id and question are required")
+        return session_id, question
+
+    async def __reading(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        question, options = self.__reading_options(request)
+        if self.tarot.is_busy:
+            return await self.__busy(writer, request.keep_alive)
+        return await self.__send_result(writer, await self.tarot.divination(question, **options), request.keep_alive)
+
+    async def __follow_up(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        session_id, question = self.__follow_up_options(request)
+        if self.tarot.is_busy:
+            return await self.__busy(writer, request.keep_alive)
+        return await self.__send_result(writer, await self.tarot.follow_up(session_id, question), request.keep_alive)
+
+    async def __send_result(self, writer: asyncio.StreamWriter, result: TarotContent, keep_alive: bool) -> bool:
+        if result.failure_reason == TarotFailure.BUSY:
+            return await self.__busy(writer, keep_alive)
+
+        status = 200 if result.is_complete else FAILURE_STATUS.get(result.failure_reason, 500)
+        return await self.__send_json(writer, status, self.__result_json(result), keep_alive=keep_alive)
+
+    # 事件: queued(排队位置), spread(牌阵与抽牌结果), sentence(一句解读), done(结束语与耗时), error(失败原因)
+    # 响应头发出后无法再改状态码, 排队超时等失败以error事件返回, 之后关闭连接
+    async def __reading_stream(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        question, options = self.__reading_options(request)
+        if self.tarot.is_busy:
+            return await self.__busy(writer, request.keep_alive)
+        return await self.__send_stream(writer, lambda result, on_queued: self.tarot.divination_stream(question, result=result, on_queued=on_queued, **options))
+
+    # 事件与/reading/stream相同, spread事件为占卜时的牌阵
+    async def __follow_up_stream(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        session_id, question = self.__follow_up_options(request)
+        if self.tarot.is_busy:
+            return await self.__busy(writer, request.keep_alive)
+        return await self.__send_stream(writer, lambda result, on_queued: self.tarot.follow_up_stream(session_id, question, result=result, on_queued=on_queued))
+
+    # factory(result, on_queued)返回逐句yield的流式占卜
+    async def __send_stream(self, writer: asyncio.StreamWriter, factory) -> bool:
+        writer.write(self.__head(200, {"Content-Type": "text/event-stream; charset=utf-8", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, keep_alive=False))
+        await writer.drain()
+
+        def on_queued(position: int):
+            self.__write_event(writer, "queued", {"position": position + 1})
+
+        result = TarotContent()
+        stream = factory(result, on_queued)
+        try:
+            is_first = True
+            async for sentence in stream:
+                if is_first:
+                    self.__write_event(writer, "spread", self.__spread_json(result))
+                    is_first = False
+                self.__write_event(writer, "sentence", {"text": sentence})
+                # 客户端断开时在这里抛出异常, 关闭stream会释放占卜位
+                await writer.drain()
+        finally:
+            await stream.aclose()
+
+        if result.is_complete:
+            if is_first:
+                self.__write_event(writer, "spread", self.__spread_json(result))
+            self.__write_event(writer, "done", {"complete_text": result.complete_text, "cached": result.cached, "session_id": result.session_id, "timings": result.timings})
+        else:
+            self.__write_event(writer, "error", {"reason": result.failure_reason, "text": result.failure_text})
+        await writer.drain()
+        return False
+
+    async def __image(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        card_keys = [key for key in request.query.get("cards", "").split(",") if key]
+        reversed_flags = [flag for flag in request.query.get("reversed", "").split(",") if flag]
+        is_reversed_list = [flag in ("1", "true") for flag in reversed_flags] or [False] * len(card_keys)
+        try:
+            tarot_info = TarotInfo.validated(self.tarot.store.snapshot, request.query.get("spread"), card_keys, is_reversed_list)
+        except ValueError as error:
+            raise HttpError(400, str(error))
+
+        image_format = request.query.get("format", "JPEG").upper()
+        tier = request.query.get("tier", "full")
+        if image_format not in IMAGE_TYPES or tier not in RENDER_TIERS:
+            raise HttpError(400, f"format is one of {', '.join(IMAGE_TYPES)}, tier is one of {', '.join(RENDER_TIERS)}")
+
+        image = await self.tarot_draw.draw(tarot_info, image_format=image_format, tier=tier)
+        writer.write(self.__head(200, {"Content-Type": IMAGE_TYPES[image_format], "Content-Length": str(len(image))}, request.keep_alive) + image)
+        await writer.drain()
+        return request.keep_alive
+
+    async def __health(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        scheduler = self.tarot.scheduler
+        backends = self.tarot.client.backends
+        data = {
+            "status": "ok" if any(backend.healthy for backend in backends) else "degraded",
+            "pid": os.getpid(),
+            "running": scheduler.running,
+            "queue_depth": scheduler.queue_depth,
+            "max_concurrency": scheduler.max_concurrency,
+            "max_queue": scheduler.max_queue,
+            "backends": [{"host": backend.host, "healthy": backend.healthy, "outstanding": backend.outstanding} for backend in backends],
+        }
+        return await self.__send_json(writer, 200 if data["status"] == "ok" else 503, data, keep_alive=request.keep_alive)
+
+    async def __metrics(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
+        payload = self.tarot.metrics.render().encode()
+        writer.write(self.__head(200, {"Content-Type": "text/plain; version=0.0.4", "Content-Length": str(len(payload))}, request.keep_alive) + payload)
+        await writer.drain()
+        return request.keep_alive
+
+    @staticmethod
+    def __spread_json(result: TarotContent) -> dict:
+        tarot_info = result.tarot_info
+        card_keys = list(tarot_info.card_keys) if tarot_info is not None else []
+        is_reversed_list = tarot_info.is_reversed_list if tarot_info is not None else []
+        data = {"spread": result.spread_key, "cards": card_keys, "is_reversed_list": is_reversed_list, "tarot_text": result.tarot_text}
+        if result.spread_key is not None:
+            data["image"] = "/image?" + urlencode({"spread": result.spread_key, "cards": ",".join(card_keys), "reversed": ",".join("1" if flag else "0" for flag in is_reversed_list)})
+        return data
+
+    @staticmethod
+    def __result_json(result: TarotContent) -> dict:
+        data = TarotServer.__spread_json(result)
+        data.update(
+            is_complete=result.is_complete,
+            result_texts=result.result_texts,
+            complete_text=result.complete_text,
+            cached=result.cached,
+            session_id=result.session_id,
+            failure_reason=result.failure_reason,
+            failure_text=result.failure_text,
+            timings=result.timings,
+        )
+        return data
+
+    @staticmethod
+    def __head(status: int, headers: dict, keep_alive: bool) -> bytes:
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    @staticmethod
+    async def __send_json(writer: asyncio.StreamWriter, status: int, data: dict, headers: dict = None, keep_alive: bool = True) -> bool:
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        headers = dict(headers or {}, **{"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(payload))})
+        writer.write(TarotServer.__head(status, headers, keep_alive) + payload)
+        await writer.drain()
+        return keep_alive
+
+    @staticmethod
+    def __write_event(writer: asyncio.StreamWriter, event: str, data: dict):
+        writer.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+# 一个工作进程: 创建Tarot并预热后开始接收请求
+async def run_worker(model: str, url, host: str, port: int, reuse_port: bool, warmup: bool = True):
+    tarot = Tarot(model, url)
+    tarot_draw = TarotDraw(RESOURCES_PATH)
+    if warmup:
+        await tarot.warmup(tarot_draw)
+    for client in tarot.clients:
+        client.start_health_checks()
+
+    server = await TarotServer(tarot, tarot_draw, host, port).start(reuse_port)
+    print(f"worker {os.getpid()} listening on {server.url}", flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        await tarot.close()
+        # 工作进程退出时不会执行atexit, 需要自己关闭绘制用的进程池
+        tarot_draw.executor.shutdown(cancel_futures=True)
+
+# SIGTERM与SIGINT都按KeyboardInterrupt处理, 让worker关闭连接池与绘制用的进程池后再退出
+# 只响应一次, 关闭过程中不再被打断
+def stop_worker(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+def worker_main(*args):
+    signal.signal(signal.SIGTERM, stop_worker)
+    signal.signal(signal.SIGINT, stop_worker)
+    try:
+        asyncio.run(run_worker(*args))
+    except KeyboardInterrupt:
+        pass
+
+# 启动workers个工作进程监听同一个端口, 系统不支持SO_REUSEPORT时只启动一个
+# 追问会话保存在各个进程中, 多进程时追问可能被分配到其他进程而找不到会话, 需要追问时只启动一个进程
+def serve(model: str, url, host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS, warmup: bool = True):
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("SO_REUSEPORT is not supported on this platform, starting a single worker")
+        workers = 1
+    if workers <= 1:
+        worker_main(model, url, host, port, False, warmup)
+        return
+
+    import multiprocessing
+    # 工作进程不能是daemon, daemon进程无法启动子进程(DRAW_EXECUTOR = "process"时的绘制进程池)
+    processes = [multiprocessing.Process(target=worker_main, args=(model, url, host, port, True, warmup)) for _ in range(workers)]
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # 主进程退出前结束并回收所有工作进程
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SERVER_SHUTDOWN_TIMEOUT
+        for process in processes:
+            if process.pid is not None:
+                process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+if __name__ == "__main__":
+    import argparse
+    from tarot import DEFAULT_CONNECT_URL
+
+    parser = argparse.ArgumentParser(description="塔罗占卜HTTP服务")
+    parser.add_argument("--model", required=True, help="模型名称")
+    parser.add_argument("--url", nargs="+", default=[DEFAULT_CONNECT_URL], help="Ollama地址, 可以有多个")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="工作进程数")
+    parser.add_argument("--no-warmup", action="store_true", help="启动时不预热模型")
+    args = parser.parse_args()
+
+    serve(args.model, args.url if len(args.url) > 1 else args.url[0], args.host, args.port, args.workers, not args.no_warmup)
@@ -0,0 +1,115 @@
+import sys, time, secrets, asyncio
+from collections import OrderedDict
+from tarot_backend import Affinity
+from tarot_deck import TarotInfo
+from tarot_config import SESSION_TTL, SESSION_MAX_COUNT, SESSION_MAX_BYTES
+
+class TarotSession:
+    """一次占卜之后的追问会话
+
+    保存抽到的牌阵与发给大模型的完整对话, 追问时在对话末尾加上新的问题.
+    affinity让追问发给解读时的主机, Ollama可以复用该主机上已计算的对话前缀, 只需计算新的问题
+    """
+    __slots__ = ("id", "spread_key", "tarot_text", "tarot_info", "a_mod", "messages", "affinity", "lock", "size", "turns", "created", "last_used")
+
+    def __init__(self, spread_key: str, tarot_text: str, tarot_info: TarotInfo, a_mod: bool, messages: list, affinity: Affinity = None):
+        self.id: str = secrets.token_urlsafe(12)
+        self.spread_key: str = spread_key
+        self.tarot_text: str = tarot_text
+        self.tarot_info: TarotInfo = tarot_info
+        self.a_mod: bool = a_mod
+        self.messages: list = messages # 发给大模型的对话, 包括大模型的回答
+        self.affinity: Affinity = affinity if affinity is not None else Affinity()
+        self.lock: asyncio.Lock = asyncio.Lock() # 同一个会话的追问依次进行, 保证对话顺序
+        self.size: int = self.measure(messages)
+        self.turns: int = 0 # 追问次数
+        self.created: float = time.monotonic()
+        self.last_used: float = self.created
+
+    def __repr__(self) -> str:
+        return f"TarotSession({self.id!r}, spread_key={self.spread_key!r}, turns={self.turns}, size={self.size})"
+
+    # 对话占用的内存(字节), 只计算文本
+    @staticmethod
+    def measure(messages: list) -> int:
+        return sum(sys.getsizeof(message["content"]) for message in messages)
+
+class SessionStore:
+    """进程内的追问会话
+
+    超过ttl秒没有追问的会话失效, 会话数超过max_count或总大小超过max_bytes时淘汰最久未使用的
+    """
+    def __init__(self, ttl: float = SESSION_TTL, max_count: int = SESSION_MAX_COUNT, max_bytes: int = SESSION_MAX_BYTES):
+        self.ttl: float = ttl
+        self.max_count: int = max_count
+        self.max_bytes: int = max_bytes
+        self.size: int = 0 # 全部会话的总大小
+        self.evicted: int = 0 # 因超出上限淘汰的会话数
+        self.expired: int = 0 # 超时失效的会话数
+        self._sessions: OrderedDict[str, TarotSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id, touch=False) is not None
+
+    def add(self, session: TarotSession) -> TarotSession:
+        self.purge()
+        self._sessions[session.id] = session
+        self.size += session.size
+        self.__evict()
+        return session
+
+    # 取出会话, 不存在或已失效时返回None, touch为True时续期
+    def get(self, session_id: str, touch: bool = True) -> TarotSession:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_used > self.ttl:
+            self.expired += 1
+            self.remove(session_id)
+            return None
+        if touch:
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    # 追问完成后把问题与回答加入对话
+    def append(self, session: TarotSession, *messages: dict):
+        session.messages.extend(messages)
+        added = TarotSession.measure(messages)
+        session.size += added
+        session.turns += 1
+        session.last_used = time.monotonic()
+        if self._sessions.get(session.id) is session:
+            self.size += added
+            self._sessions.move_to_end(session.id)
+            self.__evict()
+
+    def remove(self, session_id: str) -> TarotSession:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.size -= session.size
+        return session
+
+    # 清理失效的会话, 会话按最近使用排序, 从最久未使用的开始检查
+    def purge(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= deadline:
+                break
+            self.expired += 1
+            self.remove(session.id)
+
+    def clear(self):
+        self._sessions.clear()
+        self.size = 0
+
+    # 最新的会话即使单独超过max_bytes也保留
+    def __evict(self):
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_count or self.size > self.max_bytes):
+            self.remove(next(iter(self._sessions)))
+            self.evicted += 1
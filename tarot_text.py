@@ -0,0 +1,142 @@
+import re
+from tarot_config import REPLACE_STRING_TO_EMPTY, COLLAPSE_PUNCTUATION_LEADS, COLLAPSE_PUNCTUATION_FOLLOWS
+
+# emoji用到的全部非ASCII码位(包括ZWJ、变体选择符、肤色与旗帜标签), 合并为正则的字符集
+# ASCII的#、*与数字只在组成键帽emoji时出现, 保留它们
+def emoji_character_class() -> str:
+    import emoji
+    codepoints = sorted({ord(char) for sequence in emoji.EMOJI_DATA for char in sequence if ord(char) >= 0x80})
+
+    ranges = []
+    start = end = codepoints[0]
+    for codepoint in codepoints[1:]:
+        if codepoint == end + 1:
+            end = codepoint
+            continue
+        ranges.append((start, end))
+        start = end = codepoint
+    ranges.append((start, end))
+
+    return "[" + "".join(f"\\U{start:08x}" if start == end else f"\\U{start:08x}-\\U{end:08x}" for start, end in ranges) + "]"
+
+class TextCleaner:
+    """编译好的单遍文本清洗
+
+    去掉的词、emoji与重复标点合并为一个正则, 一次sub完成全部替换(全部替换为空):
+    每个分支都以确定的字符开头, 正则可以按首字符快速跳过无关文本;
+    重复标点与去掉的词/emoji用后顾判断前一个字符是否为标点, 是则连同其后的重复标点一起去掉.
+    只去掉原文中的词: 去掉一个词后前后文字拼成的新词不会再被去掉(例如"综上其次所述"只去掉"其次"),
+    旧的逐词replace会继续去掉这类新词; 除此之外(词之间互不重叠时)结果与先逐词去掉再合并标点相同
+
+    stream()用于流式输出, 分片清洗的结果与一次性清洗相同.
+    正则在第一次使用时才编译, emoji的字符集需要导入emoji, 不拖慢启动
+    """
+    def __init__(self, remove_words: tuple = (), emojis: bool = False, collapse_punctuation: bool = True, leads: str = COLLAPSE_PUNCTUATION_LEADS, follows: str = COLLAPSE_PUNCTUATION_FOLLOWS):
+        self.remove_words: tuple = tuple(remove_words)
+        self.emojis: bool = emojis
+        self.collapse_punctuation: bool = collapse_punctuation
+        self.leads: str = leads
+        self.follows: str = follows
+        # 流式时保留的末尾长度, 保证保留部分之前的匹配不会再因后续片段改变
+        self.holdback: int = max([len(word) for word in remove_words] + [1])
+        self._pattern: re.Pattern = None
+
+    @property
+    def pattern(self) -> re.Pattern:
+        if self._pattern is None:
+            self._pattern = self.__compile()
+        return self._pattern
+
+    def __compile(self) -> re.Pattern:
+        emojis, leads, follows = self.emojis, self.leads, self.follows
+        # 长词在前, 避免短词先匹配
+        removes = [re.escape(word) for word in sorted(set(self.remove_words), key=len, reverse=True) if word]
+
+        if not self.collapse_punctuation:
+            if emojis:
+                removes.append(emoji_character_class() + "+")
+            alternatives = removes
+        else:
+            # 后顾需要固定宽度, emoji逐个字符匹配
+            if emojis:
+                removes.append(emoji_character_class())
+            lead = "[" + re.escape(leads) + "]"
+            run = "(?:" + "|".join(["[" + re.escape(follows) + "]"] + removes) + ")"
+            # 紧跟在标点后的重复标点, 以及之后连续的重复标点
+            alternatives = [f"{re.escape(char)}(?<={lead}{re.escape(char)}){run}*" for char in dict.fromkeys(follows)]
+            # 去掉的词, 若紧跟在标点后则连同之后连续的重复标点
+            alternatives += [f"{remove}(?:(?<={lead}{remove}){run}*)?" for remove in removes]
+
+        # 全部关闭时不匹配任何内容
+        return re.compile("|".join(alternatives) or r"(?!)")
+
+    def clean(self, text: str) -> str:
+        return self.pattern.sub("", text)
+
+    def stream(self) -> "TextStream":
+        return TextStream(self)
+
+class TextStream:
+    """一次流式输出的清洗状态
+
+    末尾可能还会继续匹配的部分留到下一个片段再处理,
+    buffer开头保留上一段的最后一个原始字符, 供后顾判断
+    """
+    __slots__ = ("cleaner", "pattern", "buffer", "start")
+
+    def __init__(self, cleaner: TextCleaner):
+        self.cleaner: TextCleaner = cleaner
+        self.pattern: re.Pattern = cleaner.pattern
+        self.buffer: str = ""
+        self.start: int = 0 # buffer中待清洗部分的起点
+
+    # 喂入一个片段, 返回已经确定的清洗结果
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        cut = len(self.buffer) - self.cleaner.holdback
+        if cut <= self.start:
+            return ""
+
+        buffer = self.buffer
+        # 大多数片段中没有需要去掉的内容
+        match = self.pattern.search(buffer, self.start)
+        if match is None or match.start() >= cut:
+            text, self.buffer, self.start = buffer[self.start:cut], buffer[cut - 1:], 1
+            return text
+
+        parts = []
+        last = self.start
+        for match in self.pattern.finditer(buffer, self.start):
+            if match.end() > cut:
+                # 跨过切分点的匹配整体留到下一次
+                if match.start() < cut:
+                    cut = match.start()
+                break
+            parts.append(buffer[last:match.start()])
+            last = match.end()
+        if cut <= self.start:
+            return ""
+        parts.append(buffer[last:cut])
+
+        self.buffer, self.start = buffer[cut - 1:], 1
+        return "".join(parts)
+
+    # 输出结束, 返回剩余部分的清洗结果
+    def flush(self) -> str:
+        buffer, start = self.buffer, self.start
+        self.buffer, self.start = "", 0
+
+        parts = []
+        last = start
+        for match in self.pattern.finditer(buffer, start):
+            parts.append(buffer[last:match.start()])
+            last = match.end()
+        parts.append(buffer[last:])
+        return "".join(parts)
+
+# 用户提问: 只去掉emoji
+message_cleaner = TextCleaner(emojis=True, collapse_punctuation=False)
+# 大模型的解读: 去AI味并合并重复标点
+reading_cleaner = TextCleaner(REPLACE_STRING_TO_EMPTY)
+# 只合并重复标点
+punctuation_cleaner = TextCleaner()